@@ -0,0 +1,272 @@
+# ann_index.py - Inverted-file (IVF) approximate nearest-neighbor index in NumPy
+import json
+import math
+import threading
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# k-means sample size per centroid; more adds training time, not much recall
+TRAIN_POINTS_PER_CELL = 64
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the top_k scores, best first, without a full sort"""
+    if top_k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+    """Nearest centroid (by inner product) of each vector, in bounded-memory batches"""
+    if not len(vectors):
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate([
+        np.argmax(vectors[start:start + batch_size] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), batch_size)
+    ])
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means: unit-length centroids that maximize inner product"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        cells = assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, cells, vectors)
+        # Empty cells restart from random vectors instead of going to waste
+        empty = np.bincount(cells, minlength=k) == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = (sums / np.where(norms > 0, norms, 1.0)).astype(np.float32)
+    return centroids
+
+class InvertedList:
+    """Growable float32 vectors and their ids for one k-means cell"""
+
+    def __init__(self, dim: int, capacity: int = 16):
+        self.vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray) -> int:
+        """Add rows and return the position of the first one"""
+        needed = self.size + len(ids)
+        if needed > len(self.ids):
+            capacity = max(needed, 2 * len(self.ids))
+            grown = np.empty((capacity, self.vectors.shape[1]), dtype=np.float32)
+            grown[:self.size] = self.vectors[:self.size]
+            self.vectors = grown
+            self.ids = np.resize(self.ids, capacity)
+        start = self.size
+        self.vectors[start:needed] = vectors
+        self.ids[start:needed] = ids
+        self.size = needed
+        return start
+
+class IVFIndex:
+    """Inner-product search that scans only the nprobe nearest k-means cells
+
+    Vectors are expected to be unit length, so scores are cosine
+    similarities. Until train_size vectors have been added everything sits
+    in one list that is scanned exhaustively; the index then trains nlist
+    centroids (about sqrt(n) unless given) on a sample of at most
+    TRAIN_POINTS_PER_CELL vectors per cell, and later adds go straight into
+    their nearest cell. Deletes are tombstones, compacted once they
+    reach a quarter of the stored rows. Raising nprobe trades latency for
+    recall.
+    """
+
+    def __init__(self, dim: int, nlist: Optional[int] = None, nprobe: int = 8,
+                 train_size: int = 20000, seed: int = 0):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.seed = seed
+        self.lock = threading.RLock()
+        self.centroids = None
+        self.lists = []
+        # Vectors added before training
+        self.pending = InvertedList(dim)
+        # Internal id -> key (None once deleted), and where its row lives
+        self.keys = []
+        self.key_to_id = {}
+        self.cell_of = np.empty(0, dtype=np.int32)
+        self.position_of = np.empty(0, dtype=np.int64)
+        self.tombstones = 0
+
+    def __len__(self) -> int:
+        return len(self.key_to_id)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.key_to_id
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def add(self, keys: Sequence[Hashable], vectors: np.ndarray):
+        """Insert vectors under keys, replacing any stored under the same keys"""
+        keys = list(keys)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(keys), self.dim)
+        with self.lock:
+            self.delete([key for key in keys if key in self.key_to_id])
+            ids = np.arange(len(self.keys), len(self.keys) + len(keys), dtype=np.int64)
+            self.keys.extend(keys)
+            self.key_to_id.update(zip(keys, ids.tolist()))
+            if len(self.keys) > len(self.cell_of):
+                capacity = max(len(self.keys), 2 * len(self.cell_of))
+                self.cell_of = np.resize(self.cell_of, capacity)
+                self.position_of = np.resize(self.position_of, capacity)
+
+            if self.trained:
+                self._append(ids, vectors)
+            else:
+                self._place(-1, ids, self.pending.append(ids, vectors))
+                if self.pending.size >= self.train_size:
+                    self.train()
+
+    def delete(self, keys: Sequence[Hashable]) -> int:
+        """Forget keys; their rows are skipped until the next compaction"""
+        with self.lock:
+            removed = 0
+            for key in keys:
+                internal_id = self.key_to_id.pop(key, None)
+                if internal_id is not None:
+                    self.keys[internal_id] = None
+                    removed += 1
+            self.tombstones += removed
+            if self.tombstones * 4 > len(self.key_to_id) + self.tombstones:
+                self.compact()
+            return removed
+
+    def train(self, nlist: Optional[int] = None, iterations: int = 10):
+        """(Re)build centroids from every stored vector and redistribute them"""
+        with self.lock:
+            self.compact()
+            cells = self.lists + [self.pending]
+            ids = np.concatenate([cell.ids[:cell.size] for cell in cells])
+            if not len(ids):
+                return
+            vectors = np.concatenate([cell.vectors[:cell.size] for cell in cells])
+            self.nlist = max(1, min(nlist or self.nlist or int(math.sqrt(len(ids))), len(ids)))
+            sample = vectors
+            if len(vectors) > self.nlist * TRAIN_POINTS_PER_CELL:
+                rng = np.random.default_rng(self.seed)
+                sample = vectors[rng.choice(len(vectors), size=self.nlist * TRAIN_POINTS_PER_CELL, replace=False)]
+            self.centroids = kmeans(sample, self.nlist, iterations=iterations, seed=self.seed)
+            self.lists = [InvertedList(self.dim) for _ in range(self.nlist)]
+            self.pending = InvertedList(self.dim)
+            self._append(ids, vectors)
+
+    def search(self, query: np.ndarray, top_k: int = 10,
+               nprobe: Optional[int] = None) -> List[Tuple[Hashable, float]]:
+        """Approximate best (key, score) pairs, best first"""
+        query = np.asarray(query, dtype=np.float32)
+        with self.lock:
+            if self.trained:
+                probe = top_k_indices(self.centroids @ query, min(nprobe or self.nprobe, self.nlist))
+                cells = [self.lists[cell] for cell in probe]
+            else:
+                cells = [self.pending]
+            cells = [cell for cell in cells if cell.size]
+            if not cells:
+                return []
+            scores = np.concatenate([cell.vectors[:cell.size] @ query for cell in cells])
+            ids = np.concatenate([cell.ids[:cell.size] for cell in cells])
+            keys = self.keys
+            if self.tombstones:
+                live = np.fromiter((keys[i] is not None for i in ids.tolist()), dtype=bool, count=len(ids))
+                scores, ids = scores[live], ids[live]
+            return [(keys[ids[i]], float(scores[i])) for i in top_k_indices(scores, top_k)]
+
+    def get_vectors(self, keys: Sequence[Hashable]) -> np.ndarray:
+        """Stored vectors for keys, one row per key"""
+        with self.lock:
+            ids = np.array([self.key_to_id[key] for key in keys], dtype=np.int64)
+            result = np.empty((len(ids), self.dim), dtype=np.float32)
+            for row, (cell, position) in enumerate(zip(self.cell_of[ids].tolist(), self.position_of[ids].tolist())):
+                result[row] = (self.lists[cell] if cell >= 0 else self.pending).vectors[position]
+            return result
+
+    def compact(self):
+        """Drop tombstoned rows from every cell"""
+        with self.lock:
+            if not self.tombstones:
+                return
+            keys = self.keys
+            for number, cell in enumerate(self.lists + [self.pending]):
+                ids = cell.ids[:cell.size]
+                live = np.fromiter((keys[i] is not None for i in ids.tolist()), dtype=bool, count=len(ids))
+                kept = int(live.sum())
+                cell.vectors[:kept] = cell.vectors[:cell.size][live]
+                cell.ids[:kept] = ids[live]
+                cell.size = kept
+                self._place(number if number < len(self.lists) else -1, cell.ids[:kept], 0)
+            self.tombstones = 0
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'vectors': len(self.key_to_id),
+                'trained': self.trained,
+                'nlist': self.nlist if self.trained else 0,
+                'nprobe': self.nprobe,
+                'untrained_vectors': self.pending.size,
+                'largest_cell': max((cell.size for cell in self.lists), default=0),
+                'tombstones': self.tombstones
+            }
+
+    def save(self, path: str):
+        """Write centroids, cells and keys to one .npz file"""
+        with self.lock:
+            self.compact()
+            cells = self.lists + [self.pending]
+            meta = {'dim': self.dim, 'nlist': self.nlist, 'nprobe': self.nprobe,
+                    'train_size': self.train_size, 'seed': self.seed}
+            np.savez(
+                path,
+                meta=np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8),
+                keys=np.frombuffer(json.dumps(self.keys).encode('utf-8'), dtype=np.uint8),
+                centroids=self.centroids if self.trained else np.zeros((0, self.dim), dtype=np.float32),
+                sizes=np.array([cell.size for cell in cells], dtype=np.int64),
+                ids=np.concatenate([cell.ids[:cell.size] for cell in cells]),
+                vectors=np.concatenate([cell.vectors[:cell.size] for cell in cells])
+            )
+
+    @classmethod
+    def load(cls, path: str) -> 'IVFIndex':
+        with np.load(path) as data:
+            meta = json.loads(data['meta'].tobytes())
+            index = cls(meta['dim'], nlist=meta['nlist'], nprobe=meta['nprobe'],
+                        train_size=meta['train_size'], seed=meta['seed'])
+            # JSON stores tuple keys as lists
+            index.keys = [tuple(key) if isinstance(key, list) else key for key in json.loads(data['keys'].tobytes())]
+            index.key_to_id = {key: i for i, key in enumerate(index.keys) if key is not None}
+            index.cell_of = np.empty(len(index.keys), dtype=np.int32)
+            index.position_of = np.empty(len(index.keys), dtype=np.int64)
+            sizes, ids, vectors = data['sizes'], data['ids'], data['vectors']
+            if len(data['centroids']):
+                index.centroids = data['centroids']
+                index.lists = [InvertedList(index.dim) for _ in range(len(sizes) - 1)]
+            offsets = np.concatenate([[0], np.cumsum(sizes)])
+            for number, cell in enumerate(index.lists + [index.pending]):
+                start, end = offsets[number], offsets[number + 1]
+                cell.append(ids[start:end], vectors[start:end])
+                index._place(number if number < len(index.lists) else -1, ids[start:end], 0)
+        return index
+
+    def _append(self, ids: np.ndarray, vectors: np.ndarray):
+        """Route rows to their nearest cells; lock held"""
+        cells = assign(vectors, self.centroids)
+        order = np.argsort(cells, kind='stable')
+        bounds = np.searchsorted(cells[order], np.arange(self.nlist + 1))
+        for cell in np.flatnonzero(np.diff(bounds)).tolist():
+            rows = order[bounds[cell]:bounds[cell + 1]]
+            self._place(cell, ids[rows], self.lists[cell].append(ids[rows], vectors[rows]))
+
+    def _place(self, cell: int, ids: np.ndarray, start: int):
+        """Record that ids occupy consecutive rows of a cell (-1: untrained list)"""
+        self.cell_of[ids] = cell
+        self.position_of[ids] = np.arange(start, start + len(ids))
@@ -1,30 +1,83 @@
 # app.py - AskDocAI Backend Framework
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
-import PyPDF2
-import tempfile
-import os
 import uuid
+import json
+import hashlib
+import math
+import os
+import time
+import atexit
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import requests
 from simple_rag import SimplifiedRAG
+from ollama_client import OllamaClient, OllamaOverloaded
+from dense_index import DenseIndex, EmbeddingCache, HybridRetriever, EMBED_MODEL, RETRIEVAL_MODES
+from index_segments import SegmentIndex
+from llm_cache import ResponseCache, is_deterministic
+from single_flight import SingleFlight
+from context_packer import ContextPacker
+from doc_store import DocumentStore
+import pdf_extract
+from ingest_jobs import JobQueue, IngestError
+import summarize
+from text_normalize import clean_pdf_text
+from url_fetch import PageCache, FetchError, fetch_page
+import stage_metrics
+from stage_metrics import timed
 
 app = Flask(__name__)
 CORS(app, origins=['*'])
 
-# In-memory storage for demo
-documents = {}
+# Persistent document storage with an in-memory working set
+documents = DocumentStore.from_env()
 
 metrics = {
     'total_uploads': 0,
     'total_summaries': 0,
     'total_questions': 0,
-    'avg_response_time': []
+    'duplicate_uploads': 0
 }
 
-# Initialize RAG system
+# Whole-request latency per endpoint; pipeline stages live in stage_metrics
+request_timings = stage_metrics.StageTimings()
+ANSWER_ENDPOINTS = ('ask_question', 'summarize_document', 'ask_batch')
+
+@app.before_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    stage_metrics.start_request()
+
+@app.after_request
+def add_server_timing(response):
+    """Record request latency and report its stage timings in Server-Timing"""
+    elapsed = time.perf_counter() - g.request_start
+    request_timings.observe(request.endpoint or 'unmatched', elapsed)
+    response.headers['Server-Timing'] = stage_metrics.server_timing(stage_metrics.request_stages() or {}, elapsed)
+    response.headers['Timing-Allow-Origin'] = '*'
+    return response
+
+# Background workers for uploads and URL imports. A shared store also holds
+# job state, so a status poll can land on any worker process.
+ingest_jobs = JobQueue.from_env(store=documents if documents.shared else None)
+
+# Fetched web pages with their ETag/Last-Modified, for conditional re-imports
+page_cache = PageCache.from_env()
+
+# Initialize RAG system. With RAG_SEGMENTS_PATH set, postings live in
+# memory-mapped segment files that every worker process shares.
+rag_segments = None
 try:
-    rag = SimplifiedRAG()
+    rag_segments = SegmentIndex.from_env()
+    rag = SimplifiedRAG(store=documents, max_documents=documents.max_cached, segments=rag_segments)
+    rag.load_from_store()
+    # Contents stored without an index (e.g. after a store migration)
+    for content_hash in documents.unindexed_contents():
+        rag.index_document(content_hash, documents.get_content(content_hash)['content'])
+    if rag_segments:
+        rag_segments.start()
     RAG_AVAILABLE = True
 except Exception as e:
     print(f"RAG initialization failed: {e}")
@@ -33,58 +86,159 @@ except Exception as e:
     
 # Ollama configuration
 OLLAMA_MODEL = "qwen2.5:0.5b"
+OLLAMA_OPTIONS = {
+    'temperature': 0.3,
+    'top_p': 0.9,
+    'top_k': 40,
+    'seed': 42,
+    'num_predict': 250
+}
+
+# Shared client: pooled connections, capped concurrency, bounded wait queue
+ollama = OllamaClient.from_env(model=OLLAMA_MODEL)
+
+# Fixed seed makes generations repeatable, so responses are cached by prompt
+llm_cache = ResponseCache.from_env()
+
+# ...and identical generations already under way are shared, not repeated
+flights = SingleFlight.from_env()
+
+# Retrieved excerpts are merged, deduplicated and trimmed to the model's token budget
+context_packer = ContextPacker.from_env()
+
+def pack_context(passages, question):
+    """Pack (source, text) excerpts for the answer model's budget"""
+    with timed('pack'):
+        return context_packer.pack(passages, question, context_packer.budget_for(OLLAMA_MODEL, OLLAMA_OPTIONS))
+
+# Optional dense retrieval: chunk embeddings from Ollama, cached by chunk hash.
+# With DENSE_RETRIEVAL=1 chunks are embedded at upload; otherwise the first
+# dense query queues a background job for the documents not embedded yet,
+# and answers lexically (or from the embedded documents) until it is done.
+DENSE_AT_INDEX = os.environ.get('DENSE_RETRIEVAL', '0') not in ('', '0', 'false')
+dense_index = DenseIndex(lambda texts: ollama.embed(texts, EMBED_MODEL), cache=EmbeddingCache.from_env())
+retriever = HybridRetriever(rag, dense_index, submit=lambda work: ingest_jobs.submit('embed', work)) if rag else None
 
-def call_ollama(prompt):
+# Large corpora search dense vectors through an IVF index, saved on exit and
+# reloaded here so a restart does not re-read every embedding. Worker
+# processes sharing a store would overwrite each other's file, so they skip
+# it and get their vectors back from the shared embedding cache instead.
+ANN_INDEX_PATH = os.environ.get('ANN_INDEX_PATH',
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'ann_index.npz'))
+if ANN_INDEX_PATH and documents.shared:
+    print("Shared document store: not loading or saving the ANN index file")
+    ANN_INDEX_PATH = ''
+if ANN_INDEX_PATH:
+    if os.path.exists(ANN_INDEX_PATH):
+        try:
+            dense_index.load_ann(ANN_INDEX_PATH)
+            # Forget documents that are no longer in the store
+            for content_hash in list(dense_index.ann_sizes):
+                if not (rag and content_hash in rag):
+                    dense_index.remove_document(content_hash)
+        except Exception as e:
+            print(f"Loading ANN index failed: {e}")
+    atexit.register(dense_index.save_ann, ANN_INDEX_PATH)
+
+def call_ollama(prompt, use_cache=True):
     """Call Ollama API to generate response"""
+    cacheable = use_cache and is_deterministic(OLLAMA_OPTIONS)
+    if cacheable:
+        cached = llm_cache.get(OLLAMA_MODEL, OLLAMA_OPTIONS, prompt)
+        if cached is not None:
+            return cached
+    
+    def generate():
+        response = ollama.generate(prompt, OLLAMA_OPTIONS)
+        if cacheable and response:
+            llm_cache.put(OLLAMA_MODEL, OLLAMA_OPTIONS, prompt, response)
+        return response
+    
+    # Concurrent identical prompts wait for one generation
     try:
-        response = requests.post(
-            'http://localhost:11434/api/generate',
-            json={
-                'model': OLLAMA_MODEL,
-                'prompt': prompt,
-                'stream': False,
-                'options': {
-                    'temperature': 0.3,
-                    'top_p': 0.9,
-                    'top_k': 40,
-                    'seed': 42,
-                    'num_predict': 250
-                }
-            },
-            timeout=30
-        )
-        if response.status_code == 200:
-            return response.json().get('response', '')
+        with timed('llm'):
+            return flights.run(flights.key(OLLAMA_MODEL, OLLAMA_OPTIONS, prompt, use_cache), generate)
+    except OllamaOverloaded:
+        raise
     except Exception as e:
         print(f"Ollama error: {e}")
         return None
 
-# Test Ollama connection
-def check_ollama():
-    try:
-        response = requests.get('http://localhost:11434/api/tags')
-        if response.status_code == 200:
-            return True
-    except:
+def cache_allowed(data):
+    """Requests opt out of the response cache with no_cache or Cache-Control"""
+    if data.get('no_cache'):
         return False
-    return False
+    return 'no-cache' not in request.headers.get('Cache-Control', '')
 
-OLLAMA_AVAILABLE = check_ollama()
-print(f"Ollama status: {'Available' if OLLAMA_AVAILABLE else 'Not Available'}")
+def stream_ollama(prompt):
+    """Call Ollama API and return an iterator of response tokens"""
+    return ollama.stream(prompt, OLLAMA_OPTIONS)
+
+def overloaded_response(error):
+    """503 response telling the client when to retry"""
+    response = jsonify({'error': 'Model is busy, please retry shortly', 'retry_after': error.retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def sse_event(data, event=None):
+    """Format a Server-Sent Event carrying a JSON payload"""
+    message = f"event: {event}\n" if event else ''
+    return message + f"data: {json.dumps(data)}\n\n"
 
-def chunk_document(content, chunk_size=1000, overlap=200):
-    """Split document into overlapping chunks for better context"""
-    chunks = []
-    start = 0
-    text_length = len(content)
+def stream_generation(prompt, on_complete, use_cache=True):
+    """Relay streamed tokens as SSE and hand the full text to on_complete"""
+    cacheable = use_cache and is_deterministic(OLLAMA_OPTIONS)
+    cached = llm_cache.get(OLLAMA_MODEL, OLLAMA_OPTIONS, prompt) if cacheable else None
     
-    while start < text_length:
-        end = start + chunk_size
-        chunk = content[start:end]
-        chunks.append(chunk)
-        start = end - overlap  # Overlap for context continuity
+    # Admission happens here so overload surfaces as a 503 before streaming;
+    # an identical stream already running is shared instead, and whoever
+    # finishes it caches the text even if the leading client left early
+    tokens = None
+    if cached is None:
+        store = (lambda text: llm_cache.put(OLLAMA_MODEL, OLLAMA_OPTIONS, prompt, text)) if cacheable else None
+        tokens, _ = flights.stream(flights.key(OLLAMA_MODEL, OLLAMA_OPTIONS, prompt, use_cache),
+                                   lambda: stream_ollama(prompt), on_complete=store)
+    
+    def generate():
+        if cached is not None:
+            yield sse_event({'token': cached})
+            yield sse_event(on_complete(cached), event='done')
+            return
+        
+        parts = []
+        start = time.perf_counter()
+        try:
+            for token in tokens:
+                parts.append(token)
+                yield sse_event({'token': token})
+        except Exception as e:
+            print(f"Ollama stream error: {e}")
+            yield sse_event({'error': 'Generation failed'}, event='error')
+            return
+        finally:
+            tokens.close()
+            # Headers are long gone, so this only reaches the histogram
+            stage_metrics.record('llm', time.perf_counter() - start)
         
-    return chunks
+        text = ''.join(parts)
+        if not text:
+            yield sse_event({'error': 'Empty response from model'}, event='error')
+            return
+        yield sse_event(on_complete(text), event='done')
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Test Ollama connection
+def check_ollama():
+    return ollama.check()
+
+OLLAMA_AVAILABLE = check_ollama()
+print(f"Ollama status: {'Available' if OLLAMA_AVAILABLE else 'Not Available'}")
 
 @app.route('/')
 def home():
@@ -108,40 +262,11 @@ def upload_document():
         if not file.filename.lower().endswith('.pdf'):
             return jsonify({'error': 'Only PDF files are supported'}), 400
         
-        # Extract content from PDF
-        content = extract_pdf_content(file)
-        
-        if not content:
-            return jsonify({'error': 'Could not extract text from PDF'}), 400
-        
-        # Generate document ID
-        document_id = str(uuid.uuid4())
-        
-        # Store document data
-        documents[document_id] = {
-            'id': document_id,
-            'filename': file.filename,
-            'content': content,
-            'content_length': len(content),
-            'created_at': datetime.now().isoformat(),
-            'summary': None,
-            'qa_history': []
-        }
-
-        # Index document with RAG
-        if RAG_AVAILABLE and rag:
-            rag.index_document(document_id, content)
-            print(f"Document {document_id[:8]} indexed in RAG system")
+        filename = file.filename
+        data, content_hash = read_upload(file)
         
-        metrics['total_uploads'] += 1
-
-        return jsonify({
-            'document_id': document_id,
-            'message': 'PDF uploaded and processed successfully',
-            'filename': file.filename,
-            'content_length': len(content),
-            'content_preview': content[:200] + '...' if len(content) > 200 else content
-        }), 201
+        return run_ingestion('pdf', lambda progress: ingest_pdf(filename, data, content_hash, progress),
+                             filename=filename, content_hash=content_hash)
         
     except Exception as e:
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
@@ -150,9 +275,6 @@ def upload_document():
 def upload_from_url():
     """Extract content from web URL"""
     try:
-        from urllib.parse import urlparse
-        import re
-        
         data = request.json
         url = data.get('url')
         
@@ -163,65 +285,173 @@ def upload_from_url():
         if not url.startswith(('http://', 'https://')):
             url = 'https://' + url
         
-        # Fetch webpage content
-        response = requests.get(url, timeout=10, headers={
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
-        
-        if response.status_code != 200:
-            return jsonify({'error': f'Failed to fetch URL: {response.status_code}'}), 400
+        return run_ingestion('web', lambda progress: ingest_url(url, progress), url=url)
         
-        # Simple HTML text extraction
-        text = response.text
-        # Remove script and style elements
-        text = re.sub(r'<script[^>]*>.*?</script>', '', text, flags=re.DOTALL)
-        text = re.sub(r'<style[^>]*>.*?</style>', '', text, flags=re.DOTALL)
-        # Remove HTML tags
-        text = re.sub('<[^<]+?>', ' ', text)
-        # Clean whitespace
-        text = re.sub(r'\s+', ' ', text)
-        text = text.strip()
+    except Exception as e:
+        return jsonify({'error': f'Failed to extract web content: {str(e)}'}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Report status and progress of an ingestion job"""
+    job = ingest_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job), 200
+
+def run_ingestion(kind, work, **details):
+    """Queue ingestion work and return 202, or run it inline with ?sync=1"""
+    if request.args.get('sync') not in (None, '', '0', 'false'):
+        try:
+            return jsonify(work(lambda **fields: None)), 201
+        except IngestError as e:
+            return jsonify({'error': str(e)}), 400
+        except requests.Timeout:
+            return jsonify({'error': 'URL request timed out'}), 408
+    
+    job_id = ingest_jobs.submit(kind, work, **details)
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/api/jobs/{job_id}',
+        'message': 'Upload accepted for processing'
+    }), 202
+
+def read_upload(file, block_size=1 << 20):
+    """Read an upload into memory, hashing it as it streams in"""
+    hasher = hashlib.sha256()
+    blocks = []
+    while True:
+        block = file.stream.read(block_size)
+        if not block:
+            break
+        hasher.update(block)
+        blocks.append(block)
+    return b''.join(blocks), hasher.hexdigest()
+
+def index_content(content_hash, content, progress):
+    """Index extracted text with RAG under its content hash"""
+    if RAG_AVAILABLE and rag:
+        rag.index_document(
+            content_hash, content,
+            progress=lambda done, total: progress(chunks_indexed=done, total_chunks=total)
+        )
+        print(f"Content {content_hash[:8]} indexed in RAG system")
+        if DENSE_AT_INDEX:
+            # Embedding failures leave the document searchable lexically
+            try:
+                with timed('embed'):
+                    dense_index.add_document(content_hash, rag.chunk_texts(content_hash))
+                progress(embedded=True)
+            except Exception as e:
+                print(f"Embedding content {content_hash[:8]} failed: {e}")
+
+def ingest_pdf(filename, data, content_hash, progress):
+    """Extract, store and index an uploaded PDF"""
+    # Identical bytes were ingested before: reuse the text and index
+    stored = documents.get_content(content_hash)
+    if stored:
+        content = stored['content']
+        metrics['duplicate_uploads'] += 1
+        progress(deduplicated=True)
+    else:
+        # Extract content from PDF
+        content = extract_pdf_content(
+            data,
+            lambda done, total: progress(pages_extracted=done, total_pages=total)
+        )
         
-        if not text or len(text) < 100:
-            return jsonify({'error': 'Could not extract enough text from URL'}), 400
-        
-        # Create document entry
-        document_id = str(uuid.uuid4())
-        domain = urlparse(url).netloc
-        
-        documents[document_id] = {
-            'id': document_id,
-            'filename': f"Web: {domain}",
-            'content': text[:10000],  # Limit to 10000 chars
-            'content_length': len(text),
-            'created_at': datetime.now().isoformat(),
-            'summary': None,
-            'qa_history': [],
-            'source_type': 'web',
-            'source_url': url
-        }
-        
-        # Index with RAG if available
-        if RAG_AVAILABLE and rag:
-            rag.index_document(document_id, text[:10000])
-            print(f"Web content {document_id[:8]} indexed in RAG system")
+        if not content:
+            raise IngestError('Could not extract text from PDF')
         
-        # Update metrics
-        metrics['total_uploads'] += 1
+        documents.add_content(content_hash, content)
+        index_content(content_hash, content, progress)
+    
+    # Generate document ID
+    document_id = str(uuid.uuid4())
+    
+    # Store document data
+    documents.add({
+        'id': document_id,
+        'filename': filename,
+        'content_hash': content_hash,
+        'content_length': len(content),
+        'created_at': datetime.now().isoformat(),
+        'summary': None
+    })
+    
+    metrics['total_uploads'] += 1
+    
+    return {
+        'document_id': document_id,
+        'message': 'PDF uploaded and processed successfully',
+        'filename': filename,
+        'content_length': len(content),
+        'content_preview': content[:200] + '...' if len(content) > 200 else content,
+        'deduplicated': stored is not None
+    }
+
+def ingest_url(url, progress):
+    """Fetch, store and index the text of a web page"""
+    from urllib.parse import urlparse
+    
+    # Stream the page into the extractor, revalidating any cached copy
+    try:
+        with timed('fetch'):
+            page = fetch_page(url, cache=page_cache, progress=progress)
+    except requests.Timeout:
+        raise IngestError('URL request timed out')
+    except FetchError as e:
+        raise IngestError(str(e))
+    
+    content_hash = page['content_hash']
+    progress(not_modified=page['not_modified'], truncated=page['truncated'])
+    stored = documents.get_content(content_hash)
+    if stored:
+        text = stored['content']
+        content_length = stored['content_length']
+        metrics['duplicate_uploads'] += 1
+        progress(deduplicated=True)
+    else:
+        text = page['text']
         
-        return jsonify({
-            'document_id': document_id,
-            'message': 'Web content extracted successfully',
-            'url': url,
-            'domain': domain,
-            'content_length': len(text),
-            'content_preview': text[:200] + '...' if len(text) > 200 else text
-        }), 201
+        if not text or len(text) < 100:
+            raise IngestError('Could not extract enough text from URL')
         
-    except requests.Timeout:
-        return jsonify({'error': 'URL request timed out'}), 408
-    except Exception as e:
-        return jsonify({'error': f'Failed to extract web content: {str(e)}'}), 500
+        content_length = len(text)
+        documents.add_content(content_hash, text, content_length)
+        index_content(content_hash, text, progress)
+    
+    # Create document entry
+    document_id = str(uuid.uuid4())
+    domain = urlparse(url).netloc
+    
+    documents.add({
+        'id': document_id,
+        'filename': f"Web: {domain}",
+        'content_hash': content_hash,
+        'content_length': content_length,
+        'created_at': datetime.now().isoformat(),
+        'summary': None,
+        'source_type': 'web',
+        'source_url': url
+    })
+    
+    # Update metrics
+    metrics['total_uploads'] += 1
+    
+    return {
+        'document_id': document_id,
+        'message': 'Web content extracted successfully',
+        'url': url,
+        'domain': domain,
+        # Characters kept, which is less than the page when truncated
+        'content_length': content_length,
+        'source_bytes': page['source_bytes'],
+        'content_preview': text[:200] + '...' if len(text) > 200 else text,
+        'deduplicated': stored is not None,
+        'not_modified': page['not_modified'],
+        'truncated': page['truncated']
+    }
 
 @app.route('/api/summarize', methods=['POST'])
 def summarize_document():
@@ -233,37 +463,157 @@ def summarize_document():
         if not document_id or document_id not in documents:
             return jsonify({'error': 'Document not found'}), 404
         
-        doc = documents[document_id]
-        # Limit content length to avoid token limits
-        content = doc['content'][:2000]
+        use_cache = cache_allowed(data)
+        prompt = build_summary_prompt(documents[document_id], data.get('mode', 'auto'), use_cache)
         
-        prompt = f"""Summarize the following document in 3-5 clear sentences. Focus on the main ideas and key points.
+        summary = call_ollama(prompt, use_cache=use_cache)
+        
+        if summary:
+            return jsonify(record_summary(document_id, summary)), 200
+        else:
+            return jsonify({'error': 'Failed to generate summary'}), 500
+            
+    except OllamaOverloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/summarize/stream', methods=['POST'])
+def summarize_document_stream():
+    """Stream summary tokens for uploaded document as Server-Sent Events"""
+    try:
+        data = request.json
+        document_id = data.get('document_id')
+        
+        if not document_id or document_id not in documents:
+            return jsonify({'error': 'Document not found'}), 404
+        
+        # Section summaries run before streaming; only the final pass streams
+        use_cache = cache_allowed(data)
+        prompt = build_summary_prompt(documents[document_id], data.get('mode', 'auto'), use_cache)
+        
+        return stream_generation(
+            prompt,
+            lambda summary: record_summary(document_id, summary),
+            use_cache=use_cache
+        )
+        
+    except OllamaOverloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def build_summary_prompt(doc, mode='auto', use_cache=True):
+    """Build the summarization prompt for a document
+    
+    Long documents are summarized section by section first (map-reduce);
+    mode='truncate' only looks at the beginning of the document. Section
+    summaries are kept in the document store even when use_cache is off,
+    which only affects the final generation.
+    """
+    if mode != 'truncate':
+        with timed('map_reduce'):
+            prompt = summarize.map_reduce_prompt(
+                doc['content'],
+                lambda section_prompt: call_ollama(section_prompt, use_cache=use_cache),
+                store=documents, model=OLLAMA_MODEL
+            )
+        if prompt:
+            return prompt
+    
+    return truncated_summary_prompt(doc)
+
+def truncated_summary_prompt(doc):
+    """Summarization prompt over the beginning of a document"""
+    # Limit content length to avoid token limits
+    content = doc['content'][:2000]
+    
+    return f"""Summarize the following document in 3-5 clear sentences. Focus on the main ideas and key points.
 
 Document:
 {content}
 
 Summary:"""
+
+def record_summary(document_id, summary):
+    """Store a generated summary and return the response payload"""
+    documents.set_summary(document_id, summary)
+    
+    metrics['total_summaries'] += 1
+    
+    return {
+        'document_id': document_id,
+        'summary': summary
+    }
+
+# Largest top_k a question may ask for
+MAX_TOP_K = int(os.environ.get('MAX_TOP_K', 20))
+
+def retrieval_options(data):
+    """top_k and hybrid_alpha from a request, clamped to their ranges
+
+    Raises ValueError with a client-facing message when either is not a number.
+    """
+    try:
+        top_k = int(data.get('top_k', 3))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError('top_k must be an integer')
+    try:
+        alpha = float(data.get('hybrid_alpha', 0.5))
+    except (TypeError, ValueError):
+        raise ValueError('hybrid_alpha must be a number')
+    if math.isnan(alpha):
+        raise ValueError('hybrid_alpha must be a number')
+    return min(max(top_k, 1), MAX_TOP_K), min(max(alpha, 0.0), 1.0)
+
+@app.route('/api/ask', methods=['POST'])
+def ask_question():
+    """Answer questions about the document using relevant chunks"""
+    try:
+        data = request.json
+        document_id = data.get('document_id')
+        question = data.get('question')
         
-        summary = call_ollama(prompt)
+        retrieval = data.get('retrieval', 'lexical')
+        if retrieval not in RETRIEVAL_MODES:
+            return jsonify({'error': f"retrieval must be one of {', '.join(RETRIEVAL_MODES)}"}), 400
+        try:
+            top_k, alpha = retrieval_options(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        if summary:
-            documents[document_id]['summary'] = summary
-            
-            metrics['total_summaries'] += 1
-
-            return jsonify({
-                'document_id': document_id,
-                'summary': summary
-            }), 200
+        if data.get('scope') == 'corpus':
+            if not question:
+                return jsonify({'error': 'Question is required'}), 400
+            return ask_corpus(question, top_k=top_k, use_cache=cache_allowed(data),
+                              retrieval=retrieval, alpha=alpha)
+        
+        if not document_id or document_id not in documents:
+            return jsonify({'error': 'Document not found'}), 404
+        
+        if not question:
+            return jsonify({'error': 'Question is required'}), 400
+        
+        prompt, used_chunks = build_answer_prompt(document_id, question, retrieval=retrieval, alpha=alpha,
+                                                  top_k=top_k)
+        
+        answer = call_ollama(prompt, use_cache=cache_allowed(data))
+        
+        if answer:
+            payload = record_answer(document_id, question, answer, used_chunks)
+            payload['retrieval'] = retrieval
+            return jsonify(payload), 200
         else:
-            return jsonify({'error': 'Failed to generate summary'}), 500
+            return jsonify({'error': 'Failed to generate answer'}), 500
             
+    except OllamaOverloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/ask', methods=['POST'])
-def ask_question():
-    """Answer questions about the document using relevant chunks"""
+@app.route('/api/ask/stream', methods=['POST'])
+def ask_question_stream():
+    """Stream answer tokens for a document question as Server-Sent Events"""
     try:
         data = request.json
         document_id = data.get('document_id')
@@ -275,26 +625,54 @@ def ask_question():
         if not question:
             return jsonify({'error': 'Question is required'}), 400
         
-        doc = documents[document_id]
+        prompt, used_chunks = build_answer_prompt(document_id, question)
         
-        # Track which chunks were used
-        used_chunks = []
+        return stream_generation(
+            prompt,
+            lambda answer: record_answer(document_id, question, answer, used_chunks),
+            use_cache=cache_allowed(data)
+        )
         
-        # Use RAG to retrieve relevant chunks
-        if RAG_AVAILABLE and rag:
-            relevant_chunks = rag.retrieve(document_id, question, top_k=3)
-            if relevant_chunks:
-                context = '\n\n'.join(relevant_chunks)
-                used_chunks = relevant_chunks[:2]  # Save first 2 chunks as sources
-                print(f"Retrieved {len(relevant_chunks)} relevant chunks")
-            else:
-                context = doc['content'][:2000]
-                used_chunks = [doc['content'][:500]]  # Use beginning as source
+    except OllamaOverloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def retrieve_chunks(content_hash, question, retrieval='lexical', alpha=0.5, top_k=3):
+    """Retrieve chunks for a question, falling back to BM25 if embedding fails"""
+    if retrieval != 'lexical':
+        try:
+            return retriever.retrieve(content_hash, question, top_k=top_k, mode=retrieval, alpha=alpha)
+        except Exception as e:
+            print(f"{retrieval.capitalize()} retrieval failed, using lexical: {e}")
+    return rag.retrieve(content_hash, question, top_k=top_k)
+
+def build_answer_prompt(document_id, question, relevant_chunks=None, retrieval='lexical', alpha=0.5, top_k=3):
+    """Retrieve context for a question and build the answer prompt"""
+    doc = documents[document_id]
+    
+    # Track which chunks were used
+    used_chunks = []
+    
+    # Use RAG to retrieve relevant chunks (unless already retrieved in a batch)
+    if RAG_AVAILABLE and rag:
+        if relevant_chunks is None:
+            with timed('retrieval'):
+                relevant_chunks = retrieve_chunks(doc['content_hash'], question, retrieval, alpha, top_k)
+        if relevant_chunks:
+            context = '\n\n'.join(text for _, text in pack_context([(None, chunk) for chunk in relevant_chunks],
+                                                                   question))
+            used_chunks = relevant_chunks[:2]  # Save first 2 chunks as sources
+            print(f"Retrieved {len(relevant_chunks)} relevant chunks")
         else:
             context = doc['content'][:2000]
-            used_chunks = [doc['content'][:500]]
-        
-        # Updated prompt to include citation instruction
+            used_chunks = [doc['content'][:500]]  # Use beginning as source
+    else:
+        context = doc['content'][:2000]
+        used_chunks = [doc['content'][:500]]
+    
+    # Updated prompt to include citation instruction
+    with timed('prompt'):
         prompt = f"""Based on the following document excerpts, answer the question accurately.
 Include specific references to the information source when possible.
 
@@ -304,58 +682,251 @@ Document excerpts:
 Question: {question}
 
 Answer (cite the document when referencing specific information):"""
+    
+    return prompt, used_chunks
+
+def build_answer_record(document_id, question, answer, used_chunks):
+    """Build the Q&A history entry and response payload for an answer"""
+    doc = documents[document_id]
+    
+    # Build source reference
+    source_info = {
+        'document': doc['filename'],
+        'type': doc.get('source_type', 'pdf'),
+        'url': doc.get('source_url', None),
+        'excerpt': used_chunks[0][:200] + '...' if used_chunks else None
+    }
+    
+    entry = {
+        'question': question,
+        'answer': answer,
+        'sources': source_info,
+        'timestamp': datetime.now().isoformat()
+    }
+    
+    payload = {
+        'document_id': document_id,
+        'question': question,
+        'answer': answer,
+        'source_reference': f"Source: {doc['filename']}",
+        'source_details': source_info,
+        'method': 'RAG' if RAG_AVAILABLE else 'fallback'
+    }
+    return entry, payload
+
+def record_answer(document_id, question, answer, used_chunks):
+    """Store an answer in the Q&A history and return the response payload"""
+    entry, payload = build_answer_record(document_id, question, answer, used_chunks)
+    
+    # Store Q&A history with source
+    documents.append_qa(document_id, entry)
+    
+    # Update metrics
+    metrics['total_questions'] += 1
+    
+    return payload
+
+# Batch questions: how many may be sent at once and answered in parallel
+BATCH_MAX_QUESTIONS = int(os.environ.get('BATCH_MAX_QUESTIONS', 100))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 4))
+
+@app.route('/api/ask-batch', methods=['POST'])
+def ask_batch():
+    """Answer many questions about one or more documents in one request"""
+    try:
+        data = request.json
+        default_document_id = data.get('document_id')
+        questions = data.get('questions')
         
-        answer = call_ollama(prompt)
+        if not questions or not isinstance(questions, list):
+            return jsonify({'error': 'Questions are required'}), 400
         
-        if answer:
-            # Build source reference
-            source_info = {
-                'document': doc['filename'],
-                'type': doc.get('source_type', 'pdf'),
-                'url': doc.get('source_url', None),
-                'excerpt': used_chunks[0][:200] + '...' if used_chunks else None
-            }
-            
-            # Store Q&A history with source
-            doc['qa_history'].append({
-                'question': question,
-                'answer': answer,
-                'sources': source_info,
-                'timestamp': datetime.now().isoformat()
-            })
-            
-            # Update metrics
-            metrics['total_questions'] += 1
-            
-            return jsonify({
-                'document_id': document_id,
-                'question': question,
-                'answer': answer,
-                'source_reference': f"Source: {doc['filename']}",
-                'source_details': source_info,
-                'method': 'RAG' if RAG_AVAILABLE else 'fallback'
-            }), 200
+        if len(questions) > BATCH_MAX_QUESTIONS:
+            return jsonify({'error': f'At most {BATCH_MAX_QUESTIONS} questions per batch'}), 400
+        
+        # Each item is a question string or {"document_id": ..., "question": ...}
+        items = []
+        for i, item in enumerate(questions):
+            if isinstance(item, str):
+                document_id, question = default_document_id, item
+            else:
+                document_id = item.get('document_id', default_document_id)
+                question = item.get('question')
+            if not document_id or document_id not in documents:
+                return jsonify({'error': f'Document not found for question {i}'}), 404
+            if not question:
+                return jsonify({'error': f'Question {i} is empty'}), 400
+            items.append((document_id, question))
+        
+        # One retrieval pass for the whole batch
+        if RAG_AVAILABLE and rag:
+            with timed('retrieval'):
+                retrieved = rag.retrieve_batch(
+                    [(documents[document_id]['content_hash'], question) for document_id, question in items],
+                    top_k=3
+                )
         else:
-            return jsonify({'error': 'Failed to generate answer'}), 500
+            retrieved = [None] * len(items)
+        prompts = [
+            build_answer_prompt(document_id, question, relevant_chunks)
+            for (document_id, question), relevant_chunks in zip(items, retrieved)
+        ]
+        
+        use_cache = cache_allowed(data)
+        
+        def answer(index):
+            """Generate one answer; failures are reported per question"""
+            document_id, question = items[index]
+            prompt, used_chunks = prompts[index]
+            try:
+                text = call_ollama(prompt, use_cache=use_cache)
+            except OllamaOverloaded as e:
+                return index, None, {'document_id': document_id, 'question': question,
+                                     'error': 'Model is busy, please retry shortly',
+                                     'retry_after': e.retry_after}
+            if not text:
+                return index, None, {'document_id': document_id, 'question': question,
+                                     'error': 'Failed to generate answer'}
+            entry, payload = build_answer_record(document_id, question, text, used_chunks)
+            return index, entry, payload
+        
+        def save(outcomes):
+            """Append all successful answers to their Q&A histories at once"""
+            records = [(items[index][0], entry) for index, entry, _ in outcomes if entry]
+            documents.append_qa_batch(records)
+            metrics['total_questions'] += len(records)
+            return len(records)
+        
+        workers = max(1, min(BATCH_CONCURRENCY, len(items)))
+        
+        if data.get('stream'):
+            def generate():
+                outcomes = []
+                try:
+                    with ThreadPoolExecutor(max_workers=workers) as pool:
+                        futures = [pool.submit(contextvars.copy_context().run, answer, index)
+                                   for index in range(len(items))]
+                        for future in as_completed(futures):
+                            index, entry, payload = future.result()
+                            outcomes.append((index, entry, payload))
+                            yield sse_event(dict(payload, index=index), event='result')
+                finally:
+                    # Keep finished answers even if the client disconnects
+                    answered = save(outcomes)
+                yield sse_event({'count': len(items), 'answered': answered}, event='done')
             
+            return Response(
+                stream_with_context(generate()),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+        
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Copied contexts let worker threads add to this request's Server-Timing
+            futures = [pool.submit(contextvars.copy_context().run, answer, index)
+                       for index in range(len(items))]
+            outcomes = [future.result() for future in futures]
+        answered = save(outcomes)
+        
+        return jsonify({
+            'results': [payload for _, _, payload in outcomes],
+            'count': len(items),
+            'answered': answered
+        }), 200
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def ask_corpus(question, top_k=3, use_cache=True, retrieval='lexical', alpha=0.5):
+    """Answer a question using the best chunks across all indexed documents"""
+    if not (RAG_AVAILABLE and rag):
+        return jsonify({'error': 'Corpus search requires the RAG system'}), 503
+    
+    prompt, hits = build_corpus_prompt(question, top_k, retrieval, alpha)
+    if not hits:
+        return jsonify({'error': 'No indexed documents match the question'}), 404
+    
+    answer = call_ollama(prompt, use_cache=use_cache)
+    
+    if not answer:
+        return jsonify({'error': 'Failed to generate answer'}), 500
+    
+    return jsonify(build_corpus_answer(question, answer, hits, retrieval)), 200
+
+def build_corpus_prompt(question, top_k=3, retrieval='lexical', alpha=0.5):
+    """Retrieve chunks across the corpus and build the answer prompt
+    
+    Returns (None, []) when no indexed document matches the question.
+    """
+    with timed('retrieval'):
+        hits = None
+        if retrieval != 'lexical':
+            try:
+                hits = retriever.retrieve_corpus(question, top_k=top_k, mode=retrieval, alpha=alpha)
+            except Exception as e:
+                print(f"{retrieval.capitalize()} corpus retrieval failed, using lexical: {e}")
+        if hits is None:
+            hits = rag.retrieve_corpus(question, top_k=top_k)
+    
+    # The RAG index is keyed by content hash; cite the first upload of each.
+    # The index can still hold a hash whose documents were just deleted.
+    for hit in hits:
+        hit['document'] = documents.find_by_hash(hit['document_id'])
+    hits = [hit for hit in hits if hit['document'] is not None]
+    if not hits:
+        return None, []
+    
+    filenames = {hit['document_id']: hit['document']['filename'] for hit in hits}
+    packed = pack_context([(hit['document_id'], hit['text']) for hit in hits], question)
+    
+    with timed('prompt'):
+        context = '\n\n'.join(
+            f"[{filenames[content_hash]}]\n{text}"
+            for content_hash, text in packed
+        )
+        
+        prompt = f"""Based on the following excerpts from several documents, answer the question accurately.
+Each excerpt starts with the name of its source document in brackets.
+
+Document excerpts:
+{context}
+
+Question: {question}
+
+Answer (cite the document name when referencing specific information):"""
+    
+    return prompt, hits
+
+def build_corpus_answer(question, answer, hits, retrieval='lexical'):
+    """Response payload for a corpus answer, citing every retrieved chunk"""
+    sources = []
+    for hit in hits:
+        doc = hit['document']
+        sources.append({
+            'document_id': doc['id'],
+            'document': doc['filename'],
+            'type': doc.get('source_type', 'pdf'),
+            'url': doc.get('source_url', None),
+            'score': round(hit['score'], 4),
+            'excerpt': hit['text'][:200] + '...'
+        })
+    
+    metrics['total_questions'] += 1
+    
+    return {
+        'question': question,
+        'answer': answer,
+        'source_reference': 'Sources: ' + ', '.join(dict.fromkeys(s['document'] for s in sources)),
+        'sources': sources,
+        'method': 'RAG-corpus',
+        'retrieval': retrieval
+    }
+
 @app.route('/api/documents', methods=['GET'])
 def list_documents():
     """List all uploaded documents"""
     try:
-        doc_list = []
-        for doc_id, doc_data in documents.items():
-            doc_list.append({
-                'id': doc_id,
-                'filename': doc_data['filename'],
-                'content_length': doc_data['content_length'],
-                'created_at': doc_data['created_at'],
-                'has_summary': bool(doc_data.get('summary'))
-            })
-        
-        return jsonify({'documents': doc_list}), 200
+        return jsonify({'documents': documents.list()}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -398,32 +969,16 @@ def get_qa_history(document_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def extract_pdf_content(file):
-    """Extract text content from PDF file"""
+def extract_pdf_content(data, progress=None):
+    """Extract text content from PDF bytes"""
     try:
-        content = ""
-        
-        # Save uploaded file to temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            file.save(tmp_file.name)
-            tmp_path = tmp_file.name
-        
-        # Extract text from PDF
-        with open(tmp_path, 'rb') as pdf_file:
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            
-            # Extract text from all pages
-            for page_num, page in enumerate(pdf_reader.pages):
-                page_text = page.extract_text()
-                if page_text.strip():  # Only add non-empty pages
-                    content += f"\n--- Page {page_num + 1} ---\n"
-                    content += page_text + "\n"
-        
-        # Clean up temporary file
-        os.unlink(tmp_path)
+        # Large PDFs are split across worker processes
+        with timed('pdf_extract'):
+            content = pdf_extract.extract_text(data, progress=progress)
         
         # Clean up extracted text
-        content = clean_extracted_text(content)
+        with timed('clean'):
+            content = clean_extracted_text(content)
         
         return content if content.strip() else None
         
@@ -433,18 +988,27 @@ def extract_pdf_content(file):
 
 def clean_extracted_text(text):
     """Clean and format extracted text"""
-    import re
-    
-    # Remove excessive whitespace
-    text = re.sub(r'\s+', ' ', text)
-    
-    # Remove special characters but keep basic punctuation
-    text = re.sub(r'[^\w\s.,!?;:()\-\'"]+', ' ', text)
-    
-    # Fix spacing around punctuation
-    text = re.sub(r'\s+([.,!?;:])', r'\1', text)
-    
-    return text.strip()
+    # Whitespace, special characters and punctuation spacing in one pass
+    return clean_pdf_text(text)
+
+@app.route('/api/document/<document_id>', methods=['DELETE'])
+def delete_document(document_id):
+    """Delete a document, and its text and index once no other upload shares them"""
+    try:
+        if document_id not in documents:
+            return jsonify({'error': 'Document not found'}), 404
+        
+        orphaned = documents.delete(document_id)
+        if orphaned:
+            if rag:
+                rag.remove_document(orphaned)
+            dense_index.remove_document(orphaned)
+        
+        return jsonify({'document_id': document_id, 'deleted': True}), 200
+        
+    except Exception as e:
+        print(f"Delete error: {str(e)}")
+        return jsonify({'error': f'Failed to delete document: {str(e)}'}), 500
 
 @app.route('/api/document/<document_id>/download', methods=['GET'])
 def download_summary(document_id):
@@ -514,10 +1078,48 @@ def get_metrics():
         'total_uploads': metrics['total_uploads'],
         'total_summaries': metrics['total_summaries'],
         'total_questions': metrics['total_questions'],
-        'documents_in_memory': len(documents),
+        'duplicate_uploads': metrics['duplicate_uploads'],
+        # Milliseconds, over non-streaming question and summary requests
+        'avg_response_time': round(request_timings.mean(*ANSWER_ENDPOINTS) * 1000, 3),
+        'documents_in_memory': documents.stats()['documents_cached'],
+        'documents_stored': len(documents),
         'rag_enabled': RAG_AVAILABLE,
-        'model_used': OLLAMA_MODEL if 'OLLAMA_MODEL' in globals() else 'none'
+        'model_used': OLLAMA_MODEL if 'OLLAMA_MODEL' in globals() else 'none',
+        'ingest_jobs': ingest_jobs.stats(),
+        'ollama': ollama.stats(),
+        'llm_cache': llm_cache.stats(),
+        'coalescing': flights.stats(),
+        'context_packing': context_packer.stats(),
+        'url_cache': page_cache.stats(),
+        'dense_index': dense_index.stats(),
+        'rag_segments': rag_segments.stats() if rag_segments else None,
+        'stages': stage_metrics.stages.summary(),
+        'requests': request_timings.summary()
     }), 200
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Counters and latency histograms in the Prometheus text format"""
+    lines = []
+    for name in ('total_uploads', 'total_summaries', 'total_questions', 'duplicate_uploads'):
+        metric = f"askdocai_{name.replace('total_', '')}_total"
+        lines += [f'# TYPE {metric} counter', f'{metric} {metrics[name]}']
+    coalescing = flights.stats()
+    lines += [
+        '# TYPE askdocai_llm_generations_total counter',
+        f"askdocai_llm_generations_total {coalescing['leaders']}",
+        '# TYPE askdocai_llm_coalesced_total counter',
+        f"askdocai_llm_coalesced_total {coalescing['followers']}"
+    ]
+    lines += [
+        '# TYPE askdocai_documents_stored gauge',
+        f'askdocai_documents_stored {len(documents)}'
+    ]
+    lines += stage_metrics.stages.prometheus(
+        'askdocai_stage_duration_seconds', 'stage', 'Time spent in each pipeline stage')
+    lines += request_timings.prometheus(
+        'askdocai_request_duration_seconds', 'endpoint', 'Request latency per endpoint')
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(debug=True, port=5050)
\ No newline at end of file
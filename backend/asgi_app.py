@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio serving mode for the AskDocAI API
+
+The question and summary endpoints (/api/ask, /api/ask/stream,
+/api/summarize, /api/summarize/stream) run as coroutines: while a request
+waits for a generation slot or for Ollama's response it holds no thread,
+so thousands of waiting requests cost coroutines rather than a thread
+each. Retrieval, prompt building and store writes run on a small thread
+pool so they never block the event loop. Every other route is served by
+the Flask app in app.py through a2wsgi's WSGI middleware on its own
+thread pool, which is also where uploads are extracted and indexed.
+
+Both modes share one document store, index, response cache and generation
+slots, so OLLAMA_MAX_CONCURRENCY still caps what reaches the model. Since
+a waiting request costs a coroutine rather than a thread, OLLAMA_MAX_QUEUE
+defaults to 4096 here instead of 16.
+
+Usage:
+uvicorn asgi_app:app --host 0.0.0.0 --port 5050
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from a2wsgi import WSGIMiddleware
+
+# Set before app.py builds the Ollama client
+ASGI_MAX_QUEUE = 4096
+os.environ.setdefault('OLLAMA_MAX_QUEUE', str(ASGI_MAX_QUEUE))
+
+import app as backend
+import stage_metrics
+import summarize
+from dense_index import RETRIEVAL_MODES
+from llm_cache import is_deterministic
+from ollama_client import AsyncOllamaClient, OllamaOverloaded
+from stage_metrics import timed
+
+# Threads for blocking work inside async handlers, and for bridged Flask requests
+WORK_THREADS = int(os.environ.get('ASGI_WORK_THREADS', 8))
+WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 16))
+
+work_pool = ThreadPoolExecutor(max_workers=WORK_THREADS, thread_name_prefix='asgi-work')
+flask_app = WSGIMiddleware(backend.app, workers=WSGI_THREADS)
+
+# Shares slots, queue and statistics with the Flask app's blocking client
+ollama = AsyncOllamaClient(backend.ollama)
+
+SSE_HEADERS = [('cache-control', 'no-cache'), ('x-accel-buffering', 'no')]
+
+# body is bytes, or an async iterator of str for streamed responses
+Reply = namedtuple('Reply', ['status', 'headers', 'body'])
+
+class BadRequest(Exception):
+    """Raised for a request body the handlers cannot use; answered with 400"""
+
+class Request:
+    """The parts of an ASGI HTTP request the handlers need"""
+
+    def __init__(self, scope, body: bytes):
+        self.scope = scope
+        self.body = body
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope.get('headers', [])}
+
+    def json(self):
+        """The body as a JSON object"""
+        try:
+            data = json.loads(self.body or b'null')
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise BadRequest('Request body must be valid JSON')
+        if not isinstance(data, dict):
+            raise BadRequest('Request body must be a JSON object')
+        return data
+
+def run_blocking(fn, *args):
+    """Run fn on the work pool, keeping this request's stage timings"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(work_pool, contextvars.copy_context().run, functools.partial(fn, *args))
+
+def json_reply(payload, status=200, headers=None):
+    body = json.dumps(payload).encode('utf-8')
+    return Reply(status, [('content-type', 'application/json')] + (headers or []), body)
+
+def error_reply(message, status):
+    return json_reply({'error': message}, status)
+
+def overloaded_reply(error):
+    """503 telling the client when to retry, as in the Flask app"""
+    return json_reply({'error': 'Model is busy, please retry shortly', 'retry_after': error.retry_after},
+                      503, [('retry-after', str(error.retry_after))])
+
+def cache_allowed(data, request):
+    """Requests opt out of the response cache with no_cache or Cache-Control"""
+    if data.get('no_cache'):
+        return False
+    return 'no-cache' not in request.headers.get('cache-control', '')
+
+async def generate(prompt, use_cache=True):
+    """Async call_ollama: cached response, or a generation awaited without a thread"""
+    cacheable = use_cache and is_deterministic(backend.OLLAMA_OPTIONS)
+    if cacheable:
+        cached = await run_blocking(backend.llm_cache.get, backend.OLLAMA_MODEL, backend.OLLAMA_OPTIONS, prompt)
+        if cached is not None:
+            return cached
+
+    async def generate_once():
+        response = await ollama.generate(prompt, backend.OLLAMA_OPTIONS, model=backend.OLLAMA_MODEL)
+        if cacheable and response:
+            await run_blocking(backend.llm_cache.put, backend.OLLAMA_MODEL, backend.OLLAMA_OPTIONS, prompt, response)
+        return response
+
+    # Shares in-flight generations with the Flask routes too
+    flights = backend.flights
+    try:
+        with timed('llm'):
+            return await flights.run_async(flights.key(backend.OLLAMA_MODEL, backend.OLLAMA_OPTIONS, prompt, use_cache),
+                                           generate_once)
+    except OllamaOverloaded:
+        raise
+    except Exception as e:
+        print(f"Ollama error: {e}")
+        return None
+
+async def stream_generation(prompt, on_complete, use_cache=True):
+    """Relay streamed tokens as SSE and hand the full text to on_complete (run on the work pool)"""
+    cacheable = use_cache and is_deterministic(backend.OLLAMA_OPTIONS)
+    cached = None
+    if cacheable:
+        cached = await run_blocking(backend.llm_cache.get, backend.OLLAMA_MODEL, backend.OLLAMA_OPTIONS, prompt)
+
+    # Admission happens here so overload surfaces as a 503 before streaming;
+    # an identical stream already running is shared instead, and whoever
+    # finishes it caches the text even if the leading client left early
+    tokens = None
+    if cached is None:
+        async def store(text):
+            await run_blocking(backend.llm_cache.put, backend.OLLAMA_MODEL, backend.OLLAMA_OPTIONS, prompt, text)
+
+        flights = backend.flights
+        tokens, _ = await flights.stream_async(
+            flights.key(backend.OLLAMA_MODEL, backend.OLLAMA_OPTIONS, prompt, use_cache),
+            lambda: ollama.stream(prompt, backend.OLLAMA_OPTIONS, model=backend.OLLAMA_MODEL),
+            on_complete=store if cacheable else None
+        )
+
+    async def events():
+        if cached is not None:
+            yield backend.sse_event({'token': cached})
+            yield backend.sse_event(await run_blocking(on_complete, cached), event='done')
+            return
+
+        parts = []
+        start = time.perf_counter()
+        try:
+            async for token in tokens:
+                parts.append(token)
+                yield backend.sse_event({'token': token})
+        except Exception as e:
+            print(f"Ollama stream error: {e}")
+            yield backend.sse_event({'error': 'Generation failed'}, event='error')
+            return
+        finally:
+            await tokens.aclose()
+            stage_metrics.record('llm', time.perf_counter() - start)
+
+        text = ''.join(parts)
+        if not text:
+            yield backend.sse_event({'error': 'Empty response from model'}, event='error')
+            return
+        yield backend.sse_event(await run_blocking(on_complete, text), event='done')
+
+    return Reply(200, [('content-type', 'text/event-stream')] + SSE_HEADERS, events())
+
+async def summary_prompt(doc, mode='auto', use_cache=True):
+    """Async build_summary_prompt: section summaries are generated concurrently on the loop"""
+    if mode != 'truncate':
+        with timed('map_reduce'):
+            prompt = await summarize.map_reduce_prompt_async(
+                doc['content'],
+                lambda section_prompt: generate(section_prompt, use_cache=use_cache),
+                store=backend.documents, model=backend.OLLAMA_MODEL, run_blocking=run_blocking
+            )
+        if prompt:
+            return prompt
+    return backend.truncated_summary_prompt(doc)
+
+async def ask_question(request):
+    """Answer questions about the document using relevant chunks"""
+    data = request.json()
+    document_id = data.get('document_id')
+    question = data.get('question')
+
+    retrieval = data.get('retrieval', 'lexical')
+    if retrieval not in RETRIEVAL_MODES:
+        return error_reply(f"retrieval must be one of {', '.join(RETRIEVAL_MODES)}", 400)
+    try:
+        top_k, alpha = backend.retrieval_options(data)
+    except ValueError as e:
+        return error_reply(str(e), 400)
+    use_cache = cache_allowed(data, request)
+
+    if data.get('scope') == 'corpus':
+        if not question:
+            return error_reply('Question is required', 400)
+        if not (backend.RAG_AVAILABLE and backend.rag):
+            return error_reply('Corpus search requires the RAG system', 503)
+        prompt, hits = await run_blocking(backend.build_corpus_prompt, question, top_k, retrieval, alpha)
+        if not hits:
+            return error_reply('No indexed documents match the question', 404)
+        answer = await generate(prompt, use_cache=use_cache)
+        if not answer:
+            return error_reply('Failed to generate answer', 500)
+        return json_reply(backend.build_corpus_answer(question, answer, hits, retrieval))
+
+    if not document_id or not await run_blocking(backend.documents.__contains__, document_id):
+        return error_reply('Document not found', 404)
+
+    if not question:
+        return error_reply('Question is required', 400)
+
+    prompt, used_chunks = await run_blocking(backend.build_answer_prompt, document_id, question,
+                                             None, retrieval, alpha, top_k)
+
+    answer = await generate(prompt, use_cache=use_cache)
+
+    if not answer:
+        return error_reply('Failed to generate answer', 500)
+    payload = await run_blocking(backend.record_answer, document_id, question, answer, used_chunks)
+    payload['retrieval'] = retrieval
+    return json_reply(payload)
+
+async def ask_question_stream(request):
+    """Stream answer tokens for a document question as Server-Sent Events"""
+    data = request.json()
+    document_id = data.get('document_id')
+    question = data.get('question')
+
+    if not document_id or not await run_blocking(backend.documents.__contains__, document_id):
+        return error_reply('Document not found', 404)
+
+    if not question:
+        return error_reply('Question is required', 400)
+
+    prompt, used_chunks = await run_blocking(backend.build_answer_prompt, document_id, question)
+
+    return await stream_generation(
+        prompt,
+        lambda answer: backend.record_answer(document_id, question, answer, used_chunks),
+        use_cache=cache_allowed(data, request)
+    )
+
+async def summarize_document(request):
+    """Generate summary for uploaded document using LLM"""
+    data = request.json()
+    document_id = data.get('document_id')
+
+    doc = await run_blocking(backend.documents.get, document_id) if document_id else None
+    if not doc:
+        return error_reply('Document not found', 404)
+
+    use_cache = cache_allowed(data, request)
+    prompt = await summary_prompt(doc, data.get('mode', 'auto'), use_cache)
+
+    summary = await generate(prompt, use_cache=use_cache)
+
+    if not summary:
+        return error_reply('Failed to generate summary', 500)
+    return json_reply(await run_blocking(backend.record_summary, document_id, summary))
+
+async def summarize_document_stream(request):
+    """Stream summary tokens for uploaded document as Server-Sent Events"""
+    data = request.json()
+    document_id = data.get('document_id')
+
+    doc = await run_blocking(backend.documents.get, document_id) if document_id else None
+    if not doc:
+        return error_reply('Document not found', 404)
+
+    # Section summaries run before streaming; only the final pass streams
+    use_cache = cache_allowed(data, request)
+    prompt = await summary_prompt(doc, data.get('mode', 'auto'), use_cache)
+
+    return await stream_generation(
+        prompt,
+        lambda summary: backend.record_summary(document_id, summary),
+        use_cache=use_cache
+    )
+
+# (method, path) -> (endpoint name shared with the Flask app's timings, handler)
+ROUTES = {
+    ('POST', '/api/ask'): ('ask_question', ask_question),
+    ('POST', '/api/ask/stream'): ('ask_question_stream', ask_question_stream),
+    ('POST', '/api/summarize'): ('summarize_document', summarize_document),
+    ('POST', '/api/summarize/stream'): ('summarize_document_stream', summarize_document_stream)
+}
+
+async def read_body(receive) -> bytes:
+    parts = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        parts.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(parts)
+
+async def watch_disconnect(receive, disconnected: threading.Event):
+    """Flag the client going away while a response is still streaming"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+            return
+
+def encode_headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+async def handle(scope, receive, send, endpoint, handler):
+    """Run an async handler with the Flask app's timing, CORS and error handling"""
+    start = time.perf_counter()
+    stage_metrics.start_request()
+    request = Request(scope, await read_body(receive))
+    try:
+        reply = await handler(request)
+    except BadRequest as e:
+        reply = error_reply(str(e), 400)
+    except OllamaOverloaded as e:
+        reply = overloaded_reply(e)
+    except Exception as e:
+        reply = error_reply(str(e), 500)
+
+    elapsed = time.perf_counter() - start
+    backend.request_timings.observe(endpoint, elapsed)
+    headers = list(reply.headers)
+    headers.append(('server-timing', stage_metrics.server_timing(stage_metrics.request_stages() or {}, elapsed)))
+    headers.append(('timing-allow-origin', '*'))
+    if 'origin' in request.headers:
+        headers.append(('access-control-allow-origin', '*'))
+
+    if isinstance(reply.body, bytes):
+        headers.append(('content-length', str(len(reply.body))))
+        await send({'type': 'http.response.start', 'status': reply.status, 'headers': encode_headers(headers)})
+        await send({'type': 'http.response.body', 'body': reply.body})
+        return
+
+    disconnected = threading.Event()
+    watcher = asyncio.ensure_future(watch_disconnect(receive, disconnected))
+    try:
+        await send({'type': 'http.response.start', 'status': reply.status, 'headers': encode_headers(headers)})
+        async for event in reply.body:
+            if disconnected.is_set():
+                break
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        # Closing the generator closes the token stream and frees its slot
+        await reply.body.aclose()
+        watcher.cancel()
+
+class AsyncApp:
+    """ASGI application: async handlers for LLM endpoints, Flask for the rest"""
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        route = ROUTES.get((scope['method'], scope['path']))
+        if route is None:
+            await flask_app(scope, receive, send)
+        else:
+            await handle(scope, receive, send, *route)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await ollama.aclose()
+                work_pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+app = AsyncApp()
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5050)))
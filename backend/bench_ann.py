@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Recall and latency of the IVF index against exact dense search
+
+Builds an IVFIndex over synthetic clustered unit vectors (the shape of
+chunk embeddings: many topics, many near-duplicates), then measures, for
+each nprobe, recall@k of its results against an exact matrix scan and the
+per-query latency of both. Also times training, incremental adds, deletes
+and a save/load round trip.
+
+Usage:
+python bench_ann.py --vectors 200000 --dim 384 --nprobe 1 2 4 8 16 32 --output ann.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+
+from ann_index import IVFIndex, top_k_indices
+from stage_metrics import percentile
+
+def make_vectors(count: int, dim: int, clusters: int, spread: float, rng: np.random.Generator) -> np.ndarray:
+    """Unit vectors scattered around random topic directions"""
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, size=count)]
+    vectors += spread * rng.standard_normal((count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def latency_ms(latencies: List[float]) -> Dict[str, float]:
+    return {
+        'p50': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99': round(percentile(latencies, 0.99) * 1000, 3)
+    }
+
+def exact_search(vectors: np.ndarray, live: np.ndarray, queries: np.ndarray, k: int):
+    """Ground-truth neighbor ids and per-query latencies of a full scan"""
+    truth, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        ranked = live[top_k_indices(vectors @ query, k)]
+        latencies.append(time.perf_counter() - start)
+        truth.append(set(ranked.tolist()))
+    return truth, latencies
+
+def ann_search(index: IVFIndex, queries: np.ndarray, truth: List[set], k: int, nprobe: int) -> Dict:
+    recalls, latencies = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        hits = index.search(query, k, nprobe=nprobe)
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len(expected & {key for key, _ in hits}) / len(expected))
+    return {'recall': float(np.mean(recalls)), 'latencies': latencies}
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare IVF index recall and latency with exact search.')
+    parser.add_argument('--vectors', type=int, default=200000, help='Vectors in the index')
+    parser.add_argument('--dim', type=int, default=384, help='Vector dimension')
+    parser.add_argument('--clusters', type=int, default=2000, help='Topics the synthetic vectors gather around')
+    parser.add_argument('--spread', type=float, default=1.0, help='Noise around each topic (higher is harder)')
+    parser.add_argument('--nlist', type=int, help='IVF cells (default: about sqrt of --vectors)')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64],
+                        help='Cells scanned per query, e.g., --nprobe 1 4 16')
+    parser.add_argument('--k', type=int, default=10, help='Neighbors per query for recall@k')
+    parser.add_argument('--queries', type=int, default=200, help='Number of queries')
+    parser.add_argument('--incremental', type=float, default=0.1,
+                        help='Fraction of vectors added one batch at a time after training')
+    parser.add_argument('--delete', type=float, default=0.05, help='Fraction of vectors deleted before searching')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for vectors and queries')
+    parser.add_argument('--output', help='Write results JSON to this path (default: stdout)')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = make_vectors(args.vectors + args.queries, args.dim, args.clusters, args.spread, rng)
+    vectors, queries = vectors[:args.vectors], vectors[args.vectors:]
+    ids = np.arange(args.vectors)
+    initial = int(args.vectors * (1 - args.incremental))
+
+    index = IVFIndex(args.dim, nlist=args.nlist, train_size=initial, seed=args.seed)
+    start = time.perf_counter()
+    index.add(ids[:initial].tolist(), vectors[:initial])
+    train_seconds = time.perf_counter() - start
+
+    # Later documents arrive a few hundred chunks at a time
+    start = time.perf_counter()
+    for batch in range(initial, args.vectors, 256):
+        index.add(ids[batch:batch + 256].tolist(), vectors[batch:batch + 256])
+    add_seconds = time.perf_counter() - start
+    added = args.vectors - initial
+
+    deleted = rng.choice(args.vectors, size=int(args.vectors * args.delete), replace=False)
+    start = time.perf_counter()
+    index.delete(deleted.tolist())
+    delete_seconds = time.perf_counter() - start
+    live = np.setdiff1d(ids, deleted)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'ann.npz')
+        start = time.perf_counter()
+        index.save(path)
+        save_seconds = time.perf_counter() - start
+        file_mb = os.path.getsize(path) / 1e6
+        start = time.perf_counter()
+        index = IVFIndex.load(path)
+        load_seconds = time.perf_counter() - start
+
+    truth, exact_latencies = exact_search(np.ascontiguousarray(vectors[live]), live, queries, args.k)
+    exact_p50 = percentile(exact_latencies, 0.50)
+    runs = {}
+    for nprobe in sorted(set(args.nprobe)):
+        outcome = ann_search(index, queries, truth, args.k, nprobe)
+        runs[str(nprobe)] = {
+            'recall_at_k': round(outcome['recall'], 4),
+            'latency_ms': latency_ms(outcome['latencies']),
+            'speedup_p50': round(exact_p50 / (percentile(outcome['latencies'], 0.50) or 1e-9), 1)
+        }
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'vectors': args.vectors,
+            'dim': args.dim,
+            'clusters': args.clusters,
+            'spread': args.spread,
+            'k': args.k,
+            'queries': args.queries,
+            'seed': args.seed
+        },
+        'index': dict(index.stats(), **{
+            'train_seconds': round(train_seconds, 3),
+            'incremental_adds_per_s': round(added / add_seconds, 1) if add_seconds else 0.0,
+            'deletes_per_s': round(len(deleted) / delete_seconds, 1) if delete_seconds else 0.0,
+            'save_seconds': round(save_seconds, 3),
+            'load_seconds': round(load_seconds, 3),
+            'file_mb': round(file_mb, 1)
+        }),
+        'exact': {'latency_ms': latency_ms(exact_latencies)},
+        'nprobe': runs
+    }
+
+    print(f"=== IVF vs exact: {args.vectors} x {args.dim}, nlist {report['index']['nlist']}, "
+          f"recall@{args.k} ===", file=sys.stderr)
+    print(f"exact\t\tp50 {report['exact']['latency_ms']['p50']} ms", file=sys.stderr)
+    for nprobe, run in runs.items():
+        print(f"nprobe {nprobe}\trecall {run['recall_at_k']:.4f}\tp50 {run['latency_ms']['p50']} ms"
+              f"\t{run['speedup_p50']}x", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        print(f'Saved results to: {args.output}', file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmark for PDF text cleaning and HTML text extraction
+
+Compares the text_normalize implementations against the previous
+multi-pass regex versions on synthetic multi-MB inputs. The html-unclosed
+case has script tags that are never closed, which makes the old
+'<script[^>]*>.*?</script>' pattern quadratic; it is capped in size so
+the legacy run finishes.
+
+Usage:
+python bench_normalize.py --size-mb 4 --repeat 3
+"""
+import argparse
+import random
+import re
+import time
+
+from text_normalize import clean_pdf_text, extract_html_text
+
+WORDS = ['pump', 'valve', 'pressure', 'reset', 'manual', 'the', 'of', 'and', 'operator',
+         'café', "it's", 'section', '(see', 'note)', '"warning"', 'step-by-step']
+PUNCTUATION = ['', '', '', ',', '.', ';', ' .', ' ,', ':', '!']
+NOISE = ['', '', '', '', '•', '©', '  ', '\n', '\t', '→']
+
+def legacy_clean(text):
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'[^\w\s.,!?;:()\-\'"]+', ' ', text)
+    text = re.sub(r'\s+([.,!?;:])', r'\1', text)
+    return text.strip()
+
+def legacy_html(text):
+    text = re.sub(r'<script[^>]*>.*?</script>', '', text, flags=re.DOTALL)
+    text = re.sub(r'<style[^>]*>.*?</style>', '', text, flags=re.DOTALL)
+    text = re.sub('<[^<]+?>', ' ', text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+def make_pdf_text(size: int, seed: int = 0) -> str:
+    """Extracted-PDF-like text with page markers, bullets and stray whitespace"""
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    page = 1
+    while length < size:
+        if rng.random() < 0.001:
+            part = f'\n--- Page {page} ---\n'
+            page += 1
+        else:
+            part = rng.choice(NOISE) + rng.choice(WORDS) + rng.choice(PUNCTUATION) + ' '
+        parts.append(part)
+        length += len(part)
+    return ''.join(parts)
+
+def make_html(size: int, seed: int = 0) -> str:
+    """HTML page with paragraphs interleaved with large script and style blocks"""
+    rng = random.Random(seed)
+    parts = ['<html><head><title>Manual</title><style>body { color: #333; }</style></head><body>']
+    length = len(parts[0])
+    while length < size:
+        roll = rng.random()
+        if roll < 0.05:
+            part = '<script>var data = "' + 'x<y>' * rng.randint(50, 500) + '";</script>'
+        elif roll < 0.08:
+            part = '<style>' + '.c { margin: 0 }\n' * rng.randint(10, 100) + '</style>'
+        else:
+            words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 40)))
+            part = f'<p class="t">{words} <b>{rng.choice(WORDS)}</b> &amp; more.</p>\n'
+        parts.append(part)
+        length += len(part)
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+# Larger unclosed-script inputs take minutes with the legacy regex
+UNCLOSED_MAX = 200_000
+
+def make_unclosed_html(size: int, seed: int = 0) -> str:
+    """HTML where roughly one element in ten is a script tag that never closes"""
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        if rng.random() < 0.1:
+            part = '<script src="app.js"> '
+        else:
+            part = f'<p>{rng.choice(WORDS)} {rng.choice(WORDS)} {rng.choice(WORDS)}</p>'
+        parts.append(part)
+        length += len(part)
+    return ''.join(parts)
+
+def bench(fn, text: str, repeat: int) -> float:
+    """Best-of-repeat throughput in MB/s"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(text)
+        best = min(best, time.perf_counter() - start)
+    return len(text.encode('utf-8')) / best / 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark PDF cleaning and HTML extraction throughput.')
+    parser.add_argument('--size-mb', type=float, nargs='+', default=[1, 4],
+                        help='Input sizes in MB, e.g., --size-mb 1 4 16')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement (best is reported)')
+    args = parser.parse_args()
+
+    print('=== Text Normalization Throughput (MB/s) ===')
+    print('input\tsize_mb\tlegacy\tcurrent\tspeedup')
+    for size_mb in args.size_mb:
+        size = int(size_mb * 1e6)
+        cases = [
+            ('pdf', make_pdf_text(size), legacy_clean, clean_pdf_text),
+            ('html', make_html(size), legacy_html, extract_html_text),
+            ('html-unclosed', make_unclosed_html(min(size, UNCLOSED_MAX)), legacy_html, extract_html_text)
+        ]
+        for name, text, legacy, current in cases:
+            old = bench(legacy, text, args.repeat)
+            new = bench(current, text, args.repeat)
+            actual_mb = len(text) / 1e6
+            print(f'{name}\t{actual_mb:.2f}\t{old:.1f}\t{new:.1f}\t{new / old:.2f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks for the ingestion and retrieval hot paths
+
+Times clean_extracted_text (text_normalize.clean_pdf_text), chunk_document,
+SimplifiedRAG._create_chunks, SimplifiedRAG.index_document,
+SimplifiedRAG.retrieve and SimplifiedRAG.retrieve_corpus on a
+deterministic synthetic corpus. Only side-effect-free modules are
+imported, so nothing is written under data/ and Ollama is not contacted.
+Reports throughput, latency percentiles and peak traced memory as JSON,
+and can compare a run against a saved baseline.
+
+Usage:
+python bench_pipeline.py --size-mb 1 10 --output bench.json
+python bench_pipeline.py --size-mb 1 10 --baseline bench.json --tolerance 0.15
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from simple_rag import SimplifiedRAG
+from stage_metrics import percentile
+from text_normalize import chunk_document, clean_pdf_text
+
+VOCABULARY_SIZE = 20000
+DOCUMENT_MB = 1.0
+# Metrics where a larger value is an improvement; everything else is a cost
+HIGHER_IS_BETTER = {'mb_per_s', 'qps'}
+
+def make_vocabulary(seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        words.add(''.join(rng.choice(letters) for _ in range(rng.randint(2, 12))))
+    return sorted(words)
+
+def make_corpus(size: int, vocabulary: List[str], seed: int = 0) -> str:
+    """PDF-like text of about size characters with Zipf-distributed words
+
+    Sentences are ended with punctuation, and page markers, bullets and
+    stray whitespace are mixed in so cleaning has work to do.
+    """
+    rng = random.Random(seed)
+    weights = [1.0 / rank for rank in range(1, len(vocabulary) + 1)]
+    parts = []
+    length = 0
+    page = 1
+    while length < size:
+        words = rng.choices(vocabulary, weights, k=2000)
+        for i in range(0, len(words), rng.randint(8, 25)):
+            words[i] = words[i] + rng.choice(['.', ',', ' .', ';', '', ''])
+        block = f'\n--- Page {page} ---\n' + ' '.join(words).replace(' , ', ' •  ')
+        page += 1
+        parts.append(block)
+        length += len(block)
+    return ''.join(parts)[:size]
+
+def make_queries(vocabulary: List[str], count: int, seed: int = 0) -> Dict[str, List[str]]:
+    """Query sets by shape: common, rare, mixed, long and unknown terms"""
+    rng = random.Random(seed)
+    common = vocabulary[:50]
+    rare = vocabulary[-5000:]
+    return {
+        'common_1': [rng.choice(common) for _ in range(count)],
+        'rare_1': [rng.choice(rare) for _ in range(count)],
+        'mixed_3': [' '.join(rng.choice(common if i == 0 else vocabulary[:2000]) for i in range(3))
+                    for _ in range(count)],
+        'long_12': [' '.join(rng.choice(vocabulary[:5000]) for _ in range(12)) for _ in range(count)],
+        'unknown_3': [' '.join(f'zz{rng.randint(0, 10 ** 6)}q' for _ in range(3)) for _ in range(count)]
+    }
+
+def latency_stats(samples: List[float]) -> Dict:
+    total = sum(samples)
+    return {
+        'queries': len(samples),
+        'qps': round(len(samples) / total, 1) if total else 0.0,
+        'p50_ms': round(percentile(samples, 0.50) * 1000, 4),
+        'p95_ms': round(percentile(samples, 0.95) * 1000, 4),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 4)
+    }
+
+def time_call(fn: Callable, repeat: int):
+    """Best-of-repeat wall time and the last result"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def peak_memory(fn: Callable) -> float:
+    """Peak traced allocation of one call, in MB"""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+def throughput(name: str, fn: Callable, size: int, repeat: int, memory: bool) -> Dict:
+    seconds, _ = time_call(fn, repeat)
+    result = {'seconds': round(seconds, 4), 'mb_per_s': round(size / seconds / 1e6, 2)}
+    if memory:
+        result['peak_mb'] = round(peak_memory(fn), 2)
+    print(f"{name}\t{result['seconds']:.3f}s\t{result['mb_per_s']:.1f} MB/s"
+          + (f"\t{result['peak_mb']:.1f} MB peak" if memory else ''), file=sys.stderr)
+    return result
+
+def split_documents(text: str) -> List[Tuple[str, str]]:
+    step = int(DOCUMENT_MB * 1e6)
+    return [(f'doc{i // step:05d}', text[i:i + step]) for i in range(0, len(text), step)]
+
+def run_size(size_mb: float, args, vocabulary: List[str], queries: Dict[str, List[str]]) -> Dict:
+    size = int(size_mb * 1e6)
+    label = f'{size_mb:g}MB'
+    raw = make_corpus(size, vocabulary, seed=args.seed)
+    results = {}
+
+    results[f'clean_extracted_text/{label}'] = throughput(
+        f'clean/{label}', lambda: clean_pdf_text(raw), size, args.repeat, args.memory)
+    text = clean_pdf_text(raw)
+    results[f'chunk_document/{label}'] = throughput(
+        f'chunk_document/{label}', lambda: chunk_document(text), size, args.repeat, args.memory)
+
+    rag = SimplifiedRAG()
+    results[f'create_chunks/{label}'] = throughput(
+        f'create_chunks/{label}', lambda: rag._create_chunks(text, 500), size, args.repeat, args.memory)
+
+    docs = split_documents(text)
+
+    def index_all(target):
+        for doc_id, content in docs:
+            target.index_document(doc_id, content)
+
+    # Indexing is measured once per repeat on a fresh index
+    results[f'index_document/{label}'] = throughput(
+        f'index_document/{label}', lambda: index_all(SimplifiedRAG()), size, args.repeat, args.memory)
+
+    index_all(rag)
+    first_doc = docs[0][0]
+    for shape, query_list in queries.items():
+        samples = []
+        for query in query_list:
+            start = time.perf_counter()
+            rag.retrieve(first_doc, query, top_k=3)
+            samples.append(time.perf_counter() - start)
+        results[f'retrieve/{shape}/{label}'] = latency_stats(samples)
+
+        samples = []
+        for query in query_list[:args.corpus_queries]:
+            start = time.perf_counter()
+            rag.retrieve_corpus(query, top_k=3)
+            samples.append(time.perf_counter() - start)
+        results[f'retrieve_corpus/{shape}/{label}'] = latency_stats(samples)
+        print(f"retrieve/{shape}/{label}\tp95 {results[f'retrieve/{shape}/{label}']['p95_ms']:.3f} ms"
+              f"\tcorpus p95 {results[f'retrieve_corpus/{shape}/{label}']['p95_ms']:.3f} ms", file=sys.stderr)
+    return results
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[Dict]:
+    """Metrics that got worse than the baseline by more than tolerance"""
+    regressions = []
+    for name, metrics in sorted(current.items()):
+        old = baseline.get(name)
+        if not old:
+            continue
+        for metric, value in metrics.items():
+            before = old.get(metric)
+            if metric == 'queries' or not before or not value:
+                continue
+            change = value / before - 1
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if worse > tolerance:
+                regressions.append({'benchmark': name, 'metric': metric, 'baseline': before,
+                                    'current': value, 'change': round(change, 4)})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ingestion and retrieval hot paths.')
+    parser.add_argument('--size-mb', type=float, nargs='+', default=[1, 10],
+                        help='Corpus sizes in MB, e.g., --size-mb 1 10 100')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per throughput measurement (best is reported)')
+    parser.add_argument('--queries', type=int, default=200, help='Queries per shape for retrieve')
+    parser.add_argument('--corpus-queries', type=int, default=50, help='Queries per shape for retrieve_corpus')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the corpus and queries')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='Skip the (slow) traced peak-memory pass')
+    parser.add_argument('--output', help='Write results JSON to this path (default: stdout)')
+    parser.add_argument('--baseline', help='Results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='Allowed relative slowdown before a metric counts as a regression')
+    args = parser.parse_args()
+
+    vocabulary = make_vocabulary(args.seed)
+    queries = make_queries(vocabulary, args.queries, seed=args.seed)
+
+    # Indexing logs to stdout, which is reserved for the JSON
+    results = {}
+    with redirect_stdout(sys.stderr):
+        for size_mb in args.size_mb:
+            results.update(run_size(size_mb, args, vocabulary, queries))
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sizes_mb': args.size_mb,
+            'repeat': args.repeat,
+            'seed': args.seed
+        },
+        'results': results
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        report['regressions'] = regressions
+        for r in regressions:
+            print(f"REGRESSION {r['benchmark']} {r['metric']}: {r['baseline']} -> {r['current']} "
+                  f"({r['change']:+.1%})", file=sys.stderr)
+        if regressions:
+            exit_code = 1
+        else:
+            print(f'No regressions beyond {args.tolerance:.0%} against {args.baseline}', file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        print(f'Saved results to: {args.output}', file=sys.stderr)
+    else:
+        print(output)
+    sys.exit(exit_code)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+# context_packer.py - Fit retrieved chunks into a per-model prompt token budget
+import math
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from simple_rag import tokenize
+
+# Word pieces of at most 6 characters and single punctuation marks: a
+# tokenizer-free estimate that errs high for BPE models on English text
+TOKEN_PIECE = re.compile(r"\w{1,6}|[^\w\s]")
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+# Shared words needed before two chunks count as overlapping
+MIN_OVERLAP_WORDS = 8
+# Longer "sentences" (PDF text without punctuation) are cut into windows
+MAX_SENTENCE_WORDS = 60
+# Sentences shorter than this are never dropped as duplicates
+MIN_DUPLICATE_WORDS = 4
+
+# Ollama's context window when num_ctx is not set, and room kept for the
+# instructions and question around the excerpts
+DEFAULT_NUM_CTX = 2048
+PROMPT_RESERVE = 256
+
+# Marks sentences left out between two kept ones
+GAP = '...'
+
+def approx_tokens(text: str) -> int:
+    """Approximate prompt tokens in text without a model tokenizer"""
+    return len(TOKEN_PIECE.findall(text))
+
+def overlap_words(head: List[str], tail: List[str], min_words: int = MIN_OVERLAP_WORDS) -> int:
+    """Length of the longest suffix of head that is a prefix of tail (0 if shorter than min_words)"""
+    if not head or not tail:
+        return 0
+    first = tail[0]
+    for position in range(max(0, len(head) - len(tail)), len(head) - min_words + 1):
+        if head[position] == first and head[position:] == tail[:len(head) - position]:
+            return len(head) - position
+    return 0
+
+def merge_overlapping(texts: Sequence[str]) -> List[str]:
+    """Join chunks that overlap (consecutive chunks of one document) and drop contained ones
+
+    Each merged passage takes the place of its best-ranked chunk, so the
+    result stays in retrieval order.
+    """
+    passages = [text.split() for text in texts if text.strip()]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(passages)):
+            for j in range(len(passages)):
+                if i == j:
+                    continue
+                a, b = passages[i], passages[j]
+                if len(b) <= len(a) and f" {' '.join(b)} " in f" {' '.join(a)} ":
+                    combined = a
+                else:
+                    shared = overlap_words(a, b)
+                    if not shared:
+                        continue
+                    combined = a + b[shared:]
+                first, second = min(i, j), max(i, j)
+                passages[first] = combined
+                del passages[second]
+                merged = True
+                break
+            if merged:
+                break
+    return [' '.join(words) for words in passages]
+
+def split_sentences(text: str) -> List[str]:
+    """Sentences of a passage, with run-on stretches cut into MAX_SENTENCE_WORDS windows"""
+    sentences = []
+    for sentence in SENTENCE_END.split(text):
+        words = sentence.split()
+        for start in range(0, len(words), MAX_SENTENCE_WORDS):
+            sentences.append(' '.join(words[start:start + MAX_SENTENCE_WORDS]))
+    return sentences
+
+class ContextPacker:
+    """Merge, deduplicate and trim retrieved passages to a token budget
+
+    Overlapping chunks of one source are merged and sentences already
+    given are dropped. If the passages still exceed the budget, the
+    sentences with the most (idf-weighted) query terms are kept, in
+    document order, with gaps marked by '...'. Budgets are per model,
+    and never larger than the model's context window leaves room for.
+    """
+
+    def __init__(self, default_budget: int = 1024, budgets: Optional[Dict[str, int]] = None):
+        self.default_budget = default_budget
+        self.budgets = budgets or {}
+        self.lock = threading.Lock()
+        self.counters = {'packed': 0, 'trimmed': 0, 'tokens_in': 0, 'tokens_out': 0}
+
+    @classmethod
+    def from_env(cls) -> 'ContextPacker':
+        """Budget from CONTEXT_TOKEN_BUDGET, overridden per model by
+        CONTEXT_TOKEN_BUDGETS, e.g. "qwen2.5:0.5b=1024,llama3.1:8b=4096"
+
+        Malformed entries are logged and skipped.
+        """
+        budgets = {}
+        for entry in os.environ.get('CONTEXT_TOKEN_BUDGETS', '').split(','):
+            if not entry.strip():
+                continue
+            model, _, tokens = entry.strip().rpartition('=')
+            try:
+                if not model:
+                    raise ValueError('no model name')
+                budgets[model] = int(tokens)
+            except ValueError:
+                print(f"Ignoring CONTEXT_TOKEN_BUDGETS entry {entry.strip()!r}: expected model=tokens")
+        try:
+            default_budget = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 1024))
+        except ValueError:
+            print(f"Ignoring CONTEXT_TOKEN_BUDGET {os.environ['CONTEXT_TOKEN_BUDGET']!r}: expected a number")
+            default_budget = 1024
+        return cls(default_budget=default_budget, budgets=budgets)
+
+    def budget_for(self, model: str, options: Optional[Dict] = None) -> int:
+        """Token budget for the excerpts in a prompt to model"""
+        options = options or {}
+        window = options.get('num_ctx', DEFAULT_NUM_CTX) - options.get('num_predict', 0) - PROMPT_RESERVE
+        return max(1, min(self.budgets.get(model, self.default_budget), window))
+
+    def pack(self, passages: Sequence[Tuple[Optional[str], str]], query: str,
+             budget: int) -> List[Tuple[Optional[str], str]]:
+        """Pack (source, text) passages, best first, into at most budget tokens
+
+        Only passages from the same source are merged. Sources whose
+        passages are trimmed away entirely are left out.
+        """
+        order = list(dict.fromkeys(source for source, _ in passages))
+        merged = []
+        for source in order:
+            for text in merge_overlapping([text for s, text in passages if s == source]):
+                merged.append((source, text))
+        # Interleave sources again by the rank of their best passage
+        rank = {}
+        for position, (source, text) in enumerate(passages):
+            rank.setdefault(source, position)
+        merged.sort(key=lambda item: rank[item[0]])
+
+        # (passage, position, text) of every sentence not already seen earlier
+        seen = set()
+        sentences = []
+        for number, (_, text) in enumerate(merged):
+            position = 0
+            for sentence in split_sentences(text):
+                key = ' '.join(sentence.lower().split())
+                if len(sentence.split()) >= MIN_DUPLICATE_WORDS:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                sentences.append((number, position, sentence))
+                position += 1
+
+        tokens_in = sum(approx_tokens(text) for _, text in passages)
+        costs = [approx_tokens(sentence) + 1 for _, _, sentence in sentences]
+        trimmed = sum(costs) > budget
+        if trimmed:
+            ranked = self._select(sentences, costs, query, budget)
+        else:
+            ranked = list(range(len(sentences)))
+
+        packed = self._assemble(merged, sentences, set(ranked))
+        tokens_out = approx_tokens('\n\n'.join(text for _, text in packed))
+        # Gap marks and separators are not in the sentence costs
+        while tokens_out > budget and ranked:
+            ranked.pop()
+            packed = self._assemble(merged, sentences, set(ranked))
+            tokens_out = approx_tokens('\n\n'.join(text for _, text in packed))
+
+        with self.lock:
+            self.counters['packed'] += 1
+            self.counters['trimmed'] += trimmed
+            self.counters['tokens_in'] += tokens_in
+            self.counters['tokens_out'] += tokens_out
+        return packed
+
+    def stats(self) -> Dict:
+        with self.lock:
+            data = dict(self.counters)
+        data['saved_ratio'] = round(1 - data['tokens_out'] / data['tokens_in'], 4) if data['tokens_in'] else 0.0
+        data['default_budget'] = self.default_budget
+        data['budgets'] = dict(self.budgets)
+        return data
+
+    @staticmethod
+    def _assemble(merged: List[Tuple[Optional[str], str]], sentences: List[Tuple[int, int, str]],
+                  chosen: set) -> List[Tuple[Optional[str], str]]:
+        """(source, text) passages made of the chosen sentences, in document order"""
+        packed = []
+        for number, (source, _) in enumerate(merged):
+            parts, previous = [], None
+            for index, (passage, position, sentence) in enumerate(sentences):
+                if passage != number or index not in chosen:
+                    continue
+                if previous is not None and position != previous + 1:
+                    parts.append(GAP)
+                parts.append(sentence)
+                previous = position
+            if parts:
+                packed.append((source, ' '.join(parts)))
+        return packed
+
+    @staticmethod
+    def _select(sentences: List[Tuple[int, int, str]], costs: List[int], query: str, budget: int) -> List[int]:
+        """Indices of the best sentences that fit the budget, best first
+
+        Sentences are scored by the BM25 idf (over these sentences) of the
+        distinct query terms they contain, so words in every sentence
+        count for little; ties go to better-ranked passages and earlier
+        sentences. Whatever budget remains is filled in retrieval order.
+        """
+        query_terms = set(tokenize(query))
+        terms = [set(tokenize(sentence)) & query_terms for _, _, sentence in sentences]
+        df = {term: sum(term in found for found in terms) for term in query_terms}
+        count = len(sentences)
+        idf = {term: math.log(1 + (count - df[term] + 0.5) / (df[term] + 0.5)) for term in query_terms}
+        scores = [sum(idf[term] for term in found) for found in terms]
+
+        ranked = sorted(range(count), key=lambda i: (-scores[i], sentences[i][0], sentences[i][1]))
+        chosen, used = [], 0
+        for index in ranked:
+            if used + costs[index] <= budget:
+                chosen.append(index)
+                used += costs[index]
+        return chosen
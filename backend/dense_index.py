@@ -0,0 +1,395 @@
+# dense_index.py - Dense chunk embeddings in contiguous NumPy matrices, with hybrid scoring
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ann_index import IVFIndex, top_k_indices
+
+EMBED_MODEL = os.environ.get('OLLAMA_EMBED_MODEL', 'nomic-embed-text')
+EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', 32))
+# Lexical candidates considered per dense slot when fusing scores
+HYBRID_CANDIDATES = 4
+RETRIEVAL_MODES = ('lexical', 'dense', 'hybrid')
+# Corpus search moves from an exact scan to an IVF index at this many chunks (0: never)
+ANN_MIN_CHUNKS = int(os.environ.get('ANN_MIN_CHUNKS', 50000))
+# IVF cells scanned per query: higher is slower with better recall
+ANN_NPROBE = int(os.environ.get('ANN_NPROBE', 16))
+# Query embeddings kept in memory; they never go to the persistent cache
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_EMBED_CACHE_SIZE', 1000))
+
+def embedding_key(model: str, text: str) -> str:
+    """Cache key for one text under one embedding model"""
+    return hashlib.sha256(f'{model}\0{text}'.encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    """Chunk embeddings in SQLite, keyed by model and chunk text hash
+
+    Vectors are stored as float32 bytes, so identical chunks (including
+    re-uploads and re-indexing after a restart) are embedded only once.
+    Pass path=None for memory only.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0}
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path or ':memory:', check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)')
+        self.db.commit()
+
+    @classmethod
+    def from_env(cls) -> 'EmbeddingCache':
+        """Build a cache from EMBED_CACHE_PATH"""
+        path = os.environ.get('EMBED_CACHE_PATH',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'embeddings.db'))
+        return cls(path or None)
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        with self.lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                for key, blob in self.db.execute(
+                        f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', batch):
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            self.counters['hits'] += len(found)
+            self.counters['misses'] += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, items: List[Tuple[str, np.ndarray]]):
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)',
+                                [(key, vector.astype(np.float32).tobytes()) for key, vector in items])
+            self.db.commit()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            data = dict(self.counters)
+            data['entries'] = self.db.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        return data
+
+class DenseIndex:
+    """Unit-normalized chunk embeddings, one float32 matrix per document
+
+    Scoring a document is one matrix-vector product. Corpus-wide search uses
+    a single stacked matrix that is rebuilt lazily after documents change,
+    until the corpus reaches ann_min_chunks; from then on it goes through an
+    IVFIndex that is updated on every add and remove and can be saved to
+    disk, so a restart does not have to re-read every embedding. Query
+    embeddings are kept in a bounded in-memory LRU instead of the cache.
+    """
+
+    def __init__(self, embed: Callable[[List[str]], List[List[float]]], model: str = EMBED_MODEL,
+                 cache: Optional[EmbeddingCache] = None, batch_size: int = EMBED_BATCH_SIZE,
+                 ann_min_chunks: int = ANN_MIN_CHUNKS, nprobe: int = ANN_NPROBE,
+                 query_cache_size: int = QUERY_CACHE_SIZE):
+        self.embed = embed
+        self.model = model
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self.batch_size = batch_size
+        self.matrices = {}
+        self.lock = threading.RLock()
+        self.corpus_matrix = None
+        self.corpus_keys = []
+        self.ann_min_chunks = ann_min_chunks
+        self.nprobe = nprobe
+        self.ann = None
+        # Chunk count of every document in the ANN index
+        self.ann_sizes = {}
+        self.queries = OrderedDict()
+        self.query_cache_size = query_cache_size
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.matrices or doc_id in self.ann_sizes
+
+    def __len__(self) -> int:
+        """Number of embedded documents"""
+        with self.lock:
+            return len(self.matrices.keys() | self.ann_sizes.keys())
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        """Normalized float32 matrix for texts, embedding only cache misses"""
+        keys = [embedding_key(self.model, text) for text in texts]
+        vectors = self.cache.get_many(keys)
+        missing = list(dict.fromkeys(key for key in keys if key not in vectors))
+        if missing:
+            text_by_key = dict(zip(keys, texts))
+            for start in range(0, len(missing), self.batch_size):
+                batch = missing[start:start + self.batch_size]
+                embedded = self.embed([text_by_key[key] for key in batch])
+                fresh = [(key, np.asarray(vector, dtype=np.float32)) for key, vector in zip(batch, embedded)]
+                self.cache.put_many(fresh)
+                vectors.update(fresh)
+
+        return normalized(np.stack([vectors[key] for key in keys]))
+
+    def add_document(self, doc_id: str, chunks: List[str]):
+        matrix = self.embed_texts(chunks)
+        with self.lock:
+            self.matrices[doc_id] = matrix
+            self.corpus_matrix = None
+            if self.ann is not None:
+                self._ann_remove(doc_id)
+                self.ann.add([(doc_id, idx) for idx in range(len(matrix))], matrix)
+                self.ann_sizes[doc_id] = len(matrix)
+            elif self.ann_min_chunks and sum(map(len, self.matrices.values())) >= self.ann_min_chunks:
+                self._build_ann()
+
+    def remove_document(self, doc_id: str):
+        with self.lock:
+            if self.matrices.pop(doc_id, None) is not None:
+                self.corpus_matrix = None
+            if self.ann is not None:
+                self._ann_remove(doc_id)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """Normalized query vector, from the in-memory LRU when asked recently"""
+        with self.lock:
+            vector = self.queries.get(query)
+            if vector is not None:
+                self.queries.move_to_end(query)
+                return vector
+        vector = normalized(np.asarray(self.embed([query]), dtype=np.float32))[0]
+        with self.lock:
+            self.queries[query] = vector
+            while len(self.queries) > self.query_cache_size:
+                self.queries.popitem(last=False)
+        return vector
+
+    def scores(self, doc_id: str, query_vector: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every chunk in a document"""
+        with self.lock:
+            matrix = self.matrices.get(doc_id)
+            if matrix is None:
+                # Loaded with the ANN index only: take the vectors from there
+                matrix = self.ann.get_vectors([(doc_id, idx) for idx in range(self.ann_sizes[doc_id])])
+                self.matrices[doc_id] = matrix
+        return matrix @ query_vector
+
+    def search(self, doc_id: str, query_vector: np.ndarray, top_k: int = 3) -> List[Tuple[int, float]]:
+        scores = self.scores(doc_id, query_vector)
+        return [(int(idx), float(scores[idx])) for idx in top_k_indices(scores, top_k)]
+
+    def search_corpus(self, query_vector: np.ndarray, top_k: int = 3,
+                      nprobe: Optional[int] = None) -> List[Tuple[str, int, float]]:
+        """Best (doc_id, chunk index, score) across every embedded document"""
+        with self.lock:
+            ann = self.ann if self.ann is not None and self.ann.trained else None
+            if ann is None and self.corpus_matrix is None:
+                self._build_corpus()
+            matrix, keys = self.corpus_matrix, self.corpus_keys
+        if ann is not None:
+            hits = ann.search(query_vector, top_k, nprobe or self.nprobe)
+            return [(doc_id, idx, score) for (doc_id, idx), score in hits]
+        if not keys:
+            return []
+        scores = matrix @ query_vector
+        return [(keys[idx][0], keys[idx][1], float(scores[idx])) for idx in top_k_indices(scores, top_k)]
+
+    def save_ann(self, path: str) -> bool:
+        """Write the ANN index, if there is one, atomically to path"""
+        with self.lock:
+            if self.ann is None:
+                return False
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                self.ann.save(f)
+            os.replace(path + '.tmp', path)
+            return True
+
+    def load_ann(self, path: str):
+        """Adopt a saved ANN index; its documents count as embedded"""
+        ann = IVFIndex.load(path)
+        sizes = {}
+        for doc_id, idx in ann.key_to_id:
+            sizes[doc_id] = max(sizes.get(doc_id, 0), idx + 1)
+        with self.lock:
+            self.ann = ann
+            self.ann_sizes = sizes
+
+    def stats(self) -> Dict:
+        with self.lock:
+            data = {
+                'documents': len(self.matrices.keys() | self.ann_sizes.keys()),
+                'chunks': (len(self.ann) if self.ann is not None
+                           else sum(len(matrix) for matrix in self.matrices.values())),
+                'model': self.model,
+                'ann': self.ann.stats() if self.ann is not None else None,
+                'cached_queries': len(self.queries)
+            }
+        data['cache'] = self.cache.stats()
+        return data
+
+    def _build_ann(self):
+        """Move corpus search to a freshly trained IVF index; lock held"""
+        doc_ids = sorted(self.matrices)
+        matrix = np.vstack([self.matrices[doc_id] for doc_id in doc_ids])
+        self.ann = IVFIndex(matrix.shape[1], nprobe=self.nprobe, train_size=len(matrix))
+        self.ann.add([(doc_id, idx) for doc_id in doc_ids for idx in range(len(self.matrices[doc_id]))], matrix)
+        self.ann_sizes = {doc_id: len(self.matrices[doc_id]) for doc_id in doc_ids}
+        self.corpus_matrix = None
+        self.corpus_keys = []
+
+    def _ann_remove(self, doc_id: str):
+        """Delete a document's chunks from the ANN index; lock held"""
+        size = self.ann_sizes.pop(doc_id, 0)
+        if size:
+            self.ann.delete([(doc_id, idx) for idx in range(size)])
+
+    def _build_corpus(self):
+        """Stack every document matrix into one contiguous matrix; lock held"""
+        doc_ids = sorted(self.matrices)
+        self.corpus_keys = [(doc_id, idx) for doc_id in doc_ids for idx in range(len(self.matrices[doc_id]))]
+        self.corpus_matrix = (np.vstack([self.matrices[doc_id] for doc_id in doc_ids]) if doc_ids
+                              else np.zeros((0, 0), dtype=np.float32))
+
+def normalized(matrix: np.ndarray) -> np.ndarray:
+    """Contiguous float32 copy of matrix with unit-length rows (zero rows stay zero)"""
+    matrix = np.array(matrix, dtype=np.float32, order='C')
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms > 0, norms, 1.0)
+    return matrix
+
+def fuse(lexical: Dict, dense: Dict, alpha: float, top_k: int) -> List[Tuple[object, float]]:
+    """Blend lexical and dense scores for the same keys
+
+    BM25 scores are scaled by the best lexical score and cosine scores are
+    clipped at zero, so both lie in [0, 1]; alpha weights the dense side.
+    A key missing from one side scores zero there.
+    """
+    best_lexical = max(lexical.values(), default=0.0) or 1.0
+    combined = {
+        key: alpha * max(dense.get(key, 0.0), 0.0) + (1 - alpha) * lexical.get(key, 0.0) / best_lexical
+        for key in set(lexical) | set(dense)
+    }
+    return sorted(combined.items(), key=lambda item: -item[1])[:top_k]
+
+class HybridRetriever:
+    """Lexical, dense or fused retrieval over a SimplifiedRAG and a DenseIndex
+
+    Queries never embed documents themselves: documents missing from the
+    dense index are handed to submit(work) (e.g. a background job queue)
+    to be embedded, and meanwhile a single-document query falls back to
+    lexical retrieval and corpus queries search the documents that are
+    ready. This also covers content indexed before dense retrieval was
+    enabled. Without submit, missing documents are only skipped.
+    """
+
+    def __init__(self, rag, dense: DenseIndex, submit: Optional[Callable[[Callable], object]] = None):
+        self.rag = rag
+        self.dense = dense
+        self.submit = submit
+        # Documents handed to submit and not embedded yet
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def ready(self, doc_id: str) -> bool:
+        """Whether a document can be searched densely; queues it for embedding if not"""
+        if doc_id in self.dense:
+            return True
+        self.schedule([doc_id])
+        return False
+
+    def schedule(self, doc_ids: List[str]):
+        """Queue documents that are not embedded or queued yet for background embedding"""
+        with self.lock:
+            doc_ids = [doc_id for doc_id in doc_ids if doc_id not in self.dense and doc_id not in self.pending]
+            if not doc_ids or self.submit is None:
+                return
+            self.pending.update(doc_ids)
+        try:
+            self.submit(lambda progress: self.embed_documents(doc_ids, progress))
+        except Exception:
+            with self.lock:
+                self.pending.difference_update(doc_ids)
+            raise
+
+    def embed_documents(self, doc_ids: List[str], progress: Optional[Callable] = None) -> Dict:
+        """Embed documents still in the RAG index; failures are retried on a later query"""
+        embedded = 0
+        try:
+            for number, doc_id in enumerate(doc_ids, 1):
+                if doc_id in self.rag and doc_id not in self.dense:
+                    try:
+                        self.dense.add_document(doc_id, self.rag.chunk_texts(doc_id))
+                        embedded += 1
+                    except Exception as e:
+                        print(f"Embedding content {doc_id[:8]} failed: {e}")
+                with self.lock:
+                    self.pending.discard(doc_id)
+                if progress:
+                    progress(documents_done=number, total_documents=len(doc_ids))
+        finally:
+            with self.lock:
+                self.pending.difference_update(doc_ids)
+        return {'embedded': embedded, 'documents': len(doc_ids)}
+
+    def retrieve(self, doc_id: str, query: str, top_k: int = 3, mode: str = 'hybrid',
+                 alpha: float = 0.5) -> List[str]:
+        """Chunk texts for a query against one document, best first"""
+        if mode == 'lexical' or not self.ready(doc_id):
+            return self.rag.retrieve(doc_id, query, top_k=top_k)
+
+        query_vector = self.dense.embed_query(query)
+        if mode == 'dense':
+            ranked = self.dense.search(doc_id, query_vector, top_k)
+        else:
+            scores = self.dense.scores(doc_id, query_vector)
+            lexical = dict(self.rag.score_chunks(doc_id, query, top_k * HYBRID_CANDIDATES))
+            dense = {int(idx): float(scores[idx]) for idx in top_k_indices(scores, top_k * HYBRID_CANDIDATES)}
+            # Exact dense scores for lexical candidates outside the dense top list
+            dense.update({idx: float(scores[idx]) for idx in lexical})
+            ranked = fuse(lexical, dense, alpha, top_k)
+        return self.rag.chunk_texts(doc_id, [idx for idx, _ in ranked])
+
+    def retrieve_corpus(self, query: str, top_k: int = 3, mode: str = 'hybrid',
+                        alpha: float = 0.5) -> List[Dict]:
+        """Hits across every document, shaped like SimplifiedRAG.retrieve_corpus
+
+        Documents not embedded yet are left out of the dense side (in
+        hybrid mode they still compete on their lexical score); with none
+        embedded at all the search is lexical.
+        """
+        if mode == 'lexical':
+            return self.rag.retrieve_corpus(query, top_k=top_k)
+        self.schedule([doc_id for doc_id in self.rag.document_ids() if doc_id not in self.dense])
+        if not len(self.dense):
+            return self.rag.retrieve_corpus(query, top_k=top_k)
+
+        query_vector = self.dense.embed_query(query)
+        candidates = top_k if mode == 'dense' else top_k * HYBRID_CANDIDATES
+        dense = {(doc_id, idx): score for doc_id, idx, score in self.dense.search_corpus(query_vector, candidates)}
+        if mode == 'dense':
+            ranked = sorted(dense.items(), key=lambda item: -item[1])
+        else:
+            lexical = dict(self.rag.score_corpus(query, top_k=candidates))
+            # One matrix-vector product per document, however many of its chunks are candidates
+            doc_scores = {}
+            for doc_id, idx in lexical:
+                if (doc_id, idx) not in dense and doc_id in self.dense:
+                    if doc_id not in doc_scores:
+                        doc_scores[doc_id] = self.dense.scores(doc_id, query_vector)
+                    dense[(doc_id, idx)] = float(doc_scores[doc_id][idx])
+            ranked = fuse(lexical, dense, alpha, top_k)
+        return [
+            {
+                'document_id': doc_id,
+                'chunk_index': idx,
+                'score': score,
+                'text': self.rag.chunk_texts(doc_id, [idx])[0]
+            }
+            for (doc_id, idx), score in ranked
+        ]
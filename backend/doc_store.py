@@ -0,0 +1,359 @@
+# doc_store.py - Persistent document store with an in-memory working set
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# Extracted text and RAG index data are keyed by the SHA-256 of the source
+# bytes, so re-uploading the same file only adds a row to documents.
+# Map-reduce section summaries are keyed by the hash of the section text,
+# so they are shared by every document containing that section.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS contents (
+    hash TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    content_length INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    content_length INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    summary TEXT,
+    source_type TEXT,
+    source_url TEXT
+);
+CREATE INDEX IF NOT EXISTS documents_content_hash ON documents (content_hash);
+CREATE TABLE IF NOT EXISTS qa_history (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    document_id TEXT NOT NULL,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS qa_history_document ON qa_history (document_id, seq);
+CREATE TABLE IF NOT EXISTS rag_index (
+    content_hash TEXT PRIMARY KEY,
+    postings BLOB NOT NULL,
+    chunk_lengths TEXT NOT NULL,
+    chunks BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS section_summaries (
+    model TEXT NOT NULL,
+    section_hash TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    PRIMARY KEY (model, section_hash)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    job TEXT NOT NULL,
+    finished_at TEXT
+);
+'''
+
+DOCUMENT_COLUMNS = ('id', 'filename', 'content_hash', 'content_length', 'created_at',
+                    'summary', 'source_type', 'source_url')
+
+def pack(value) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+def unpack(blob: bytes):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+class DocumentStore:
+    """SQLite-backed documents, Q&A history and RAG index data
+
+    Full document records (content, summary, qa_history) are loaded lazily
+    and kept in an LRU of at most max_cached entries. Records returned by
+    get() are shared with the cache; change them only through set_summary()
+    and append_qa() so the change is persisted.
+
+    A shared store is written by several processes at once, so get() reads
+    the mutable fields (summary, qa_history) from SQLite on every call and
+    only content and metadata are served from the working set.
+    """
+
+    def __init__(self, path: str = ':memory:', max_cached: int = 64, shared: bool = False):
+        self.path = path
+        self.max_cached = max_cached
+        self.shared = shared
+        self.cache = OrderedDict()
+        self.lock = threading.RLock()
+        self.counters = {'cache_hits': 0, 'cache_misses': 0, 'evictions': 0}
+
+        if path != ':memory:':
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        if path != ':memory:':
+            self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    @classmethod
+    def from_env(cls) -> 'DocumentStore':
+        """Build a store from DOCSTORE_* environment variables
+
+        DOCSTORE_SHARED defaults to on when RAG_SEGMENTS_PATH is set, since
+        that is how several worker processes share one store.
+        """
+        path = os.environ.get('DOCSTORE_PATH',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'askdocai.db'))
+        shared = os.environ.get('DOCSTORE_SHARED', '1' if os.environ.get('RAG_SEGMENTS_PATH') else '0')
+        return cls(path=path, max_cached=int(os.environ.get('DOCSTORE_CACHE_SIZE', 64)),
+                   shared=shared not in ('', '0', 'false'))
+
+    def __contains__(self, doc_id) -> bool:
+        with self.lock:
+            if doc_id in self.cache and not self.shared:
+                return True
+            row = self.db.execute('SELECT 1 FROM documents WHERE id = ?', (doc_id,)).fetchone()
+            return row is not None
+
+    def __getitem__(self, doc_id) -> Dict:
+        record = self.get(doc_id)
+        if record is None:
+            raise KeyError(doc_id)
+        return record
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+    def add_content(self, content_hash: str, content: str, content_length: Optional[int] = None):
+        """Store extracted text once per content hash"""
+        with self.lock:
+            self.db.execute(
+                'INSERT OR IGNORE INTO contents (hash, content, content_length) VALUES (?, ?, ?)',
+                (content_hash, content, len(content) if content_length is None else content_length)
+            )
+            self.db.commit()
+
+    def get_content(self, content_hash: str) -> Optional[Dict]:
+        """Stored text for a content hash, or None if it was never extracted"""
+        with self.lock:
+            row = self.db.execute('SELECT content, content_length FROM contents WHERE hash = ?',
+                                  (content_hash,)).fetchone()
+        return {'content': row[0], 'content_length': row[1]} if row else None
+
+    def find_by_hash(self, content_hash: str) -> Optional[Dict]:
+        """The oldest document record sharing a content hash"""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT id FROM documents WHERE content_hash = ? ORDER BY created_at LIMIT 1',
+                (content_hash,)
+            ).fetchone()
+        return self.get(row[0]) if row else None
+
+    def add(self, doc: Dict):
+        """Insert a new document record; its content must already be stored"""
+        record = {column: doc.get(column) for column in DOCUMENT_COLUMNS}
+        with self.lock:
+            self.db.execute(
+                f"INSERT OR REPLACE INTO documents ({', '.join(DOCUMENT_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in DOCUMENT_COLUMNS)})",
+                [record[column] for column in DOCUMENT_COLUMNS]
+            )
+            self.db.execute('DELETE FROM qa_history WHERE document_id = ?', (record['id'],))
+            self.db.commit()
+            self.cache.pop(record['id'], None)
+
+    def get(self, doc_id: str) -> Optional[Dict]:
+        """Return the full document record, loading it from disk if needed"""
+        with self.lock:
+            if doc_id in self.cache:
+                self.cache.move_to_end(doc_id)
+                self.counters['cache_hits'] += 1
+                if self.shared:
+                    return self._refresh(doc_id, self.cache[doc_id])
+                return self.cache[doc_id]
+
+            row = self.db.execute(
+                f"SELECT {', '.join('d.' + column for column in DOCUMENT_COLUMNS)}, c.content "
+                'FROM documents d JOIN contents c ON c.hash = d.content_hash WHERE d.id = ?', (doc_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.counters['cache_misses'] += 1
+
+            record = self._without_nulls(dict(zip(DOCUMENT_COLUMNS + ('content',), row)))
+            record['qa_history'] = self._qa_history(doc_id)
+            self._remember(doc_id, record)
+            return dict(record) if self.shared else record
+
+    def list(self) -> List[Dict]:
+        """Metadata for every document, without loading content"""
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT id, filename, content_length, created_at, summary IS NOT NULL '
+                'FROM documents ORDER BY created_at'
+            ).fetchall()
+        return [
+            {
+                'id': doc_id,
+                'filename': filename,
+                'content_length': content_length,
+                'created_at': created_at,
+                'has_summary': bool(has_summary)
+            }
+            for doc_id, filename, content_length, created_at, has_summary in rows
+        ]
+
+    def set_summary(self, doc_id: str, summary: str):
+        with self.lock:
+            self.db.execute('UPDATE documents SET summary = ? WHERE id = ?', (summary, doc_id))
+            self.db.commit()
+            if doc_id in self.cache:
+                self.cache[doc_id]['summary'] = summary
+
+    def append_qa(self, doc_id: str, entry: Dict):
+        with self.lock:
+            self.db.execute('INSERT INTO qa_history (document_id, entry) VALUES (?, ?)',
+                            (doc_id, json.dumps(entry)))
+            self.db.commit()
+            if doc_id in self.cache:
+                self.cache[doc_id]['qa_history'].append(entry)
+
+    def append_qa_batch(self, records: List[Tuple[str, Dict]]):
+        """Append many (doc_id, entry) pairs in one transaction"""
+        with self.lock:
+            with self.db:
+                self.db.executemany('INSERT INTO qa_history (document_id, entry) VALUES (?, ?)',
+                                    [(doc_id, json.dumps(entry)) for doc_id, entry in records])
+            for doc_id, entry in records:
+                if doc_id in self.cache:
+                    self.cache[doc_id]['qa_history'].append(entry)
+
+    def delete(self, doc_id: str) -> Optional[str]:
+        """Delete a document; returns its content hash if nothing else uses it"""
+        with self.lock:
+            row = self.db.execute('SELECT content_hash FROM documents WHERE id = ?', (doc_id,)).fetchone()
+            self.db.execute('DELETE FROM documents WHERE id = ?', (doc_id,))
+            self.db.execute('DELETE FROM qa_history WHERE document_id = ?', (doc_id,))
+            self.cache.pop(doc_id, None)
+            orphaned = None
+            if row and not self.db.execute('SELECT 1 FROM documents WHERE content_hash = ?', row).fetchone():
+                orphaned = row[0]
+                self.db.execute('DELETE FROM contents WHERE hash = ?', row)
+                self.db.execute('DELETE FROM rag_index WHERE content_hash = ?', row)
+            self.db.commit()
+            return orphaned
+
+    def save_index(self, content_hash: str, postings: Dict, chunk_lengths: List[int], chunks: List[str]):
+        """Persist the RAG postings and chunk texts for one content hash"""
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO rag_index (content_hash, postings, chunk_lengths, chunks) '
+                'VALUES (?, ?, ?, ?)',
+                (content_hash, pack(postings), json.dumps(chunk_lengths), pack(chunks))
+            )
+            self.db.commit()
+
+    def iter_indexes(self):
+        """Yield (content_hash, postings, chunk_lengths) for every indexed content"""
+        with self.lock:
+            rows = self.db.execute('SELECT content_hash, postings, chunk_lengths FROM rag_index').fetchall()
+        for content_hash, postings, chunk_lengths in rows:
+            yield content_hash, unpack(postings), json.loads(chunk_lengths)
+
+    def unindexed_contents(self) -> List[str]:
+        """Content hashes that have text but no RAG index yet"""
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT hash FROM contents WHERE hash NOT IN (SELECT content_hash FROM rag_index)'
+            ).fetchall()
+        return [content_hash for (content_hash,) in rows]
+
+    def load_chunks(self, content_hash: str) -> Optional[List[str]]:
+        with self.lock:
+            row = self.db.execute('SELECT chunks FROM rag_index WHERE content_hash = ?',
+                                  (content_hash,)).fetchone()
+        return unpack(row[0]) if row else None
+
+    def section_summaries(self, model: str, section_hashes: List[str]) -> Dict[str, str]:
+        """Stored summaries by section hash, for the sections that have one"""
+        with self.lock:
+            found = {}
+            unique = list(dict.fromkeys(section_hashes))
+            # Stay under SQLite's bound-parameter limit on very long documents
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                found.update(self.db.execute(
+                    'SELECT section_hash, summary FROM section_summaries WHERE model = ? '
+                    f"AND section_hash IN ({', '.join('?' for _ in batch)})", [model] + batch
+                ).fetchall())
+        return found
+
+    def save_section_summaries(self, model: str, summaries: Dict[str, str]):
+        with self.lock:
+            with self.db:
+                self.db.executemany(
+                    'INSERT OR REPLACE INTO section_summaries (model, section_hash, summary) VALUES (?, ?, ?)',
+                    [(model, section_hash, summary) for section_hash, summary in summaries.items()]
+                )
+
+    def save_job(self, job: Dict):
+        """Write an ingestion job's current state, so any process can report it"""
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO jobs (id, job, finished_at) VALUES (?, ?, ?)',
+                            (job['id'], json.dumps(job), job.get('finished_at')))
+            self.db.commit()
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        with self.lock:
+            row = self.db.execute('SELECT job FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def prune_jobs(self, keep: int):
+        """Forget all but the newest keep finished jobs"""
+        with self.lock:
+            self.db.execute(
+                'DELETE FROM jobs WHERE finished_at IS NOT NULL AND id NOT IN '
+                '(SELECT id FROM jobs WHERE finished_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?)',
+                (keep,)
+            )
+            self.db.commit()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            data = dict(self.counters)
+            data['documents_cached'] = len(self.cache)
+            data['max_cached'] = self.max_cached
+            data['contents_stored'] = self.db.execute('SELECT COUNT(*) FROM contents').fetchone()[0]
+        data['documents_stored'] = len(self)
+        return data
+
+    def _qa_history(self, doc_id: str) -> List[Dict]:
+        return [
+            json.loads(entry) for (entry,) in self.db.execute(
+                'SELECT entry FROM qa_history WHERE document_id = ? ORDER BY seq', (doc_id,)
+            )
+        ]
+
+    def _refresh(self, doc_id: str, record: Dict) -> Optional[Dict]:
+        """A copy of a cached record with summary and qa_history as other processes left them"""
+        row = self.db.execute('SELECT summary FROM documents WHERE id = ?', (doc_id,)).fetchone()
+        if row is None:
+            # Deleted by another process
+            self.cache.pop(doc_id, None)
+            return None
+        return dict(record, summary=row[0], qa_history=self._qa_history(doc_id))
+
+    def _remember(self, doc_id: str, record: Dict):
+        """Insert into the working set, evicting the least recently used record"""
+        self.cache[doc_id] = record
+        self.cache.move_to_end(doc_id)
+        while len(self.cache) > self.max_cached:
+            self.cache.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    @staticmethod
+    def _without_nulls(record: Dict) -> Dict:
+        """Drop unset optional columns so doc.get(key, default) keeps working"""
+        return {
+            key: value for key, value in record.items()
+            if value is not None or key == 'summary'
+        }
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Evaluate SimplifiedRAG retrieval quality and latency in one run
+
+Indexes a corpus with SimplifiedRAG.index_document, runs every labeled
+query through retrieval, and scores the ranked chunk ids with
+retrieval_metrics (Recall, MRR, nDCG and MAP at each k) next to
+per-query latency percentiles. Queries run one at a time by default;
+--workers N spreads them over N processes, each indexing the corpus for
+itself first (BM25 scoring holds the GIL, so threads would only contend).
+
+Corpus (--corpus):
+- a directory of .txt, .md or .pdf files (document id = file name), or
+- a .jsonl file with {"id": ..., "text": ...} per line
+
+Queries (--queries), .jsonl or .csv with:
+- query_id, query
+- relevant_ids: document ids ("manual.pdf") or chunk ids ("manual.pdf#3");
+  semicolon-separated in CSV, a list in JSONL
+- or answers: text that a relevant chunk must contain (case-insensitive),
+  which keeps labels valid when chunking changes
+- document_id (optional): search only this document instead of the corpus
+
+Usage:
+python eval_retrieval.py --corpus docs/ --queries queries.jsonl --ks 1 3 5 10 --output per_query.csv
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+from typing import Dict, List, Tuple
+
+from retrieval_metrics import METRICS, evaluate, parse_list
+from simple_rag import SimplifiedRAG
+from stage_metrics import percentile
+from text_normalize import clean_pdf_text
+
+def load_corpus(path: str) -> List[Tuple[str, str]]:
+    """(document id, text) pairs from a directory or a .jsonl file"""
+    if os.path.isdir(path):
+        corpus = []
+        for name in sorted(os.listdir(path)):
+            full_path = os.path.join(path, name)
+            extension = os.path.splitext(name)[1].lower()
+            if extension in ('.txt', '.md'):
+                with open(full_path, 'r', encoding='utf-8', errors='replace') as f:
+                    corpus.append((name, f.read()))
+            elif extension == '.pdf':
+                import pdf_extract
+                with open(full_path, 'rb') as f:
+                    corpus.append((name, clean_pdf_text(pdf_extract.extract_text(f.read()))))
+        return corpus
+    with open(path, 'r', encoding='utf-8') as f:
+        return [(str(doc['id']), doc['text']) for doc in (json.loads(line) for line in f if line.strip())]
+
+def load_queries(path: str) -> List[Dict]:
+    if path.endswith('.jsonl'):
+        with open(path, 'r', encoding='utf-8') as f:
+            queries = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            queries = list(csv.DictReader(f))
+    for i, query in enumerate(queries):
+        query.setdefault('query_id', str(i))
+        for field in ('relevant_ids', 'answers'):
+            if isinstance(query.get(field), str):
+                query[field] = parse_list(query[field])
+    return queries
+
+class Evaluator:
+    """Index a corpus once, then retrieve and label results for many queries"""
+
+    def __init__(self, rag: SimplifiedRAG, top_k: int):
+        self.rag = rag
+        self.top_k = top_k
+        # Chunk texts per document, for labeling by answer text
+        self.chunks = {}
+
+    def index(self, corpus: List[Tuple[str, str]], chunk_size: int) -> float:
+        start = time.perf_counter()
+        for doc_id, text in corpus:
+            self.rag.index_document(doc_id, text, chunk_size=chunk_size)
+        elapsed = time.perf_counter() - start
+        for doc_id, _ in corpus:
+            self.chunks[doc_id] = self.rag.chunk_texts(doc_id)
+        return elapsed
+
+    def run_query(self, query: Dict) -> Tuple[List[Tuple[str, int, str]], float]:
+        """Ranked (document id, chunk index, text) hits and the retrieval time
+
+        A query matching no chunk has no hits (retrieve() would fall back to
+        the first chunk, which is not a retrieval result).
+        """
+        start = time.perf_counter()
+        doc_id = query.get('document_id')
+        if doc_id:
+            ranked = self.rag.score_chunks(doc_id, query['query'], top_k=self.top_k)
+            texts = self.rag.chunk_texts(doc_id, [idx for idx, _ in ranked]) if ranked else []
+            elapsed = time.perf_counter() - start
+            hits = [(doc_id, idx, text) for (idx, _), text in zip(ranked, texts)]
+        else:
+            # Document-level labels need top_k distinct documents, which may
+            # take more than top_k chunks
+            wanted = self.top_k
+            while True:
+                results = self.rag.retrieve_corpus(query['query'], top_k=wanted)
+                if (not document_level(query) or len(results) < wanted
+                        or len({hit['document_id'] for hit in results}) >= self.top_k):
+                    break
+                wanted *= 2
+            elapsed = time.perf_counter() - start
+            hits = [(hit['document_id'], hit['chunk_index'], hit['text']) for hit in results]
+        return hits, elapsed
+
+    def label(self, query: Dict, hits: List[Tuple[str, int, str]]) -> Tuple[List[str], List[str]]:
+        """Relevant and retrieved ids on the same level as the query's labels"""
+        retrieved = [f'{doc_id}#{idx}' for doc_id, idx, _ in hits]
+        answers = [answer.lower() for answer in query.get('answers') or []]
+        if answers:
+            # Every chunk that contains an answer counts as relevant
+            relevant = [
+                f'{doc_id}#{idx}'
+                for doc_id, chunks in self.scope(query).items()
+                for idx, text in enumerate(chunks)
+                if any(answer in text.lower() for answer in answers)
+            ]
+            return relevant, retrieved
+
+        relevant = list(query.get('relevant_ids') or [])
+        if document_level(query):
+            # Rank documents by their best chunk
+            retrieved = list(dict.fromkeys(doc_id for doc_id, _, _ in hits))[:self.top_k]
+        return relevant, retrieved
+
+    def scope(self, query: Dict) -> Dict[str, List[str]]:
+        doc_id = query.get('document_id')
+        return {doc_id: self.chunks[doc_id]} if doc_id else self.chunks
+
+def document_level(query: Dict) -> bool:
+    """Whether a query is labeled with document ids rather than chunks or answers"""
+    relevant = query.get('relevant_ids')
+    return bool(relevant) and not query.get('answers') and all('#' not in rid for rid in relevant)
+
+# Each --workers process holds its own index, built by init_worker
+worker_evaluator = None
+
+def init_worker(corpus: List[Tuple[str, str]], chunk_size: int, k1: float, b: float, top_k: int, ready):
+    global worker_evaluator
+    with redirect_stdout(sys.stderr):
+        worker_evaluator = Evaluator(SimplifiedRAG(k1=k1, b=b), top_k)
+        worker_evaluator.index(corpus, chunk_size)
+    ready.wait()
+
+def run_in_worker(query: Dict) -> Tuple[List[Tuple[str, int, str]], float]:
+    return worker_evaluator.run_query(query)
+
+def run_queries(evaluator: Evaluator, queries: List[Dict], workers: int, corpus: List[Tuple[str, str]],
+                chunk_size: int) -> Tuple[List, float]:
+    """Per-query (hits, seconds) and the wall time for all of them
+
+    With several workers the clock starts once every worker has indexed.
+    """
+    if workers <= 1:
+        start = time.perf_counter()
+        outcomes = [evaluator.run_query(query) for query in queries]
+        return outcomes, time.perf_counter() - start
+
+    context = multiprocessing.get_context()
+    ready = context.Barrier(workers + 1)
+    rag = evaluator.rag
+    with context.Pool(workers, initializer=init_worker,
+                      initargs=(corpus, chunk_size, rag.k1, rag.b, evaluator.top_k, ready)) as pool:
+        ready.wait()
+        start = time.perf_counter()
+        outcomes = pool.map(run_in_worker, queries)
+        return outcomes, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate SimplifiedRAG retrieval quality and latency.')
+    parser.add_argument('--corpus', required=True, help='Directory of documents or a .jsonl corpus.')
+    parser.add_argument('--queries', required=True, help='Labeled queries (.jsonl or .csv).')
+    parser.add_argument('--ks', nargs='+', type=int, default=[1, 3, 5, 10],
+                        help='List of k values, e.g., --ks 1 3 5 10')
+    parser.add_argument('--chunk-size', type=int, default=500, help='Words per chunk when indexing.')
+    parser.add_argument('--k1', type=float, default=1.5, help='BM25 k1.')
+    parser.add_argument('--b', type=float, default=0.75, help='BM25 b.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processes issuing queries (1 times each query without contention).')
+    parser.add_argument('--output', help='Per-query CSV (retrieval_metrics.py input format plus latency).')
+    parser.add_argument('--json', help='Write the summary as JSON to this path.')
+    args = parser.parse_args()
+
+    ks = sorted(set(args.ks))
+    corpus = load_corpus(args.corpus)
+    queries = load_queries(args.queries)
+    if not corpus or not queries:
+        print('Corpus or query set is empty.')
+        return
+
+    # Index logging goes to stderr so stdout holds only the report
+    with redirect_stdout(sys.stderr):
+        evaluator = Evaluator(SimplifiedRAG(k1=args.k1, b=args.b), top_k=max(ks))
+        index_seconds = evaluator.index(corpus, args.chunk_size)
+
+    outcomes, wall_seconds = run_queries(evaluator, queries, args.workers, corpus, args.chunk_size)
+
+    rows = []
+    for query, (hits, elapsed) in zip(queries, outcomes):
+        relevant, retrieved = evaluator.label(query, hits)
+        rows.append({
+            'query_id': query['query_id'],
+            'relevant_ids': ';'.join(relevant),
+            'retrieved_ids': ';'.join(retrieved),
+            'latency_ms': f'{elapsed * 1000:.3f}'
+        })
+
+    results = evaluate(iter([[(row['relevant_ids'], row['retrieved_ids']) for row in rows]]), ks)
+    latencies = [elapsed for _, elapsed in outcomes]
+    unlabeled = sum(1 for row in rows if not row['relevant_ids'])
+    summary = {
+        'documents': len(corpus),
+        'chunks': evaluator.rag.total_chunks,
+        'queries': len(queries),
+        'unlabeled_queries': unlabeled,
+        'index_seconds': round(index_seconds, 3),
+        'qps': round(len(queries) / wall_seconds, 1) if wall_seconds else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99': round(percentile(latencies, 0.99) * 1000, 3)
+        },
+        'metrics': {name: {str(k): round(results[name][k], 6) for k in ks} for name in METRICS},
+        'params': {'chunk_size': args.chunk_size, 'k1': args.k1, 'b': args.b, 'workers': args.workers}
+    }
+
+    # Pretty print
+    print('=== Retrieval Evaluation ===')
+    print(f"{summary['documents']} documents, {summary['chunks']} chunks, {summary['queries']} queries"
+          f" ({unlabeled} without relevant chunks), indexed in {summary['index_seconds']}s")
+    print('k\t' + '\t'.join(f'{name}@k' for name in METRICS))
+    for k in ks:
+        print('\t'.join([str(k)] + [f'{results[name][k]:.6f}' for name in METRICS]))
+    print(f"\nLatency p50 {summary['latency_ms']['p50']} ms, p95 {summary['latency_ms']['p95']} ms,"
+          f" p99 {summary['latency_ms']['p99']} ms, {summary['qps']} queries/s")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['query_id', 'relevant_ids', 'retrieved_ids', 'latency_ms'])
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f'\nSaved per-query results to: {args.output}')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        print(f'Saved summary to: {args.json}')
+
+if __name__ == '__main__':
+    main()
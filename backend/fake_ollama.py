@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Ollama HTTP API, for load tests and CI
+
+Implements /api/generate (streaming and non-streaming), /api/tags,
+/api/embeddings and /api/embed. Answers are deterministic for a given
+prompt; latency, token rate and injected failures are configurable.
+Embeddings are hashed bag-of-words vectors, so texts that share words
+get similar vectors.
+
+Usage:
+python fake_ollama.py --port 11434 --latency 0.2 --tokens-per-sec 40 --error-rate 0.01
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+from simple_rag import tokenize
+
+WORDS = ['the', 'document', 'describes', 'pressure', 'valve', 'system', 'and', 'its', 'operation',
+         'in', 'detail', 'including', 'safety', 'steps', 'for', 'maintenance', 'of', 'key', 'parts',
+         'with', 'reference', 'to', 'section', 'results', 'show', 'that', 'a', 'reset', 'is', 'needed']
+
+class FakeOllamaConfig:
+    """Behaviour knobs shared by all request handlers"""
+
+    def __init__(self, model: str = 'qwen2.5:0.5b', latency: float = 0.2, jitter: float = 0.0,
+                 tokens_per_sec: float = 50.0, response_tokens: int = 40, error_rate: float = 0.0,
+                 error_status: int = 500, embedding_dim: int = 384, seed: int = 0):
+        self.model = model
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_sec = tokens_per_sec
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.embedding_dim = embedding_dim
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {'generate': 0, 'stream': 0, 'embeddings': 0, 'tags': 0, 'errors': 0}
+
+    def count(self, name: str):
+        with self.lock:
+            self.counters[name] += 1
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            return self.rng.random() < self.error_rate
+
+    def first_token_delay(self) -> float:
+        with self.lock:
+            return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+def answer_tokens(prompt: str, count: int) -> List[str]:
+    """Deterministic pseudo-answer for a prompt, one token per word"""
+    rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).digest())
+    words = [rng.choice(WORDS) for _ in range(count)]
+    words[0] = words[0].capitalize()
+    return [word + ('.' if i == count - 1 else ' ') for i, word in enumerate(words)]
+
+def embed(text: str, dim: int) -> List[float]:
+    """Unit-length hashed bag-of-words vector"""
+    vector = [0.0] * dim
+    for token in tokenize(text):
+        digest = hashlib.md5(token.encode('utf-8')).digest()
+        index = int.from_bytes(digest[:4], 'little') % dim
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = FakeOllamaConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self.config.count('tags')
+            self.send_json({'models': [{'name': self.config.model, 'model': self.config.model,
+                                        'modified_at': now(), 'size': 0}]})
+        elif self.path == '/api/version':
+            self.send_json({'version': '0.0.0-fake'})
+        elif self.path == '/fake/stats':
+            with self.config.lock:
+                self.send_json(dict(self.config.counters))
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_json({'error': 'invalid JSON'}, 400)
+            return
+
+        if self.path not in ('/api/generate', '/api/embeddings', '/api/embed'):
+            self.send_json({'error': 'not found'}, 404)
+            return
+
+        if self.config.should_fail():
+            self.config.count('errors')
+            self.send_json({'error': 'injected failure'}, self.config.error_status)
+            return
+
+        if self.path == '/api/generate':
+            self.generate(payload)
+        else:
+            self.embeddings(payload)
+
+    def generate(self, payload: Dict):
+        config = self.config
+        options = payload.get('options') or {}
+        count = max(1, min(config.response_tokens, options.get('num_predict') or config.response_tokens))
+        tokens = answer_tokens(payload.get('prompt', ''), count)
+        token_delay = 1.0 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0.0
+        start = time.perf_counter()
+        time.sleep(config.first_token_delay())
+
+        if payload.get('stream', True):
+            config.count('stream')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            try:
+                for token in tokens:
+                    self.write_chunk({'model': config.model, 'created_at': now(), 'response': token, 'done': False})
+                    time.sleep(token_delay)
+                self.write_chunk(dict(self.done_fields(start, count), response=''))
+                self.wfile.write(b'0\r\n\r\n')
+            except (BrokenPipeError, ConnectionResetError):
+                # The client stopped reading; nothing left to do
+                self.close_connection = True
+            return
+
+        config.count('generate')
+        time.sleep(token_delay * count)
+        self.send_json(dict(self.done_fields(start, count), response=''.join(tokens)))
+
+    def embeddings(self, payload: Dict):
+        self.config.count('embeddings')
+        time.sleep(self.config.first_token_delay() / 10)
+        dim = self.config.embedding_dim
+        if self.path == '/api/embed':
+            texts = payload.get('input', '')
+            texts = [texts] if isinstance(texts, str) else texts
+            self.send_json({'model': self.config.model, 'embeddings': [embed(text, dim) for text in texts]})
+        else:
+            self.send_json({'embedding': embed(payload.get('prompt', ''), dim)})
+
+    def done_fields(self, start: float, count: int) -> Dict:
+        return {
+            'model': self.config.model,
+            'created_at': now(),
+            'done': True,
+            'done_reason': 'stop',
+            'total_duration': int((time.perf_counter() - start) * 1e9),
+            'eval_count': count
+        }
+
+    def send_json(self, data: Dict, status: int = 200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, data: Dict):
+        line = json.dumps(data).encode('utf-8') + b'\n'
+        self.wfile.write(f'{len(line):X}\r\n'.encode('ascii') + line + b'\r\n')
+        self.wfile.flush()
+
+def now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def make_server(config: FakeOllamaConfig, host: str = '127.0.0.1', port: int = 11434) -> ThreadingHTTPServer:
+    handler = type('ConfiguredHandler', (FakeOllamaHandler,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def start_server(config: FakeOllamaConfig, host: str = '127.0.0.1', port: int = 11434) -> ThreadingHTTPServer:
+    """Serve in a background thread; call shutdown() on the result to stop"""
+    server = make_server(config, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a fake Ollama server for load testing.')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to bind')
+    parser.add_argument('--port', type=int, default=11434, help='Port to listen on')
+    parser.add_argument('--model', default='qwen2.5:0.5b', help='Model name reported by /api/tags')
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds before the first token')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random +/- seconds added to latency')
+    parser.add_argument('--tokens-per-sec', type=float, default=50.0, help='Generation speed (0 for instant)')
+    parser.add_argument('--response-tokens', type=int, default=40, help='Tokens per answer (capped by num_predict)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail')
+    parser.add_argument('--error-status', type=int, default=500, help='HTTP status of injected failures')
+    parser.add_argument('--embedding-dim', type=int, default=384, help='Length of embedding vectors')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for jitter and error injection')
+    args = parser.parse_args()
+
+    config = FakeOllamaConfig(
+        model=args.model, latency=args.latency, jitter=args.jitter,
+        tokens_per_sec=args.tokens_per_sec, response_tokens=args.response_tokens,
+        error_rate=args.error_rate, error_status=args.error_status,
+        embedding_dim=args.embedding_dim, seed=args.seed
+    )
+    server = make_server(config, args.host, args.port)
+    print(f'Fake Ollama listening on http://{args.host}:{args.port} (model {args.model})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,608 @@
+# index_segments.py - Immutable, memory-mapped BM25 index segments shared between processes
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: segments still work, but only one process may write them
+    fcntl = None
+
+MAGIC = b'ADSEG001'
+ALIGN = 64
+# Adjacent segments of one size tier are merged once there are this many
+SEGMENT_MERGE_AT = int(os.environ.get('RAG_SEGMENT_MERGE_AT', 8))
+# How often the background thread looks for segments written by other processes
+SEGMENT_REFRESH_SECONDS = float(os.environ.get('RAG_SEGMENT_REFRESH', 1.0))
+
+def term_hash(term: str) -> int:
+    """Stable 64-bit hash used to look terms up in a segment"""
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def bm25_idf(num_chunks: int, df):
+    """BM25 inverse document frequency, always positive (same as SimplifiedRAG._idf)"""
+    return np.log(1 + (num_chunks - df + 0.5) / (df + 0.5))
+
+def score_batch(term_sets: List[Set[str]], length_norms: np.ndarray, k1: float, top_k: int,
+                postings: Callable[[str], Optional[Tuple[np.ndarray, np.ndarray]]]) -> List[List[Tuple[int, float]]]:
+    """BM25 top_k (chunk index, score) pairs of one document for many queries at once
+
+    postings(term) gives the document's (chunk indices, term frequencies)
+    for a term, or None. Every distinct term across the queries is looked
+    up and weighted once, then added to the rows of all queries containing
+    it in one queries x chunks score array.
+    """
+    rows_by_term = {}
+    for row, terms in enumerate(term_sets):
+        for term in terms:
+            rows_by_term.setdefault(term, []).append(row)
+
+    num_chunks = len(length_norms)
+    scores = np.zeros((len(term_sets), num_chunks))
+    matched = np.zeros((len(term_sets), num_chunks), dtype=bool)
+    for term, rows in rows_by_term.items():
+        found = postings(term)
+        if found is None:
+            continue
+        chunks, tfs = found
+        weights = bm25_idf(num_chunks, len(chunks)) * tfs * (k1 + 1) / (tfs + length_norms[chunks])
+        # A term's chunk indices are distinct, so the fancy-indexed add is exact
+        index = (np.asarray(rows)[:, None], chunks[None, :])
+        scores[index] += weights
+        matched[index] = True
+
+    results = []
+    for row in range(len(term_sets)):
+        candidates = np.flatnonzero(matched[row])
+        ranked = candidates[np.lexsort((candidates, -scores[row, candidates]))][:top_k]
+        results.append([(int(idx), float(scores[row, idx])) for idx in ranked])
+    return results
+
+def write_segment(path: str, doc_ids: List[str], chunk_lengths: List[np.ndarray], terms: List[str],
+                  row_term: np.ndarray, row_doc: np.ndarray, row_chunk: np.ndarray, row_tf: np.ndarray):
+    """Write one posting row per (term, doc, chunk) as an immutable segment file
+
+    Rows are sorted by term, then document, then chunk, so every term's
+    postings are one contiguous slice and a document's postings within it
+    can be found by binary search. Terms are sorted by their hash.
+    """
+    # Drop terms that lost all their rows (e.g. to deleted documents during a merge)
+    used = np.zeros(len(terms), dtype=bool)
+    used[row_term] = True
+    kept = np.flatnonzero(used)
+    terms = [terms[i] for i in kept.tolist()]
+    remap = np.full(len(used), -1, dtype=np.int64)
+    remap[kept] = np.arange(len(kept))
+    row_term = remap[row_term]
+
+    encoded = [term.encode('utf-8') for term in terms]
+    hashes = np.array([term_hash(term) for term in terms], dtype=np.uint64)
+    order = sorted(range(len(terms)), key=lambda i: (int(hashes[i]), encoded[i]))
+    rank = np.empty(len(terms), dtype=np.int64)
+    rank[order] = np.arange(len(terms))
+    row_rank = rank[row_term]
+    rows = np.lexsort((row_chunk, row_doc, row_rank))
+
+    lengths = [np.asarray(lengths, dtype=np.uint32) for lengths in chunk_lengths]
+    arrays = {
+        'term_hashes': hashes[order],
+        'term_offsets': np.concatenate([[0], np.cumsum([len(encoded[i]) for i in order])]).astype(np.uint64),
+        'term_bytes': np.frombuffer(b''.join(encoded[i] for i in order), dtype=np.uint8),
+        'posting_offsets': np.searchsorted(row_rank[rows], np.arange(len(terms) + 1)).astype(np.uint64),
+        'posting_docs': row_doc[rows].astype(np.uint32),
+        'posting_chunks': row_chunk[rows].astype(np.uint32),
+        'posting_tfs': row_tf[rows].astype(np.uint32),
+        'doc_chunk_offsets': np.concatenate([[0], np.cumsum([len(l) for l in lengths])]).astype(np.uint64),
+        'doc_lengths': np.array([int(l.sum()) for l in lengths], dtype=np.uint64),
+        'chunk_lengths': np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.uint32)
+    }
+
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = [array.dtype.str, offset, len(array)]
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    header = json.dumps({'doc_ids': doc_ids, 'arrays': layout}).encode('utf-8')
+    data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+
+    temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(MAGIC + len(header).to_bytes(8, 'little') + header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name][1])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def postings_columns(docs: List[Tuple[str, Dict, List[int]]]) -> Tuple:
+    """Segment columns from in-memory postings: term -> flat [idx, tf, ...] lists"""
+    term_ids = {}
+    terms, row_term, row_doc, row_chunk, row_tf = [], [], [], [], []
+    for doc_number, (_, doc_postings, _) in enumerate(docs):
+        for term, plist in doc_postings.items():
+            term_id = term_ids.get(term)
+            if term_id is None:
+                term_id = term_ids[term] = len(terms)
+                terms.append(term)
+            count = len(plist) // 2
+            row_term.extend([term_id] * count)
+            row_doc.extend([doc_number] * count)
+            row_chunk.extend(plist[0::2])
+            row_tf.extend(plist[1::2])
+    return (
+        [doc_id for doc_id, _, _ in docs],
+        [np.asarray(chunk_lengths, dtype=np.uint32) for _, _, chunk_lengths in docs],
+        terms,
+        np.array(row_term, dtype=np.int64),
+        np.array(row_doc, dtype=np.uint32),
+        np.array(row_chunk, dtype=np.uint32),
+        np.array(row_tf, dtype=np.uint32)
+    )
+
+class Segment:
+    """A read-only, memory-mapped segment file
+
+    Arrays are views into the mapping, so every process that opens the same
+    file shares one copy of it in the page cache. Only the document id list
+    is held as Python objects.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not an index segment')
+        header_length = int.from_bytes(self.buffer[len(MAGIC):len(MAGIC) + 8], 'little')
+        header_start = len(MAGIC) + 8
+        header = json.loads(self.buffer[header_start:header_start + header_length])
+        data_start = -(-(header_start + header_length) // ALIGN) * ALIGN
+        for name, (dtype, offset, count) in header['arrays'].items():
+            setattr(self, name, np.frombuffer(self.buffer, dtype=np.dtype(dtype), count=count,
+                                              offset=data_start + offset))
+        self.doc_ids = header['doc_ids']
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def term_rows(self, term: str) -> Tuple[int, int]:
+        """Slice of the posting arrays holding a term (empty if absent)"""
+        key = np.uint64(term_hash(term))
+        low = int(np.searchsorted(self.term_hashes, key, 'left'))
+        high = int(np.searchsorted(self.term_hashes, key, 'right'))
+        encoded = term.encode('utf-8')
+        for i in range(low, high):
+            if self.term_bytes[int(self.term_offsets[i]):int(self.term_offsets[i + 1])].tobytes() == encoded:
+                return int(self.posting_offsets[i]), int(self.posting_offsets[i + 1])
+        return 0, 0
+
+    def terms(self) -> List[str]:
+        data = self.term_bytes.tobytes()
+        offsets = self.term_offsets.tolist()
+        return [data[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+class SegmentView:
+    """Immutable snapshot of the live segments, swapped whole on refresh
+
+    A document lives in the newest segment that contains it unless it was
+    deleted afterwards; live[i] masks the documents of segments[i].
+    """
+
+    def __init__(self, segments: List[Segment], deleted: Set[str], generation: int):
+        self.segments = segments
+        self.generation = generation
+        self.docs = {}
+        self.live = [np.zeros(len(segment), dtype=bool) for segment in segments]
+        for number in range(len(segments) - 1, -1, -1):
+            live = self.live[number]
+            for local, doc_id in enumerate(segments[number].doc_ids):
+                if doc_id not in self.docs and doc_id not in deleted:
+                    self.docs[doc_id] = (number, local)
+                    live[local] = True
+        self.total_chunks = 0
+        self.total_length = 0
+        for segment, live in zip(segments, self.live):
+            self.total_chunks += int(np.diff(segment.doc_chunk_offsets.astype(np.int64))[live].sum())
+            self.total_length += int(segment.doc_lengths[live].sum())
+
+class SegmentIndex:
+    """A directory of segment files and the manifest that lists them
+
+    Writers publish a new small segment per batch of documents (the delta)
+    and a background merge folds adjacent segments of similar size into one
+    once there are merge_at of them. Every change rewrites manifest.json atomically under an exclusive
+    file lock, so several processes can index into the same directory;
+    readers pick up changes on refresh().
+    """
+
+    def __init__(self, directory: str, merge_at: int = SEGMENT_MERGE_AT):
+        self.directory = directory
+        self.merge_at = merge_at
+        os.makedirs(directory, exist_ok=True)
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        # lock guards the view; write_lock serializes this process's writers
+        # and merge_lock its merges
+        self.lock = threading.RLock()
+        self.write_lock = threading.Lock()
+        self.merge_lock = threading.Lock()
+        self.opened = {}
+        self.manifest_stamp = None
+        self.view = SegmentView([], set(), 0)
+        self.counters = {'published': 0, 'merges': 0, 'refreshes': 0}
+        self.refresh()
+
+    @classmethod
+    def from_env(cls) -> Optional['SegmentIndex']:
+        """Build an index from RAG_SEGMENTS_PATH, or None if it is unset"""
+        path = os.environ.get('RAG_SEGMENTS_PATH', '')
+        return cls(path) if path else None
+
+    def has(self, doc_id: str) -> bool:
+        """Whether a document is live, refreshing once if another process may have added it"""
+        if doc_id in self.view.docs:
+            return True
+        self.refresh()
+        return doc_id in self.view.docs
+
+    def document_ids(self) -> List[str]:
+        return list(self.view.docs)
+
+    def refresh(self) -> bool:
+        """Re-read the manifest if it changed; returns whether the view changed"""
+        with self.lock:
+            for attempt in range(3):
+                try:
+                    stat = os.stat(self.manifest_path)
+                except FileNotFoundError:
+                    return False
+                stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+                if stamp == self.manifest_stamp:
+                    return False
+                manifest = self._read_manifest()
+                try:
+                    opened = {name: self.opened.get(name) or Segment(os.path.join(self.directory, name))
+                              for name in manifest['segments']}
+                    break
+                except FileNotFoundError:
+                    # A merge in another process replaced the manifest after we read it
+                    if attempt == 2:
+                        raise
+            self.opened = opened
+            self.view = SegmentView([opened[name] for name in manifest['segments']],
+                                    set(manifest['deleted']), manifest['generation'])
+            self.manifest_stamp = stamp
+            self.counters['refreshes'] += 1
+            return True
+
+    def publish(self, docs: List[Tuple[str, Dict, List[int]]]):
+        """Write (doc_id, postings, chunk lengths) documents as a new segment"""
+        if not docs:
+            return
+        name = f'seg-{time.time_ns():x}-{uuid.uuid4().hex[:8]}.seg'
+        write_segment(os.path.join(self.directory, name), *postings_columns(docs))
+        new_ids = {doc_id for doc_id, _, _ in docs}
+        with self._exclusive():
+            manifest = self._read_manifest()
+            manifest['segments'].append(name)
+            manifest['deleted'] = [doc_id for doc_id in manifest['deleted'] if doc_id not in new_ids]
+            self._write_manifest(manifest)
+        self.counters['published'] += 1
+        self.refresh()
+
+    def delete(self, doc_ids: Iterable[str]):
+        """Hide documents from every segment written so far"""
+        doc_ids = set(doc_ids)
+        with self._exclusive():
+            manifest = self._read_manifest()
+            manifest['deleted'] = sorted(set(manifest['deleted']) | doc_ids)
+            self._write_manifest(manifest)
+        self.refresh()
+
+    def merge(self, force: bool = False) -> bool:
+        """Fold a run of adjacent, similar-sized segments into one, dropping deleted and replaced documents
+
+        Segments are tiered by size, each tier merge_at times larger than
+        the one below, and merge_at adjacent segments of the lowest such
+        tier are merged, so a document is rewritten about log(N) times
+        rather than on every merge; force merges every segment. Only one
+        process merges at a time, and the new file is written before the
+        directory lock is taken to swap it into the manifest, so uploads
+        are not held up by a merge.
+        """
+        with self._merging() as merging:
+            if not merging.acquired:
+                return False
+            manifest = self._read_manifest()
+            segments = [self.opened.get(name) or Segment(os.path.join(self.directory, name))
+                        for name in manifest['segments']]
+            if force:
+                run = (0, len(segments)) if len(segments) >= 2 else None
+            else:
+                run = self._merge_run(segments)
+            if run is None:
+                return False
+            start, end = run
+            view = SegmentView(segments, set(manifest['deleted']), manifest['generation'])
+            name = f'seg-{time.time_ns():x}-{uuid.uuid4().hex[:8]}.seg'
+            path = os.path.join(self.directory, name)
+            write_segment(path, *self._live_columns(view, range(start, end)))
+
+            merged = manifest['segments'][start:end]
+            # Deleted documents of the run are gone for good unless an older segment still has them
+            dropped = {doc_id for segment in segments[start:end] for doc_id in segment.doc_ids}
+            dropped -= {doc_id for segment in segments[:start] + segments[end:] for doc_id in segment.doc_ids}
+            dropped &= set(manifest['deleted'])
+            with self._exclusive():
+                current = self._read_manifest()
+                position = start
+                if current['generation'] != manifest['generation']:
+                    # Uploads and deletes since only append segments and mark deletions,
+                    # so the run is still in place unless the manifest was rebuilt
+                    position = next((i for i in range(len(current['segments']) - len(merged) + 1)
+                                     if current['segments'][i:i + len(merged)] == merged), None)
+                if position is None:
+                    os.remove(path)
+                    return False
+                current['segments'][position:position + len(merged)] = [name]
+                current['deleted'] = [doc_id for doc_id in current['deleted'] if doc_id not in dropped]
+                self._write_manifest(current)
+            # Processes that still map the old files keep reading them until they refresh
+            for old_name in merged:
+                try:
+                    os.remove(os.path.join(self.directory, old_name))
+                except OSError:
+                    # Windows cannot delete a mapped file
+                    pass
+        self.counters['merges'] += 1
+        self.refresh()
+        return True
+
+    def start(self, interval: float = SEGMENT_REFRESH_SECONDS) -> threading.Thread:
+        """Refresh and merge in a daemon thread"""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                    self.merge()
+                except Exception as e:
+                    print(f"Segment maintenance failed: {e}")
+        thread = threading.Thread(target=run, name='segment-maintenance', daemon=True)
+        thread.start()
+        return thread
+
+    def score_document(self, doc_id: str, query_terms: Set[str], k1: float, b: float,
+                       top_k: int) -> List[Tuple[int, float]]:
+        """BM25 top_k chunks of one document, scored like SimplifiedRAG._score_terms"""
+        view = self.view
+        number, local = view.docs[doc_id]
+        segment = view.segments[number]
+        first = int(segment.doc_chunk_offsets[local])
+        lengths = segment.chunk_lengths[first:int(segment.doc_chunk_offsets[local + 1])].astype(np.float64)
+        avg_length = (lengths.sum() / len(lengths)) or 1.0
+        length_norms = k1 * (1 - b + b * lengths / avg_length)
+
+        scores = np.zeros(len(lengths))
+        matched = np.zeros(len(lengths), dtype=bool)
+        for term in query_terms:
+            start, end = segment.term_rows(term)
+            if start == end:
+                continue
+            docs = segment.posting_docs[start:end]
+            low = start + int(np.searchsorted(docs, local, 'left'))
+            high = start + int(np.searchsorted(docs, local, 'right'))
+            if low == high:
+                continue
+            chunks = segment.posting_chunks[low:high]
+            tfs = segment.posting_tfs[low:high].astype(np.float64)
+            scores[chunks] += bm25_idf(len(lengths), high - low) * tfs * (k1 + 1) / (tfs + length_norms[chunks])
+            matched[chunks] = True
+
+        candidates = np.flatnonzero(matched)
+        ranked = candidates[np.lexsort((candidates, -scores[candidates]))][:top_k]
+        return [(int(idx), float(scores[idx])) for idx in ranked]
+
+    def score_document_batch(self, doc_id: str, term_sets: List[Set[str]], k1: float, b: float,
+                             top_k: int) -> List[List[Tuple[int, float]]]:
+        """score_document for several queries, each term's postings read once"""
+        view = self.view
+        number, local = view.docs[doc_id]
+        segment = view.segments[number]
+        first = int(segment.doc_chunk_offsets[local])
+        lengths = segment.chunk_lengths[first:int(segment.doc_chunk_offsets[local + 1])].astype(np.float64)
+        avg_length = (lengths.sum() / len(lengths)) or 1.0
+
+        def postings(term):
+            start, end = segment.term_rows(term)
+            if start == end:
+                return None
+            docs = segment.posting_docs[start:end]
+            low = start + int(np.searchsorted(docs, local, 'left'))
+            high = start + int(np.searchsorted(docs, local, 'right'))
+            if low == high:
+                return None
+            return segment.posting_chunks[low:high].astype(np.int64), segment.posting_tfs[low:high].astype(np.float64)
+
+        return score_batch(term_sets, k1 * (1 - b + b * lengths / avg_length), k1, top_k, postings)
+
+    def score_corpus(self, query_terms: Set[str], k1: float, b: float,
+                     top_k: int) -> List[Tuple[Tuple[str, int], float]]:
+        """BM25 top_k ((doc_id, chunk index), score) over every live document"""
+        view = self.view
+        if not view.total_chunks:
+            return []
+        avg_length = (view.total_length / view.total_chunks) or 1.0
+
+        # Live posting rows of each query term in each segment
+        hits = {}
+        for term in query_terms:
+            rows = []
+            for number, segment in enumerate(view.segments):
+                start, end = segment.term_rows(term)
+                if start == end:
+                    continue
+                docs = segment.posting_docs[start:end]
+                live = view.live[number][docs]
+                rows.append((number, docs[live], segment.posting_chunks[start:end][live],
+                             segment.posting_tfs[start:end][live]))
+            df = sum(len(docs) for _, docs, _, _ in rows)
+            if df:
+                hits[term] = (bm25_idf(view.total_chunks, df), rows)
+
+        best = []
+        for number, segment in enumerate(view.segments):
+            positions, contributions = [], []
+            for term_idf, rows in hits.values():
+                for row_number, docs, chunks, tfs in rows:
+                    if row_number != number:
+                        continue
+                    position = segment.doc_chunk_offsets[docs].astype(np.int64) + chunks
+                    lengths = segment.chunk_lengths[position]
+                    tfs = tfs.astype(np.float64)
+                    norms = k1 * (1 - b + b * lengths / avg_length)
+                    positions.append(position)
+                    contributions.append(term_idf * tfs * (k1 + 1) / (tfs + norms))
+            if not positions:
+                continue
+            position = np.concatenate(positions)
+            unique, inverse = np.unique(position, return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(contributions))
+            top = np.argsort(-scores, kind='stable')[:top_k]
+            docs = np.searchsorted(segment.doc_chunk_offsets, unique[top], 'right') - 1
+            for doc, chunk_position, score in zip(docs.tolist(), unique[top].tolist(), scores[top].tolist()):
+                chunk = chunk_position - int(segment.doc_chunk_offsets[doc])
+                best.append(((segment.doc_ids[doc], chunk), score))
+        return heapq.nlargest(top_k, best, key=lambda item: item[1])
+
+    def stats(self) -> Dict:
+        view = self.view
+        data = dict(self.counters)
+        data.update({
+            'generation': view.generation,
+            'segments': len(view.segments),
+            'documents': len(view.docs),
+            'chunks': view.total_chunks,
+            'mapped_mb': round(sum(len(segment.buffer) for segment in view.segments) / 1e6, 1)
+        })
+        return data
+
+    def _merge_run(self, segments: List[Segment]) -> Optional[Tuple[int, int]]:
+        """(start, end) of the segments to merge next, or None
+
+        A run is a stretch of adjacent segments no larger than some tier,
+        merged once it holds merge_at segments of that tier, so a large
+        base segment is only rewritten when others have grown to its size.
+        """
+        base = max(self.merge_at, 2)
+        tiers = [int(math.log(max(len(segment.chunk_lengths), 1), base)) for segment in segments]
+        for tier in sorted(set(tiers)):
+            start, count = 0, 0
+            for end in range(len(tiers) + 1):
+                if end < len(tiers) and tiers[end] <= tier:
+                    count += tiers[end] == tier
+                    continue
+                if count >= self.merge_at:
+                    return start, end
+                start, count = end + 1, 0
+        return None
+
+    def _live_columns(self, view: SegmentView, numbers: Iterable[int]) -> Tuple:
+        """Segment columns holding only the live documents of some segments of a view"""
+        doc_ids, chunk_lengths = [], []
+        terms, term_ids = [], {}
+        row_term, row_doc, row_chunk, row_tf = [], [], [], []
+        for number in numbers:
+            segment, live = view.segments[number], view.live[number]
+            new_doc = np.full(len(segment), -1, dtype=np.int64)
+            new_doc[live] = np.arange(len(doc_ids), len(doc_ids) + int(live.sum()))
+            offsets = segment.doc_chunk_offsets.astype(np.int64)
+            for local in np.flatnonzero(live).tolist():
+                doc_ids.append(segment.doc_ids[local])
+                chunk_lengths.append(segment.chunk_lengths[offsets[local]:offsets[local + 1]])
+
+            local_terms = segment.terms()
+            for term in local_terms:
+                if term not in term_ids:
+                    term_ids[term] = len(terms)
+                    terms.append(term)
+            term_map = np.array([term_ids[term] for term in local_terms], dtype=np.int64)
+            counts = np.diff(segment.posting_offsets.astype(np.int64))
+            keep = live[segment.posting_docs]
+            row_term.append(np.repeat(term_map, counts)[keep])
+            row_doc.append(new_doc[segment.posting_docs[keep]])
+            row_chunk.append(segment.posting_chunks[keep])
+            row_tf.append(segment.posting_tfs[keep])
+
+        def joined(parts, dtype):
+            return np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype=dtype)
+
+        return (doc_ids, chunk_lengths, terms, joined(row_term, np.int64), joined(row_doc, np.uint32),
+                joined(row_chunk, np.uint32), joined(row_tf, np.uint32))
+
+    def _read_manifest(self) -> Dict:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'generation': 0, 'segments': [], 'deleted': []}
+
+    def _write_manifest(self, manifest: Dict):
+        manifest['generation'] += 1
+        temp_path = f'{self.manifest_path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, self.manifest_path)
+
+    def _exclusive(self):
+        return _DirectoryLock(os.path.join(self.directory, 'lock'), self.write_lock)
+
+    def _merging(self):
+        """Claim the merge without waiting; check .acquired"""
+        return _DirectoryLock(os.path.join(self.directory, 'merge.lock'), self.merge_lock, blocking=False)
+
+class _DirectoryLock:
+    """Thread lock plus, where available, an exclusive flock shared with other processes"""
+
+    def __init__(self, path: str, thread_lock, blocking: bool = True):
+        self.path = path
+        self.thread_lock = thread_lock
+        self.blocking = blocking
+        self.file = None
+        self.acquired = False
+
+    def __enter__(self):
+        if not self.thread_lock.acquire(self.blocking):
+            return self
+        if fcntl is not None:
+            self.file = open(self.path, 'a')
+            try:
+                fcntl.flock(self.file, fcntl.LOCK_EX if self.blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.file.close()
+                self.file = None
+                self.thread_lock.release()
+                return self
+        self.acquired = True
+        return self
+
+    def __exit__(self, *exc):
+        if not self.acquired:
+            return
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+        self.acquired = False
+        self.thread_lock.release()
@@ -0,0 +1,131 @@
+# ingest_jobs.py - Background ingestion jobs with bounded parallelism
+import copy
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+# Seconds between progress writes to a shared store; status changes are written at once
+PROGRESS_INTERVAL = 0.5
+
+class IngestError(Exception):
+    """Raised when uploaded content cannot be turned into a document"""
+
+class JobQueue:
+    """Run ingestion work on a fixed-size worker pool and track its progress
+
+    Work functions receive a progress(**fields) callback and return the
+    response payload for the finished document. Only the newest max_finished
+    completed jobs are remembered.
+
+    With a store (a shared DocumentStore), every job is also written there,
+    so a worker process other than the one running the job can report it.
+    """
+
+    def __init__(self, max_workers: int = 2, max_finished: int = 500, store=None):
+        self.max_workers = max_workers
+        self.max_finished = max_finished
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ingest')
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        # Keeps store writes of one job in the order their snapshots were taken
+        self.save_lock = threading.Lock()
+        # Job id -> time of its last progress write to the store
+        self.written = {}
+
+    @classmethod
+    def from_env(cls, store=None) -> 'JobQueue':
+        """Build a queue from INGEST_* environment variables"""
+        return cls(max_workers=int(os.environ.get('INGEST_WORKERS', 2)), store=store)
+
+    def submit(self, kind: str, work: Callable, **details) -> str:
+        """Queue work and return the new job id"""
+        job_id = str(uuid.uuid4())
+        job = {
+            'id': job_id,
+            'kind': kind,
+            'status': 'queued',
+            'created_at': datetime.now().isoformat(),
+            'started_at': None,
+            'finished_at': None,
+            'progress': {},
+            'result': None,
+            'error': None
+        }
+        job.update(details)
+        with self.lock:
+            self.jobs[job_id] = job
+        self._save(job_id)
+        self.executor.submit(self._run, job_id, work)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Snapshot of a job, safe to serialize while the job runs"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job:
+                return copy.deepcopy(job)
+        # Started by another process
+        return self.store.get_job(job_id) if self.store is not None else None
+
+    def progress(self, job_id: str, **fields):
+        with self.lock:
+            self.jobs[job_id]['progress'].update(fields)
+            due = time.monotonic() - self.written.get(job_id, 0.0) >= PROGRESS_INTERVAL
+        if due:
+            self._save(job_id)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            counts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0}
+            for job in self.jobs.values():
+                counts[job['status']] += 1
+        counts['workers'] = self.max_workers
+        return counts
+
+    def _run(self, job_id: str, work: Callable):
+        self._update(job_id, status='running', started_at=datetime.now().isoformat())
+        try:
+            result = work(lambda **fields: self.progress(job_id, **fields))
+        except IngestError as e:
+            self._finish(job_id, 'failed', error=str(e))
+        except Exception as e:
+            print(f"Ingestion job {job_id[:8]} failed: {e}")
+            self._finish(job_id, 'failed', error=f'Ingestion failed: {str(e)}')
+        else:
+            self._finish(job_id, 'done', result=result)
+
+    def _update(self, job_id: str, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+        self._save(job_id)
+
+    def _finish(self, job_id: str, status: str, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields, status=status, finished_at=datetime.now().isoformat())
+        self._save(job_id)
+        with self.lock:
+            self.written.pop(job_id, None)
+            finished = [key for key, job in self.jobs.items() if job['finished_at']]
+            for key in finished[:max(0, len(finished) - self.max_finished)]:
+                del self.jobs[key]
+        if self.store is not None:
+            self.store.prune_jobs(self.max_finished)
+
+    def _save(self, job_id: str):
+        """Write a job to the store, if there is one"""
+        if self.store is None:
+            return
+        with self.save_lock:
+            with self.lock:
+                job = copy.deepcopy(self.jobs[job_id])
+                self.written[job_id] = time.monotonic()
+            try:
+                self.store.save_job(job)
+            except Exception as e:
+                print(f"Saving job {job_id[:8]} failed: {e}")
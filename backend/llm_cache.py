@@ -0,0 +1,108 @@
+# llm_cache.py - Two-tier cache for deterministic LLM responses
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+def cache_key(model: str, options: Dict, prompt: str) -> str:
+    """Stable key for a (model, options, prompt) generation"""
+    prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    payload = json.dumps({'model': model, 'options': options, 'prompt': prompt_hash},
+                         sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def is_deterministic(options: Dict) -> bool:
+    """Only seeded or greedy generations repeat, so only those are cacheable"""
+    return options.get('seed') is not None or options.get('temperature') == 0
+
+class ResponseCache:
+    """LRU memory tier in front of a persistent SQLite tier
+
+    Lookups check memory first, then disk; disk hits are promoted into
+    memory. Writes go to both tiers. Pass path=None for memory only.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'writes': 0}
+
+        self.db = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, model TEXT, response TEXT, created_at REAL)'
+            )
+            self.db.commit()
+
+    @classmethod
+    def from_env(cls) -> 'ResponseCache':
+        """Build a cache from LLM_CACHE_* environment variables"""
+        path = os.environ.get('LLM_CACHE_PATH',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'llm_cache.db'))
+        return cls(path=path or None, max_entries=int(os.environ.get('LLM_CACHE_SIZE', 1024)))
+
+    def get(self, model: str, options: Dict, prompt: str) -> Optional[str]:
+        key = cache_key(model, options, prompt)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return self.memory[key]
+
+            if self.db is not None:
+                row = self.db.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    self._remember(key, row[0])
+                    self.counters['disk_hits'] += 1
+                    return row[0]
+
+            self.counters['misses'] += 1
+            return None
+
+    def put(self, model: str, options: Dict, prompt: str, response: str):
+        key = cache_key(model, options, prompt)
+        with self.lock:
+            self._remember(key, response)
+            self.counters['writes'] += 1
+            if self.db is not None:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO responses (key, model, response, created_at) VALUES (?, ?, ?, ?)',
+                    (key, model, response, time.time())
+                )
+                self.db.commit()
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.db is not None:
+                self.db.execute('DELETE FROM responses')
+                self.db.commit()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            data = dict(self.counters)
+            data['memory_entries'] = len(self.memory)
+            if self.db is not None:
+                data['disk_entries'] = self.db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        lookups = data['memory_hits'] + data['disk_hits'] + data['misses']
+        data['hit_rate'] = round((data['memory_hits'] + data['disk_hits']) / lookups, 4) if lookups else 0.0
+        data['max_entries'] = self.max_entries
+        return data
+
+    def _remember(self, key: str, response: str):
+        """Insert into the memory tier, evicting the least recently used entry"""
+        self.memory[key] = response
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
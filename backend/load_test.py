@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Open-loop load generator for the AskDocAI backend
+
+Sends a mix of ask, summarize and upload requests at a target rate and
+reports achieved throughput, status counts and latency percentiles per
+operation. Requests are started on schedule whether or not earlier ones
+have finished, so queueing in the backend shows up as tail latency.
+
+Start a fake model first so no real Ollama is needed:
+python fake_ollama.py --latency 0.2 --tokens-per-sec 50
+python app.py
+
+Usage:
+python load_test.py --rps 5 --duration 30 --mix ask=0.7 summarize=0.2 upload=0.1 --output load.json
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import requests
+
+from stage_metrics import percentile
+
+QUESTIONS = [
+    'What is the main topic of the document?',
+    'Which steps are required for maintenance?',
+    'What safety precautions are mentioned?',
+    'Summarize the key results.',
+    'What does the document say about pressure?',
+    'Who is the intended audience?',
+    'What are the limitations described?',
+    'How is the system reset?'
+]
+
+def parse_mix(items: List[str]) -> Dict[str, float]:
+    mix = {}
+    for item in items:
+        name, _, weight = item.partition('=')
+        if name not in ('ask', 'summarize', 'upload'):
+            raise SystemExit(f'Unknown operation in --mix: {name}')
+        mix[name] = float(weight or 1)
+    return mix
+
+class LoadGenerator:
+    """Runs operations against the API and collects per-operation results"""
+
+    def __init__(self, base_url: str, pdf_path: str, no_cache: bool, timeout: float):
+        self.base_url = base_url.rstrip('/')
+        self.no_cache = no_cache
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=256)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        with open(pdf_path, 'rb') as f:
+            self.pdf = f.read()
+        self.document_ids = []
+        self.lock = threading.Lock()
+        self.results = {}
+
+    def setup(self, document_id: str = None):
+        """Make sure there is a document to ask about"""
+        if document_id:
+            self.document_ids.append(document_id)
+            return
+        response = self.session.post(f'{self.base_url}/upload?sync=1', timeout=self.timeout,
+                                     files={'file': ('loadtest.pdf', self.pdf, 'application/pdf')})
+        response.raise_for_status()
+        self.document_ids.append(response.json()['document_id'])
+
+    def ask(self, rng: random.Random):
+        return self.session.post(f'{self.base_url}/ask', timeout=self.timeout, json={
+            'document_id': rng.choice(self.document_ids),
+            'question': rng.choice(QUESTIONS),
+            'no_cache': self.no_cache
+        })
+
+    def summarize(self, rng: random.Random):
+        return self.session.post(f'{self.base_url}/summarize', timeout=self.timeout, json={
+            'document_id': rng.choice(self.document_ids),
+            'no_cache': self.no_cache
+        })
+
+    def upload(self, rng: random.Random):
+        # A trailing PDF comment makes every upload unique, so none is deduplicated
+        data = self.pdf + f'\n%{uuid.UUID(int=rng.getrandbits(128))}\n'.encode('ascii')
+        response = self.session.post(f'{self.base_url}/upload?sync=1', timeout=self.timeout,
+                                     files={'file': ('loadtest.pdf', data, 'application/pdf')})
+        if response.status_code == 201:
+            with self.lock:
+                self.document_ids.append(response.json()['document_id'])
+        return response
+
+    def run_one(self, operation: str, seed: int):
+        rng = random.Random(seed)
+        start = time.perf_counter()
+        try:
+            status = str(getattr(self, operation)(rng).status_code)
+        except requests.Timeout:
+            status = 'timeout'
+        except requests.RequestException:
+            status = 'connection_error'
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            result = self.results.setdefault(operation, {'latencies': [], 'statuses': {}})
+            result['statuses'][status] = result['statuses'].get(status, 0) + 1
+            if status.startswith('2'):
+                result['latencies'].append(elapsed)
+
+    def run(self, rps: float, duration: float, mix: Dict[str, float], max_in_flight: int, seed: int) -> Dict:
+        """Start requests every 1/rps seconds for duration seconds"""
+        rng = random.Random(seed)
+        operations = list(mix)
+        weights = [mix[name] for name in operations]
+        interval = 1.0 / rps
+        in_flight = threading.BoundedSemaphore(max_in_flight)
+        skipped = 0
+        sent = 0
+
+        def task(operation, task_seed):
+            try:
+                self.run_one(operation, task_seed)
+            finally:
+                in_flight.release()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+            while True:
+                scheduled = started + sent * interval
+                if scheduled - started >= duration:
+                    break
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                sent += 1
+                operation = rng.choices(operations, weights)[0]
+                # Count, rather than queue, requests beyond the in-flight cap
+                if not in_flight.acquire(blocking=False):
+                    skipped += 1
+                    continue
+                pool.submit(task, operation, rng.getrandbits(32))
+        elapsed = time.perf_counter() - started
+
+        report = {
+            'target_rps': rps,
+            'duration_s': round(elapsed, 2),
+            'scheduled': sent,
+            'skipped_in_flight_cap': skipped,
+            'operations': {}
+        }
+        for operation, result in sorted(self.results.items()):
+            latencies = result['latencies']
+            report['operations'][operation] = {
+                'statuses': result['statuses'],
+                'ok': len(latencies),
+                'throughput_rps': round(len(latencies) / elapsed, 2),
+                'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+                'max_ms': round(max(latencies, default=0.0) * 1000, 1)
+            }
+        return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive upload, ask and summarize at a target request rate.')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5050/api', help='API base URL')
+    parser.add_argument('--rps', type=float, default=5.0, help='Requests started per second')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds to generate load')
+    parser.add_argument('--mix', nargs='+', default=['ask=0.7', 'summarize=0.2', 'upload=0.1'],
+                        help='Operation weights, e.g., --mix ask=0.8 summarize=0.2')
+    parser.add_argument('--pdf', default='test.pdf', help='PDF used for uploads')
+    parser.add_argument('--document-id', help='Ask about this document instead of uploading one first')
+    parser.add_argument('--max-in-flight', type=int, default=64, help='Requests allowed to be outstanding')
+    parser.add_argument('--timeout', type=float, default=120.0, help='Per-request timeout in seconds')
+    parser.add_argument('--no-cache', action='store_true', help='Bypass the backend response cache')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the operation and question mix')
+    parser.add_argument('--output', help='Write the JSON report to this path (default: stdout)')
+    args = parser.parse_args()
+
+    generator = LoadGenerator(args.base_url, args.pdf, args.no_cache, args.timeout)
+    generator.setup(args.document_id)
+    report = generator.run(args.rps, args.duration, parse_mix(args.mix), args.max_in_flight, args.seed)
+
+    print('=== Load Test ===', file=sys.stderr)
+    print('operation\tok\trps\tp50_ms\tp95_ms\tp99_ms\tstatuses', file=sys.stderr)
+    for operation, stats in report['operations'].items():
+        print(f"{operation}\t{stats['ok']}\t{stats['throughput_rps']}\t{stats['p50_ms']}\t"
+              f"{stats['p95_ms']}\t{stats['p99_ms']}\t{stats['statuses']}", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        print(f'Saved report to: {args.output}', file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,586 @@
+# ollama_client.py - Pooled, concurrency-limited Ollama clients (blocking and asyncio)
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # only needed by AsyncOllamaClient
+    httpx = None
+
+class OllamaOverloaded(Exception):
+    """Raised when a generation cannot be admitted; maps to HTTP 503"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class OllamaError(Exception):
+    """Raised when Ollama fails after all retries"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class CircuitBreaker:
+    """Fail fast after repeated errors, probing again after a cooldown"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self) -> bool:
+        """Return True if a call may proceed; only one probe when half-open"""
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def retry_after(self) -> int:
+        if self.opened_at is None:
+            return 1
+        remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+        return max(1, math.ceil(remaining))
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+class Slots:
+    """Generation slots shared by threads and coroutines, granted first come first served
+
+    Threads block in acquire(); coroutines await acquire_async() without
+    holding a thread. A released slot is handed straight to the oldest
+    waiter of either kind, so both share one concurrency cap.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.waiters = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        with self.lock:
+            if self.used < self.limit and not self.waiters:
+                self.used += 1
+                return True
+            granted = threading.Event()
+            waiter = granted.set
+            self.waiters.append(waiter)
+        if granted.wait(timeout):
+            return True
+        return not self._withdraw(waiter)
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> bool:
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.used < self.limit and not self.waiters:
+                self.used += 1
+                return True
+            granted = loop.create_future()
+
+            def waiter():
+                loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+            self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(granted, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return not self._withdraw(waiter)
+        except BaseException:
+            # Cancelled (e.g. the client went away): give back a slot granted meanwhile
+            if not self._withdraw(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        with self.lock:
+            if not self.waiters:
+                self.used -= 1
+                return
+            # The slot passes to the next waiter without being freed
+            waiter = self.waiters.popleft()
+        waiter()
+
+    def _withdraw(self, waiter) -> bool:
+        """Stop waiting; False if the slot was granted in the meantime"""
+        with self.lock:
+            try:
+                self.waiters.remove(waiter)
+                return True
+            except ValueError:
+                return False
+
+class OllamaClient:
+    """Ollama HTTP client with keep-alive pooling and admission control
+
+    At most max_concurrency generations run at once. Up to max_queue more
+    callers wait for a slot; anything beyond that, or anything waiting longer
+    than queue_timeout, is rejected with OllamaOverloaded. Embedding requests
+    have their own max_embed_concurrency slots, so indexing a document or
+    embedding a query never waits behind answers (nor holds one up).
+    """
+
+    def __init__(self, host: str = 'http://localhost:11434', model: str = 'qwen2.5:0.5b',
+                 max_concurrency: int = 2, max_queue: int = 16, queue_timeout: float = 60.0,
+                 max_embed_concurrency: int = 2,
+                 connect_timeout: float = 3.0, read_timeout: float = 120.0,
+                 max_retries: int = 2, backoff: float = 0.5,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.host = host.rstrip('/')
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency + max_embed_concurrency + 2)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.slots = Slots(max_concurrency)
+        self.embed_slots = Slots(max_embed_concurrency)
+        self.lock = threading.Lock()
+        self.stats_data = {
+            'in_flight': 0,
+            'queue_depth': 0,
+            'max_queue_depth': 0,
+            'admitted': 0,
+            'rejected': 0,
+            'failures': 0,
+            'retries': 0,
+            'total_wait_time': 0.0,
+            'max_wait_time': 0.0,
+            'total_generation_time': 0.0,
+            'completed': 0
+        }
+
+    @classmethod
+    def from_env(cls, **overrides) -> 'OllamaClient':
+        """Build a client from OLLAMA_* environment variables"""
+        config = {
+            'host': os.environ.get('OLLAMA_HOST', 'http://localhost:11434'),
+            'max_concurrency': int(os.environ.get('OLLAMA_MAX_CONCURRENCY', 2)),
+            'max_queue': int(os.environ.get('OLLAMA_MAX_QUEUE', 16)),
+            'max_embed_concurrency': int(os.environ.get('OLLAMA_EMBED_CONCURRENCY', 2)),
+            'queue_timeout': float(os.environ.get('OLLAMA_QUEUE_TIMEOUT', 60)),
+            'read_timeout': float(os.environ.get('OLLAMA_TIMEOUT', 120)),
+            'max_retries': int(os.environ.get('OLLAMA_MAX_RETRIES', 2))
+        }
+        config.update(overrides)
+        return cls(**config)
+
+    def generate(self, prompt: str, options: Optional[Dict] = None, model: Optional[str] = None) -> str:
+        """Run a blocking generation and return the full response text"""
+        self._acquire()
+        started = time.monotonic()
+        try:
+            response = self._post('/api/generate', {
+                'model': model or self.model,
+                'prompt': prompt,
+                'stream': False,
+                'options': options or {}
+            })
+            return response.json().get('response', '')
+        finally:
+            self._release(started)
+
+    def stream(self, prompt: str, options: Optional[Dict] = None,
+               model: Optional[str] = None) -> 'TokenStream':
+        """Admit a streaming generation and return an iterator of tokens
+
+        The slot is taken and the connection opened before returning, so
+        overload and connection errors surface to the caller immediately.
+        """
+        self._acquire()
+        started = time.monotonic()
+        try:
+            response = self._post('/api/generate', {
+                'model': model or self.model,
+                'prompt': prompt,
+                'stream': True,
+                'options': options or {}
+            }, stream=True)
+        except Exception:
+            self._release(started)
+            raise
+        return TokenStream(response, lambda: self._release(started))
+
+    def embed(self, texts: List[str], model: str) -> List[List[float]]:
+        """Embed a batch of texts with one request
+
+        Uses /api/embed, falling back to one /api/embeddings call per text on
+        Ollama versions that predate batch embedding. Takes an embedding slot,
+        not a generation slot.
+        """
+        if not self.embed_slots.acquire(timeout=self.queue_timeout):
+            raise OllamaOverloaded('Timed out waiting for an embedding slot', self._retry_after())
+        if not self.breaker.allow():
+            self.embed_slots.release()
+            raise OllamaOverloaded('Ollama circuit is open', self.breaker.retry_after())
+        try:
+            try:
+                response = self._post('/api/embed', {'model': model, 'input': texts})
+                return response.json()['embeddings']
+            except OllamaError as e:
+                if e.status_code != 404:
+                    raise
+            return [
+                self._post('/api/embeddings', {'model': model, 'prompt': text}).json()['embedding']
+                for text in texts
+            ]
+        finally:
+            self.embed_slots.release()
+
+    def check(self) -> bool:
+        """Return True if the Ollama server answers /api/tags"""
+        try:
+            response = self.session.get(f'{self.host}/api/tags', timeout=self.timeout[0])
+            return response.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def stats(self) -> Dict:
+        """Snapshot of queue, wait-time and breaker statistics"""
+        with self.lock:
+            data = dict(self.stats_data)
+        admitted = data['admitted']
+        completed = data['completed']
+        data['avg_wait_time'] = round(data['total_wait_time'] / admitted, 4) if admitted else 0.0
+        data['avg_generation_time'] = round(data['total_generation_time'] / completed, 4) if completed else 0.0
+        data['total_wait_time'] = round(data['total_wait_time'], 4)
+        data['max_wait_time'] = round(data['max_wait_time'], 4)
+        data['total_generation_time'] = round(data['total_generation_time'], 4)
+        data['max_concurrency'] = self.max_concurrency
+        data['max_queue'] = self.max_queue
+        data['circuit_state'] = self.breaker.state
+        return data
+
+    def _retry_after(self) -> int:
+        """Estimate seconds until a slot frees up for a new caller"""
+        with self.lock:
+            completed = self.stats_data['completed']
+            avg = self.stats_data['total_generation_time'] / completed if completed else 5.0
+            waiting = self.stats_data['queue_depth'] + 1
+        return max(1, math.ceil(avg * waiting / self.max_concurrency))
+
+    def _acquire(self):
+        """Wait for a generation slot, shedding load when the queue is full"""
+        self._enqueue()
+        waited_from = time.monotonic()
+        acquired = self.slots.acquire(timeout=self.queue_timeout)
+        self._admit(acquired, time.monotonic() - waited_from)
+
+    def _enqueue(self):
+        """Join the wait queue, or raise OllamaOverloaded if it is full"""
+        with self.lock:
+            if self.stats_data['queue_depth'] >= self.max_queue:
+                self.stats_data['rejected'] += 1
+                full = True
+            else:
+                self.stats_data['queue_depth'] += 1
+                self.stats_data['max_queue_depth'] = max(self.stats_data['max_queue_depth'],
+                                                         self.stats_data['queue_depth'])
+                full = False
+        if full:
+            raise OllamaOverloaded('Ollama queue is full', self._retry_after())
+
+    def _admit(self, acquired: bool, waited: float):
+        """Leave the wait queue holding a slot, or raise OllamaOverloaded"""
+        with self.lock:
+            self.stats_data['queue_depth'] -= 1
+            if not acquired:
+                self.stats_data['rejected'] += 1
+            else:
+                self.stats_data['admitted'] += 1
+                self.stats_data['in_flight'] += 1
+                self.stats_data['total_wait_time'] += waited
+                self.stats_data['max_wait_time'] = max(self.stats_data['max_wait_time'], waited)
+        if not acquired:
+            raise OllamaOverloaded('Timed out waiting for Ollama', self._retry_after())
+
+        if not self.breaker.allow():
+            with self.lock:
+                self.stats_data['in_flight'] -= 1
+                self.stats_data['admitted'] -= 1
+                self.stats_data['rejected'] += 1
+            self.slots.release()
+            raise OllamaOverloaded('Ollama circuit is open', self.breaker.retry_after())
+
+    def _release(self, started: float):
+        with self.lock:
+            self.stats_data['in_flight'] -= 1
+            self.stats_data['completed'] += 1
+            self.stats_data['total_generation_time'] += time.monotonic() - started
+        self.slots.release()
+
+    def _post(self, path: str, payload: Dict, stream: bool = False) -> requests.Response:
+        """POST with retry and exponential backoff on connection errors and 5xx"""
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self.lock:
+                    self.stats_data['retries'] += 1
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+            try:
+                response = self.session.post(f'{self.host}{path}', json=payload,
+                                             stream=stream, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+                continue
+            if response.status_code >= 500:
+                response.close()
+                last_error = OllamaError(f'Ollama returned {response.status_code}')
+                continue
+            if response.status_code != 200:
+                response.close()
+                # Client errors (unknown model, bad request) are not worth retrying
+                self.breaker.record_success()
+                raise OllamaError(f'Ollama returned {response.status_code}', response.status_code)
+            self.breaker.record_success()
+            return response
+
+        self.breaker.record_failure()
+        with self.lock:
+            self.stats_data['failures'] += 1
+        raise OllamaError(f'Ollama request failed: {last_error}')
+
+class TokenStream:
+    """Iterator over streamed response tokens that frees its slot when closed"""
+
+    def __init__(self, response: requests.Response, release):
+        self.response = response
+        self.release = release
+        self.lines = response.iter_lines()
+        self.finished = False
+        self.closed = False
+
+    def __iter__(self) -> Iterator[str]:
+        return self
+
+    def __next__(self) -> str:
+        if self.closed:
+            raise StopIteration
+        try:
+            while not self.finished:
+                line = next(self.lines, None)
+                if line is None:
+                    break
+                if not line:
+                    continue
+                # Ollama streams one JSON object per line
+                chunk = json.loads(line)
+                self.finished = bool(chunk.get('done'))
+                if chunk.get('response'):
+                    return chunk['response']
+        except Exception:
+            self.close()
+            raise
+        self.close()
+        raise StopIteration
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.response.close()
+            self.release()
+
+    def __del__(self):
+        self.close()
+
+class AsyncOllamaClient:
+    """asyncio counterpart of OllamaClient for the ASGI server
+
+    Shares the wrapped client's slots, wait queue, breaker and statistics,
+    so blocking and async callers in one process stay under one
+    OLLAMA_MAX_CONCURRENCY. Waiting for a slot or a response suspends a
+    coroutine instead of holding a thread. Requires httpx.
+    """
+
+    def __init__(self, client: OllamaClient):
+        if httpx is None:
+            raise RuntimeError('AsyncOllamaClient requires httpx (pip install httpx)')
+        self.client = client
+        connect_timeout, read_timeout = client.timeout
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=client.max_concurrency + 2,
+                                max_keepalive_connections=client.max_concurrency + 2)
+        )
+
+    async def generate(self, prompt: str, options: Optional[Dict] = None, model: Optional[str] = None) -> str:
+        """Run a generation and return the full response text"""
+        await self._acquire()
+        started = time.monotonic()
+        try:
+            response = await self._post('/api/generate', {
+                'model': model or self.client.model,
+                'prompt': prompt,
+                'stream': False,
+                'options': options or {}
+            })
+            return response.json().get('response', '')
+        finally:
+            self.client._release(started)
+
+    async def stream(self, prompt: str, options: Optional[Dict] = None,
+                     model: Optional[str] = None) -> 'AsyncTokenStream':
+        """Admit a streaming generation and return an async iterator of tokens"""
+        await self._acquire()
+        started = time.monotonic()
+        try:
+            response = await self._post('/api/generate', {
+                'model': model or self.client.model,
+                'prompt': prompt,
+                'stream': True,
+                'options': options or {}
+            }, stream=True)
+        except BaseException:
+            self.client._release(started)
+            raise
+        return AsyncTokenStream(response, lambda: self.client._release(started))
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    async def _acquire(self):
+        client = self.client
+        client._enqueue()
+        waited_from = time.monotonic()
+        try:
+            acquired = await client.slots.acquire_async(timeout=client.queue_timeout)
+        except BaseException:
+            with client.lock:
+                client.stats_data['queue_depth'] -= 1
+            raise
+        client._admit(acquired, time.monotonic() - waited_from)
+
+    async def _post(self, path: str, payload: Dict, stream: bool = False) -> 'httpx.Response':
+        """POST with the same retry, backoff and breaker rules as OllamaClient._post"""
+        client = self.client
+        last_error = None
+        for attempt in range(client.max_retries + 1):
+            if attempt:
+                with client.lock:
+                    client.stats_data['retries'] += 1
+                await asyncio.sleep(client.backoff * (2 ** (attempt - 1)))
+            try:
+                request = self.http.build_request('POST', f'{client.host}{path}', json=payload)
+                response = await self.http.send(request, stream=stream)
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                last_error = e
+                continue
+            if response.status_code >= 500:
+                await response.aclose()
+                last_error = OllamaError(f'Ollama returned {response.status_code}')
+                continue
+            if response.status_code != 200:
+                await response.aclose()
+                client.breaker.record_success()
+                raise OllamaError(f'Ollama returned {response.status_code}', response.status_code)
+            client.breaker.record_success()
+            return response
+
+        client.breaker.record_failure()
+        with client.lock:
+            client.stats_data['failures'] += 1
+        raise OllamaError(f'Ollama request failed: {last_error}')
+
+# Responses being closed for streams that were garbage-collected, kept until done
+_closing = set()
+
+def _close_response(response: 'httpx.Response'):
+    task = asyncio.ensure_future(response.aclose())
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+class AsyncTokenStream:
+    """Async iterator over streamed response tokens that frees its slot when closed"""
+
+    def __init__(self, response: 'httpx.Response', release):
+        self.response = response
+        self.release = release
+        self.loop = asyncio.get_running_loop()
+        self.lines = response.aiter_lines()
+        self.finished = False
+        self.closed = False
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self
+
+    async def __anext__(self) -> str:
+        if self.closed:
+            raise StopAsyncIteration
+        try:
+            while not self.finished:
+                line = await self.lines.__anext__()
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                self.finished = bool(chunk.get('done'))
+                if chunk.get('response'):
+                    return chunk['response']
+        except StopAsyncIteration:
+            pass
+        except BaseException:
+            await self.aclose()
+            raise
+        await self.aclose()
+        raise StopAsyncIteration
+
+    async def aclose(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                await self.response.aclose()
+            finally:
+                self.release()
+
+    def __del__(self):
+        # Garbage-collected without aclose(): free the slot now and close the
+        # response on its loop, so its pooled connection goes back to httpx
+        if not self.closed:
+            self.closed = True
+            self.release()
+            try:
+                self.loop.call_soon_threadsafe(_close_response, self.response)
+            except RuntimeError:
+                pass  # The loop is closed, and its connections with it
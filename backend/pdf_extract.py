@@ -0,0 +1,107 @@
+# pdf_extract.py - In-memory, parallel PDF text extraction
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import PyPDF2
+
+# Documents with fewer pages than this are extracted in-process
+PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', 32))
+MAX_WORKERS = int(os.environ.get('PDF_WORKERS', os.cpu_count() or 1))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ProcessPoolExecutor:
+    """Shared process pool, created on first use
+
+    Workers are started with forkserver (spawn where that is unavailable)
+    rather than forked from the multithreaded server process. Like any
+    non-fork worker they import the __main__ script: the launcher under
+    gunicorn or uvicorn, but app.py itself, set-up included, when the
+    development server is started with `python app.py`.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=context)
+        return _pool
+
+def _extract_range(name: str, size: int, start: int, end: int) -> List[Tuple[int, str]]:
+    """Extract pages [start, end) of the PDF in shared memory block name; runs inside a worker process
+
+    Nothing is kept once the range is done, so an idle worker holds no
+    document.
+    """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        reader = PyPDF2.PdfReader(io.BytesIO(block.buf[:size]))
+        return [(page_num + 1, reader.pages[page_num].extract_text() or '')
+                for page_num in range(start, end)]
+    finally:
+        block.close()
+
+def iter_pages(data: bytes, workers: Optional[int] = None,
+               progress: Optional[Callable[[int, int], None]] = None) -> Iterator[Tuple[int, str]]:
+    """Yield (page number, text) for every page, in order
+
+    Large documents are split into page ranges extracted across the process
+    pool; results are still yielded in page order as each range finishes.
+    progress, if given, is called with (pages done, page count).
+    """
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    page_count = len(reader.pages)
+    workers = workers or MAX_WORKERS
+    if progress:
+        progress(0, page_count)
+
+    if page_count < PARALLEL_MIN_PAGES or workers < 2:
+        for page_num, page in enumerate(reader.pages):
+            text = page.extract_text() or ''
+            if progress:
+                progress(page_num + 1, page_count)
+            yield page_num + 1, text
+        return
+
+    # A few ranges per worker keeps the pool busy when pages vary in cost.
+    # Workers read the upload from one shared memory block instead of each
+    # range being sent a pickled copy of the bytes.
+    batch = max(1, -(-page_count // (workers * 2)))
+    starts = list(range(0, page_count, batch))
+    ends = [min(start + batch, page_count) for start in starts]
+    block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    try:
+        block.buf[:len(data)] = data
+        futures = [get_pool().submit(_extract_range, block.name, len(data), start, end)
+                   for start, end in zip(starts, ends)]
+        try:
+            for future in futures:
+                pages = future.result()
+                if progress:
+                    progress(pages[-1][0], page_count)
+                yield from pages
+        finally:
+            for future in futures:
+                future.cancel()
+            # Ranges already running still read the block
+            for future in futures:
+                if not future.cancelled():
+                    future.exception()
+    finally:
+        block.close()
+        block.unlink()
+
+def extract_text(data: bytes, workers: Optional[int] = None,
+                 progress: Optional[Callable[[int, int], None]] = None) -> str:
+    """Extract all non-empty pages, joined once with page markers"""
+    return ''.join(
+        f"\n--- Page {page_num} ---\n{text}\n"
+        for page_num, text in iter_pages(data, workers, progress)
+        if text.strip()
+    )
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Compute Retrieval Accuracy: Recall@k and MRR@k
+Compute Retrieval Accuracy: Recall@k, MRR@k, nDCG@k and MAP@k
 
 Input CSV must have columns:
 - query_id: unique id per query (string or int)
@@ -11,26 +11,50 @@ Input CSV must have columns:
 Example row:
 42,"A;C","B;A;D;E"
 
+The CSV is read in chunks of --chunk-size rows, so memory stays flat on
+multi-million-row logs. Each chunk becomes a hit matrix (one row per
+query, one column per rank up to max(k)), and every k is computed from
+its cumulative sums at once. --workers spreads chunks over processes,
+with at most two chunks per worker read ahead.
+
+A retrieved id repeated further down the list counts only once, so
+Recall@k never exceeds 1.
+
 Usage:
 python retrieval_metrics.py --input data.csv --ks 1 3 5 10 --output metrics.csv
+python retrieval_metrics.py --input big.csv --ks 1 3 5 10 --workers 4 --chunk-size 200000
 """
 import argparse
 import csv
-from collections import defaultdict
-from typing import List, Dict, Tuple, Set
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+from typing import Iterator, List, Dict, Optional, Tuple, Set
+
+import numpy as np
+
+METRICS = ('Recall', 'MRR', 'nDCG', 'MAP')
 
 def parse_list(cell: str, sep: str = ';') -> List[str]:
     if cell is None:
         return []
     # Split, strip, drop empties
-    return [x.strip() for x in str(cell).split(sep) if str(x).strip() != '']
+    return [x for x in (part.strip() for part in str(cell).split(sep)) if x]
+
+def hit_ranks(relevant: Set[str], retrieved: List[str], k: int) -> List[int]:
+    """1-based ranks within the top k where a relevant id first appears"""
+    seen = set()
+    ranks = []
+    for idx, doc_id in enumerate(retrieved[:k], start=1):
+        if doc_id in relevant and doc_id not in seen:
+            seen.add(doc_id)
+            ranks.append(idx)
+    return ranks
 
 def recall_at_k(relevant: Set[str], retrieved: List[str], k: int) -> float:
     if len(relevant) == 0:
         return 0.0
-    topk = retrieved[:k]
-    hit = sum(1 for r in topk if r in relevant)
-    return hit / float(len(relevant))
+    return len(hit_ranks(relevant, retrieved, k)) / float(len(relevant))
 
 def mrr_at_k(relevant: Set[str], retrieved: List[str], k: int) -> float:
     topk = retrieved[:k]
@@ -39,36 +63,152 @@ def mrr_at_k(relevant: Set[str], retrieved: List[str], k: int) -> float:
             return 1.0 / idx
     return 0.0
 
+def ndcg_at_k(relevant: Set[str], retrieved: List[str], k: int) -> float:
+    if len(relevant) == 0:
+        return 0.0
+    dcg = sum(1.0 / np.log2(idx + 1) for idx in hit_ranks(relevant, retrieved, k))
+    idcg = sum(1.0 / np.log2(idx + 1) for idx in range(1, min(len(relevant), k) + 1))
+    return float(dcg / idcg)
+
+def ap_at_k(relevant: Set[str], retrieved: List[str], k: int) -> float:
+    if len(relevant) == 0:
+        return 0.0
+    total = sum(hits / idx for hits, idx in enumerate(hit_ranks(relevant, retrieved, k), start=1))
+    return total / min(len(relevant), k)
+
+def hit_matrix(pairs: List[Tuple[str, str]], max_k: int, sep: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Hits by rank (queries x max_k) and relevant counts for (relevant, retrieved) cells
+
+    A retrieved id repeated further down the list counts only once.
+    """
+    num_relevant = np.zeros(len(pairs), dtype=np.float64)
+    hit_rows = []
+    hit_cols = []
+    for row, (relevant_cell, retrieved_cell) in enumerate(pairs):
+        relevant = set(parse_list(relevant_cell, sep=sep))
+        num_relevant[row] = len(relevant)
+        if not relevant:
+            continue
+        for idx, doc_id in enumerate(parse_list(retrieved_cell, sep=sep)[:max_k]):
+            if doc_id in relevant:
+                hit_rows.append(row)
+                hit_cols.append(idx)
+                relevant.discard(doc_id)
+    # One scatter into the matrix instead of an element-wise store per hit
+    hits = np.zeros((len(pairs), max_k), dtype=np.float64)
+    hits[hit_rows, hit_cols] = 1.0
+    return hits, num_relevant
+
+def chunk_sums(pairs: List[Tuple[str, str]], ks: List[int], sep: str) -> Tuple[int, Dict[str, np.ndarray]]:
+    """Per-k metric sums over one chunk of queries, computed for all k at once"""
+    ks_index = np.asarray(ks) - 1
+    max_k = max(ks)
+    hits, num_relevant = hit_matrix(pairs, max_k, sep)
+    has_relevant = num_relevant > 0
+    safe_relevant = np.where(has_relevant, num_relevant, 1.0)
+    ranks = np.arange(1, max_k + 1, dtype=np.float64)
+
+    cumulative_hits = np.cumsum(hits, axis=1)
+    recall = cumulative_hits / safe_relevant[:, None]
+
+    # Reciprocal rank of the first hit, counted from that rank onwards
+    first_hit = np.where(hits.any(axis=1), hits.argmax(axis=1) + 1, max_k + 1)
+    mrr = np.where(ranks[None, :] >= first_hit[:, None], 1.0 / first_hit[:, None], 0.0)
+
+    discounts = 1.0 / np.log2(ranks + 1)
+    dcg = np.cumsum(hits * discounts, axis=1)
+    ideal = np.cumsum(discounts)
+    # Ideal DCG@k uses min(|relevant|, k) hits at the top ranks
+    ideal_hits = np.minimum(num_relevant[:, None], ranks[None, :]).astype(np.int64)
+    idcg = np.where(ideal_hits > 0, ideal[np.maximum(ideal_hits - 1, 0)], 1.0)
+    ndcg = dcg / idcg
+
+    precision_at_hits = np.cumsum(hits * (cumulative_hits / ranks), axis=1)
+    ap = precision_at_hits / np.maximum(np.minimum(num_relevant[:, None], ranks[None, :]), 1.0)
+
+    sums = {}
+    for name, values in zip(METRICS, (recall, mrr, ndcg, ap)):
+        sums[name] = np.where(has_relevant[:, None], values, 0.0)[:, ks_index].sum(axis=0)
+    return len(pairs), sums
+
+def evaluate(chunks: Iterator[List[Tuple[str, str]]], ks: List[int], sep: str = ';',
+             workers: int = 1) -> Dict[str, Dict[int, float]]:
+    """Mean of every metric at every k over all chunks of (relevant, retrieved) cells"""
+    ks = sorted(set(ks))
+    totals = {name: np.zeros(len(ks)) for name in METRICS}
+    count = 0
+
+    def accumulate(result):
+        nonlocal count
+        rows, sums = result
+        count += rows
+        for name in METRICS:
+            totals[name] += sums[name]
+
+    if workers > 1:
+        with Pool(workers) as pool:
+            # Read ahead no more than two chunks per worker, so memory stays flat
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(chunk_sums, (chunk, ks, sep)))
+                if len(pending) >= 2 * workers:
+                    accumulate(pending.popleft().get())
+            while pending:
+                accumulate(pending.popleft().get())
+    else:
+        for chunk in chunks:
+            accumulate(chunk_sums(chunk, ks, sep))
+
+    return {
+        name: {k: (float(totals[name][i]) / count if count else 0.0) for i, k in enumerate(ks)}
+        for name in METRICS
+    }
+
 def compute_metrics(rows: List[Dict[str, str]], ks: List[int], sep: str,
                     relevant_col: str, retrieved_col: str, query_col: str
                    ) -> Tuple[Dict[int, float], Dict[int, float]]:
-    recalls = defaultdict(list)  # k -> list of per-query recall@k
-    mrrs = defaultdict(list)     # k -> list of per-query mrr@k
-
-    for row in rows:
-        relevant = set(parse_list(row.get(relevant_col, ''), sep=sep))
-        retrieved = parse_list(row.get(retrieved_col, ''), sep=sep)
+    pairs = [(row.get(relevant_col, ''), row.get(retrieved_col, '')) for row in rows]
+    results = evaluate(iter([pairs]), ks, sep)
+    return results['Recall'], results['MRR']
 
-        for k in ks:
-            recalls[k].append(recall_at_k(relevant, retrieved, k))
-            mrrs[k].append(mrr_at_k(relevant, retrieved, k))
-
-    mean_recall = {k: (sum(v)/len(v) if v else 0.0) for k, v in recalls.items()}
-    mean_mrr = {k: (sum(v)/len(v) if v else 0.0) for k, v in mrrs.items()}
-    return mean_recall, mean_mrr
+def iter_chunks(path: str, chunk_size: int, relevant_col: str, retrieved_col: str
+               ) -> Iterator[List[Tuple[str, str]]]:
+    """Stream (relevant, retrieved) cells from the CSV, chunk_size rows at a time"""
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        for col in (relevant_col, retrieved_col):
+            if col not in header:
+                raise ValueError(f'Column {col!r} not found in {path}')
+        relevant_idx = header.index(relevant_col)
+        retrieved_idx = header.index(retrieved_col)
+        while True:
+            chunk = [
+                (row[relevant_idx] if len(row) > relevant_idx else '',
+                 row[retrieved_idx] if len(row) > retrieved_idx else '')
+                for row in islice(reader, chunk_size)
+            ]
+            if not chunk:
+                return
+            yield chunk
 
 def load_rows(path: str) -> List[Dict[str, str]]:
     with open(path, 'r', encoding='utf-8-sig', newline='') as f:
         reader = csv.DictReader(f)
         return list(reader)
 
-def save_summary(path: str, mean_recall: Dict[int, float], mean_mrr: Dict[int, float]) -> None:
-    ks_sorted = sorted(set(list(mean_recall.keys()) + list(mean_mrr.keys())))
+def save_summary(path: str, mean_recall: Dict[int, float], mean_mrr: Dict[int, float],
+                 mean_ndcg: Optional[Dict[int, float]] = None, mean_map: Optional[Dict[int, float]] = None) -> None:
+    rows = [('Recall', mean_recall), ('MRR', mean_mrr), ('nDCG', mean_ndcg), ('MAP', mean_map)]
+    rows = [(name, values) for name, values in rows if values is not None]
+    ks_sorted = sorted(set(k for _, values in rows for k in values))
     with open(path, 'w', encoding='utf-8', newline='') as f:
         writer = csv.writer(f)
         writer.writerow(['metric'] + [f'@{k}' for k in ks_sorted])
-        writer.writerow(['Recall'] + [f'{mean_recall.get(k, 0.0):.6f}'] * len(ks_sorted))
-        writer.writerow(['MRR'] + [f'{mean_mrr.get(k, 0.0):.6f}'] * len(ks_sorted))
+        for name, values in rows:
+            writer.writerow([name] + [f'{values.get(k, 0.0):.6f}' for k in ks_sorted])
 
 def main():
     parser = argparse.ArgumentParser(description='Compute Recall@k and MRR@k for retrieval results.')
@@ -80,24 +220,30 @@ def main():
     parser.add_argument('--relevant_col', default='relevant_ids', help='Name of column with relevant ids.')
     parser.add_argument('--retrieved_col', default='retrieved_ids', help='Name of column with retrieved ids (ranked).')
     parser.add_argument('--query_col', default='query_id', help='Name of the query id column.')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='Rows read and scored per chunk.')
+    parser.add_argument('--workers', type=int, default=1, help='Processes scoring chunks in parallel.')
     args = parser.parse_args()
 
-    rows = load_rows(args.input)
-    if not rows:
+    chunks = iter_chunks(args.input, args.chunk_size, args.relevant_col, args.retrieved_col)
+    first = next(chunks, None)
+    if not first:
         print('No rows found in input.')
         return
 
-    mean_recall, mean_mrr = compute_metrics(rows, args.ks, args.sep,
-                                            args.relevant_col, args.retrieved_col, args.query_col)
+    def all_chunks():
+        yield first
+        yield from chunks
+
+    results = evaluate(all_chunks(), args.ks, args.sep, args.workers)
 
     # Pretty print
     print('=== Retrieval Metrics ===')
-    print('k\tRecall@k\tMRR@k')
-    for k in sorted(args.ks):
-        print(f'{k}\t{mean_recall.get(k, 0.0):.6f}\t{mean_mrr.get(k, 0.0):.6f}')
+    print('k\tRecall@k\tMRR@k\tnDCG@k\tMAP@k')
+    for k in sorted(set(args.ks)):
+        print('\t'.join([str(k)] + [f'{results[name][k]:.6f}' for name in METRICS]))
 
     # Save CSV summary
-    save_summary(args.output, mean_recall, mean_mrr)
+    save_summary(args.output, results['Recall'], results['MRR'], results['nDCG'], results['MAP'])
     print(f'\nSaved summary to: {args.output}')
 
 if __name__ == '__main__':
@@ -1,55 +1,471 @@
 # simple_rag.py
+import heapq
 import json
-from typing import List, Dict
+import math
+import re
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from typing import Callable, Iterable, List, Dict, Optional, Set, Tuple
+
+import numpy as np
+
+from index_segments import score_batch
+from stage_metrics import timed
+
+# Word tokens, keeping inner apostrophes ("don't") but dropping punctuation
+TOKEN_PATTERN = re.compile(r"\w+(?:'\w+)*")
+
+# Words shared by consecutive chunks
+CHUNK_OVERLAP = 50
+# Recently returned chunk texts kept built, so hot chunks skip the join
+CHUNK_CACHE_SIZE = 1024
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase and split text into punctuation-free word tokens"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+def pairs(plist: array) -> Iterable[Tuple[int, int]]:
+    """(chunk index, term frequency) pairs of a flat posting list"""
+    values = iter(plist)
+    return zip(values, values)
+
+def chunk_bounds(num_words: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """(start, end) word offsets of overlapping chunks"""
+    return [(start, min(start + chunk_size, num_words))
+            for start in range(0, num_words, chunk_size - CHUNK_OVERLAP)]
+
+class Vocabulary:
+    """Interned strings with dense integer ids, shared by every document
+
+    Each distinct word or term is held once; documents refer to it by id.
+    Ids are never reused, so the vocabulary only grows.
+    """
+    __slots__ = ('ids', 'words', 'lock')
 
-class SimplifiedRAG:
-    """Simplified RAG without heavy dependencies"""
-    
     def __init__(self):
+        self.ids = {}
+        self.words = []
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def encode(self, words: Iterable[str]) -> array:
+        words = list(words)
+        ids = self.ids
+        with self.lock:
+            for word in dict.fromkeys(words):
+                if word not in ids:
+                    ids[word] = len(self.words)
+                    self.words.append(word)
+            return array('I', map(ids.__getitem__, words))
+
+    def decode(self, word_ids: Iterable[int]) -> List[str]:
+        return list(map(self.words.__getitem__, word_ids))
+
+class ChunkedDocument:
+    """One indexed document: its words once, chunks as offsets into them
+
+    word_ids is None while the document's text is evicted (or not yet read
+    back from the store); starts and ends stay None until it is first read.
+    """
+    __slots__ = ('word_ids', 'starts', 'ends', 'term_ids', 'chunk_lengths', 'length_norms')
+
+    def __init__(self, term_ids: array, chunk_lengths: array, length_norms: array):
+        self.word_ids = None
+        self.starts = None
+        self.ends = None
+        self.term_ids = term_ids
+        self.chunk_lengths = chunk_lengths
+        self.length_norms = length_norms
+
+    def __len__(self) -> int:
+        return len(self.chunk_lengths)
+
+class SimplifiedRAG:
+    """Simplified RAG without heavy dependencies
+
+    With a store attached, every indexed document is persisted and reloaded
+    by load_from_store() without re-chunking. Postings stay in memory so the
+    whole corpus remains searchable, while chunk texts are kept for at most
+    max_documents documents and read back from the store on demand.
+
+    In memory a document's text is one array of interned word ids; chunks
+    are (start, end) offsets into it, so overlapping words are stored once
+    and chunk strings are only built for the chunks a caller asks for.
+
+    With segments (an index_segments.SegmentIndex) postings live in
+    memory-mapped segment files shared by every process instead, and chunk
+    texts are read from the store; self.documents then stays empty.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, store=None, max_documents: int = 64,
+                 segments=None):
+        if segments is not None and store is None:
+            raise ValueError('Segment-backed indexes need a store for chunk texts')
         self.documents = {}
+        self.store = store
+        self.segments = segments
+        self.max_documents = max_documents
+        # Documents whose chunk texts are currently held in memory, oldest first
+        self.resident = OrderedDict()
+        self.vocabulary = Vocabulary()
+        # (doc_id, chunk index) -> text, least recently used first
+        self.chunk_cache = OrderedDict()
+        # Shared inverted index: term -> doc_id -> flat array of chunk index, term frequency pairs
+        self.postings = {}
+        # Number of chunks containing each term across the whole corpus
+        self.term_df = Counter()
+        self.total_chunks = 0
+        self.total_length = 0
+        # BM25 parameters: term frequency saturation and length normalization
+        self.k1 = k1
+        self.b = b
+        # Guards the shared index; tokenizing happens outside it
+        self.lock = threading.RLock()
         print("Simplified RAG initialized")
-    
-    def index_document(self, doc_id: str, content: str, chunk_size: int = 500):
-        """Store document chunks with simple indexing"""
-        chunks = self._create_chunks(content, chunk_size)
-        self.documents[doc_id] = {
-            'chunks': chunks,
-            'chunk_words': [set(chunk.lower().split()) for chunk in chunks]
-        }
+
+    def index_document(self, doc_id: str, content: str, chunk_size: int = 500,
+                       progress: Optional[Callable[[int, int], None]] = None):
+        """Store document chunks in the shared BM25 inverted index
+
+        progress, if given, is called with (chunks done, chunk count).
+        """
+        with timed('chunk'):
+            words = content.split()
+            word_ids = self.vocabulary.encode(words)
+            bounds = chunk_bounds(len(words), chunk_size) or [(0, 0)]
+            chunks = [' '.join(words[start:end]) for start, end in bounds]
+
+        with timed('index'):
+            doc_postings = {}
+            chunk_lengths = []
+            for i, chunk in enumerate(chunks):
+                tokens = tokenize(chunk)
+                chunk_lengths.append(len(tokens))
+                for term, tf in Counter(tokens).items():
+                    doc_postings.setdefault(term, []).extend((i, tf))
+                if progress:
+                    progress(i + 1, len(chunks))
+
+            if self.store is not None:
+                self.store.save_index(doc_id, doc_postings, chunk_lengths, chunks)
+
+            if self.segments is not None:
+                # Every process sees the document once its segment is published
+                self.segments.publish([(doc_id, doc_postings, chunk_lengths)])
+                with self.lock:
+                    self._forget_chunks(doc_id)
+                print(f"Indexed {len(chunks)} chunks for document {doc_id[:8]} into a segment")
+                return True
+
+            with self.lock:
+                if doc_id in self.documents:
+                    self.remove_document(doc_id)
+                doc = self._add_document(doc_id, doc_postings, chunk_lengths)
+                doc.word_ids = word_ids
+                doc.starts = array('I', [start for start, _ in bounds])
+                doc.ends = array('I', [end for _, end in bounds])
+                self._mark_resident(doc_id)
         print(f"Indexed {len(chunks)} chunks for document {doc_id[:8]}")
         return True
-    
+
+    def load_from_store(self, batch_size: int = 1000) -> int:
+        """Rebuild the in-memory postings from the attached store
+
+        With segments, only stored indexes that no segment holds yet are
+        loaded, and they are written out as segments instead.
+        """
+        if self.store is None:
+            return 0
+        if self.segments is not None:
+            batch = []
+            count = 0
+            for doc_id, doc_postings, chunk_lengths in self.store.iter_indexes():
+                if doc_id not in self.segments.view.docs:
+                    batch.append((doc_id, doc_postings, chunk_lengths))
+                if len(batch) >= batch_size:
+                    self.segments.publish(batch)
+                    count += len(batch)
+                    batch = []
+            self.segments.publish(batch)
+            count += len(batch)
+            print(f"Wrote {count} stored indexes to segments; {len(self.segments.view.docs)} documents mapped")
+            return count
+        count = 0
+        for doc_id, doc_postings, chunk_lengths in self.store.iter_indexes():
+            with self.lock:
+                if doc_id in self.documents:
+                    self.remove_document(doc_id)
+                self._add_document(doc_id, doc_postings, chunk_lengths)
+            count += 1
+        print(f"Loaded {count} indexed documents from store")
+        return count
+
+    def _add_document(self, doc_id: str, doc_postings: Dict, chunk_lengths: List[int]) -> ChunkedDocument:
+        """Merge one document's postings into the shared index, without its text"""
+        term_ids = self.vocabulary.encode(doc_postings)
+        words = self.vocabulary.words
+        for term_id, plist in zip(term_ids, doc_postings.values()):
+            # The vocabulary's copy of the term is the one kept as a key
+            term = words[term_id]
+            self.postings.setdefault(term, {})[doc_id] = array('I', plist)
+            self.term_df[term] += len(plist) // 2
+        self.total_chunks += len(chunk_lengths)
+        self.total_length += sum(chunk_lengths)
+
+        avg_length = (sum(chunk_lengths) / len(chunk_lengths)) or 1.0
+        # Precompute the length-dependent part of the BM25 denominator
+        length_norms = array('d', [
+            self.k1 * (1 - self.b + self.b * length / avg_length)
+            for length in chunk_lengths
+        ])
+
+        doc = ChunkedDocument(term_ids, array('I', chunk_lengths), length_norms)
+        self.documents[doc_id] = doc
+        return doc
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.documents or (self.segments is not None and self.segments.has(doc_id))
+
+    def document_ids(self) -> List[str]:
+        """Ids of every indexed document"""
+        with self.lock:
+            ids = list(self.documents)
+        return ids + self.segments.document_ids() if self.segments is not None else ids
+
+    def _get_chunks(self, doc_id: str) -> List[str]:
+        """Every chunk text of a document"""
+        if doc_id not in self.documents:
+            return self.store.load_chunks(doc_id)
+        return self._build_chunks(doc_id, range(len(self.documents[doc_id])))
+
+    def _chunk_texts(self, doc_id: str, indices: List[int]) -> List[str]:
+        """Texts of a few chunks, from the chunk cache where possible"""
+        cache = self.chunk_cache
+        missing = [idx for idx in indices if (doc_id, idx) not in cache]
+        for idx, text in zip(missing, self._build_chunks(doc_id, missing) if missing else []):
+            cache[(doc_id, idx)] = text
+        texts = []
+        for idx in indices:
+            cache.move_to_end((doc_id, idx))
+            texts.append(cache[(doc_id, idx)])
+        while len(cache) > CHUNK_CACHE_SIZE:
+            cache.popitem(last=False)
+        return texts
+
+    def _build_chunks(self, doc_id: str, indices: Iterable[int]) -> List[str]:
+        """Join chunk texts from word ids, reloading evicted words from the store"""
+        doc = self.documents.get(doc_id)
+        if doc is None:
+            # Segment-backed: the store holds the only copy of the text
+            chunks = self.store.load_chunks(doc_id)
+            return [chunks[idx] for idx in indices]
+        if doc.word_ids is None:
+            self._load_words(doc, self.store.load_chunks(doc_id))
+        self._mark_resident(doc_id)
+        words, word_ids = self.vocabulary.words, doc.word_ids
+        return [' '.join(map(words.__getitem__, word_ids[doc.starts[idx]:doc.ends[idx]])) for idx in indices]
+
+    def _load_words(self, doc: ChunkedDocument, chunks: List[str]):
+        """Rebuild the word array and chunk offsets from stored chunk texts"""
+        word_ids = array('I')
+        starts = array('I')
+        ends = array('I')
+        previous = []
+        for chunk in chunks:
+            chunk_words = chunk.split()
+            # Consecutive chunks share their CHUNK_OVERLAP boundary words
+            overlap = min(CHUNK_OVERLAP, len(chunk_words), len(previous))
+            if overlap and chunk_words[:overlap] != previous[len(previous) - overlap:]:
+                overlap = 0
+            starts.append(len(word_ids) - overlap)
+            word_ids.extend(self.vocabulary.encode(chunk_words[overlap:]))
+            ends.append(len(word_ids))
+            previous = chunk_words
+        doc.word_ids, doc.starts, doc.ends = word_ids, starts, ends
+
+    def _mark_resident(self, doc_id: str):
+        self.resident[doc_id] = True
+        self.resident.move_to_end(doc_id)
+        # Without a store evicted chunks could not be reloaded
+        if self.store is None:
+            return
+        while len(self.resident) > self.max_documents:
+            evicted, _ = self.resident.popitem(last=False)
+            self.documents[evicted].word_ids = None
+
+    def remove_document(self, doc_id: str) -> bool:
+        """Drop a document and its postings from the shared index"""
+        with self.lock:
+            if self.segments is not None and doc_id in self.segments.view.docs:
+                self.segments.delete([doc_id])
+                self._forget_chunks(doc_id)
+                return True
+            doc = self.documents.pop(doc_id, None)
+            if doc is None:
+                return False
+
+            for term in self.vocabulary.decode(doc.term_ids):
+                by_doc = self.postings[term]
+                self.term_df[term] -= len(by_doc.pop(doc_id)) // 2
+                if not by_doc:
+                    del self.postings[term]
+                    del self.term_df[term]
+            self.total_chunks -= len(doc.chunk_lengths)
+            self.total_length -= sum(doc.chunk_lengths)
+            self._forget_chunks(doc_id)
+            self.resident.pop(doc_id, None)
+            return True
+
+    def _forget_chunks(self, doc_id: str):
+        """Drop a document's cached chunk texts; lock held"""
+        for key in [key for key in self.chunk_cache if key[0] == doc_id]:
+            del self.chunk_cache[key]
+
     def retrieve(self, doc_id: str, query: str, top_k: int = 3) -> List[str]:
-        """Retrieve relevant chunks using keyword matching"""
+        """Retrieve relevant chunks using BM25 scoring"""
+        query_terms = set(tokenize(query))
+
+        with self.lock:
+            return self._retrieve_terms(doc_id, query_terms, top_k)
+
+    def retrieve_batch(self, queries: List[Tuple[str, str]], top_k: int = 3) -> List[List[str]]:
+        """Retrieve chunks for many (doc_id, query) pairs in a single pass
+
+        Each distinct query is tokenized once and the index lock is taken once
+        for the whole batch. The queries on one document are scored together:
+        every distinct term's postings are read and weighted once and added
+        into a queries x chunks array. Results are returned in input order.
+        """
+        terms_by_query = {query: set(tokenize(query)) for _, query in queries}
+        rows_by_doc = {}
+        for row, (doc_id, _) in enumerate(queries):
+            rows_by_doc.setdefault(doc_id, []).append(row)
+
+        results = [[] for _ in queries]
+        with self.lock:
+            for doc_id, rows in rows_by_doc.items():
+                if doc_id not in self:
+                    continue
+                ranked = self._score_batch(doc_id, [terms_by_query[queries[row][1]] for row in rows], top_k)
+                for row, hits in zip(rows, ranked):
+                    results[row] = self._chunk_texts(doc_id, [idx for idx, _ in hits] or [0])
+        return results
+
+    def score_chunks(self, doc_id: str, query: str, top_k: int = 3) -> List[Tuple[int, float]]:
+        """Top (chunk index, BM25 score) pairs for a query, best first"""
+        query_terms = set(tokenize(query))
+
+        with self.lock:
+            if doc_id not in self:
+                return []
+            return self._score_terms(doc_id, query_terms, top_k)
+
+    def chunk_texts(self, doc_id: str, indices: Optional[List[int]] = None) -> List[str]:
+        """Texts of the given chunks of a document, or all of them"""
+        with self.lock:
+            return self._get_chunks(doc_id) if indices is None else self._chunk_texts(doc_id, indices)
+
+    def _retrieve_terms(self, doc_id: str, query_terms: Set[str], top_k: int) -> List[str]:
+        """Score one document's chunks for tokenized query terms; lock held"""
+        if doc_id not in self:
+            return []
+
+        ranked = self._score_terms(doc_id, query_terms, top_k)
+        return self._chunk_texts(doc_id, [idx for idx, score in ranked] or [0])
+
+    def _score_batch(self, doc_id: str, term_sets: List[Set[str]], top_k: int) -> List[List[Tuple[int, float]]]:
+        """BM25 top_k over one document's chunks for several queries; lock held"""
         if doc_id not in self.documents:
+            return self.segments.score_document_batch(doc_id, term_sets, self.k1, self.b, top_k)
+        doc = self.documents[doc_id]
+
+        def postings(term):
+            plist = self.postings.get(term, {}).get(doc_id)
+            if not plist:
+                return None
+            flat = np.frombuffer(plist, dtype=np.uint32)
+            return flat[0::2].astype(np.int64), flat[1::2].astype(np.float64)
+
+        return score_batch(term_sets, np.frombuffer(doc.length_norms, dtype=np.float64), self.k1, top_k, postings)
+
+    def _score_terms(self, doc_id: str, query_terms: Set[str], top_k: int) -> List[Tuple[int, float]]:
+        """BM25 top_k over one document's chunks; lock held"""
+        if doc_id not in self.documents:
+            return self.segments.score_document(doc_id, query_terms, self.k1, self.b, top_k)
+        doc = self.documents[doc_id]
+        length_norms = doc.length_norms
+        k1_plus_1 = self.k1 + 1
+
+        scores = {}
+        for term in query_terms:
+            plist = self.postings.get(term, {}).get(doc_id)
+            if not plist:
+                continue
+            term_idf = self._idf(len(doc), len(plist) // 2)
+            for idx, tf in pairs(plist):
+                scores[idx] = scores.get(idx, 0.0) + term_idf * tf * k1_plus_1 / (tf + length_norms[idx])
+
+        # Bounded heap over the chunks that matched a query term
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: (item[1], -item[0]))
+
+    def retrieve_corpus(self, query: str, top_k: int = 3) -> List[Dict]:
+        """Retrieve the best chunks across every indexed document"""
+        with self.lock:
+            ranked = self.score_corpus(query, top_k)
+            return [
+                {
+                    'document_id': doc_id,
+                    'chunk_index': idx,
+                    'score': score,
+                    'text': self._chunk_texts(doc_id, [idx])[0]
+                }
+                for (doc_id, idx), score in ranked
+            ]
+
+    def score_corpus(self, query: str, top_k: int = 3) -> List[Tuple[Tuple[str, int], float]]:
+        """Top ((doc_id, chunk index), BM25 score) pairs across every document, best first"""
+        query_terms = set(tokenize(query))
+
+        with self.lock:
+            if self.segments is not None:
+                return self.segments.score_corpus(query_terms, self.k1, self.b, top_k)
+            return self._score_corpus(query_terms, top_k)
+
+    def _score_corpus(self, query_terms: Set[str], top_k: int) -> List[Tuple[Tuple[str, int], float]]:
+        """BM25 top_k ((doc_id, chunk index), score) over the in-memory index; lock held"""
+        if not self.total_chunks:
             return []
-        
-        doc_data = self.documents[doc_id]
-        query_words = set(query.lower().split())
-        
-        # Score each chunk by word overlap
-        chunk_scores = []
-        for i, chunk_words in enumerate(doc_data['chunk_words']):
-            score = len(query_words & chunk_words) / max(len(query_words), 1)
-            chunk_scores.append((score, i))
-        
-        # Sort by score and get top chunks
-        chunk_scores.sort(reverse=True)
-        top_chunks = []
-        for score, idx in chunk_scores[:top_k]:
-            if score > 0:
-                top_chunks.append(doc_data['chunks'][idx])
-        
-        return top_chunks if top_chunks else [doc_data['chunks'][0]]
-    
+
+        avg_length = (self.total_length / self.total_chunks) or 1.0
+        k1 = self.k1
+        b = self.b
+        k1_plus_1 = k1 + 1
+
+        scores = {}
+        for term in query_terms:
+            by_doc = self.postings.get(term)
+            if not by_doc:
+                continue
+            term_idf = self._idf(self.total_chunks, self.term_df[term])
+            for doc_id, plist in by_doc.items():
+                chunk_lengths = self.documents[doc_id].chunk_lengths
+                for idx, tf in pairs(plist):
+                    norm = k1 * (1 - b + b * chunk_lengths[idx] / avg_length)
+                    key = (doc_id, idx)
+                    scores[key] = scores.get(key, 0.0) + term_idf * tf * k1_plus_1 / (tf + norm)
+
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    @staticmethod
+    def _idf(num_chunks: int, df: int) -> float:
+        """BM25 inverse document frequency, always positive"""
+        return math.log(1 + (num_chunks - df + 0.5) / (df + 0.5))
+
     def _create_chunks(self, text: str, chunk_size: int) -> List[str]:
         """Split text into chunks by word count"""
         words = text.split()
-        chunks = []
-        
-        for i in range(0, len(words), chunk_size - 50):  # 50 word overlap
-            chunk = ' '.join(words[i:i + chunk_size])
-            if chunk:
-                chunks.append(chunk)
-        
+        chunks = [' '.join(words[start:end]) for start, end in chunk_bounds(len(words), chunk_size)]
         return chunks if chunks else [text[:2000]]
\ No newline at end of file
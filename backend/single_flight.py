@@ -0,0 +1,402 @@
+# single_flight.py - Share one in-flight LLM generation among identical concurrent requests
+import asyncio
+import os
+import threading
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional, Tuple
+
+from llm_cache import cache_key, is_deterministic
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+def _copy_error(error: BaseException) -> BaseException:
+    """A fresh instance of a flight's error for one reader
+
+    Raising the shared instance in every reader would append each one's
+    frames to the same traceback; the copy is raised from the original.
+    """
+    copied = type(error).__new__(type(error), *error.args)
+    copied.__dict__.update(error.__dict__)
+    return copied
+
+def _completing(tokens: Iterator[str], on_complete: Optional[Callable[[str], None]]) -> Iterator[str]:
+    """Relay an unshared stream, calling on_complete with its text if it runs to the end"""
+    if on_complete is None:
+        return tokens
+
+    def relay():
+        parts = []
+        try:
+            for token in tokens:
+                parts.append(token)
+                yield token
+        finally:
+            tokens.close()
+        if parts:
+            on_complete(''.join(parts))
+    return relay()
+
+def _completing_async(tokens: AsyncIterator[str],
+                      on_complete: Optional[Callable[[str], Awaitable[None]]]) -> AsyncIterator[str]:
+    if on_complete is None:
+        return tokens
+
+    async def relay():
+        parts = []
+        try:
+            async for token in tokens:
+                parts.append(token)
+                yield token
+        finally:
+            await tokens.aclose()
+        if parts:
+            await on_complete(''.join(parts))
+    return relay()
+
+class Flight:
+    """Tokens of one generation, replayed to every request that joined it
+
+    Fed and read from threads or coroutines alike: threads wait on a
+    condition, coroutines on futures woken through their own event loop.
+    A blocking generation pushes its whole text as a single token.
+    """
+
+    def __init__(self):
+        self.tokens = []
+        self.finished = False
+        self.error = None
+        # Requests still reading, guarded by SingleFlight.lock
+        self.watchers = 0
+        self.cond = threading.Condition()
+        self.wakeups = []
+
+    def push(self, token: str):
+        with self.cond:
+            self.tokens.append(token)
+            self._notify()
+
+    def finish(self, error: Optional[BaseException] = None):
+        with self.cond:
+            self.finished = True
+            self.error = error
+            self._notify()
+
+    def result(self) -> str:
+        """Block until the generation lands and return its full text"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.finished)
+        return self._outcome()
+
+    async def result_async(self) -> str:
+        while not self.finished:
+            await self._changed(len(self.tokens))
+        return self._outcome()
+
+    def stream(self) -> Iterator[str]:
+        """Every token so far, then each new one as it arrives"""
+        index = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: len(self.tokens) > index or self.finished)
+                fresh, done = self.tokens[index:], self.finished
+            index += len(fresh)
+            yield from fresh
+            if done:
+                if self.error:
+                    raise _copy_error(self.error) from self.error
+                return
+
+    async def stream_async(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            await self._changed(index)
+            with self.cond:
+                fresh, done = self.tokens[index:], self.finished
+            index += len(fresh)
+            for token in fresh:
+                yield token
+            if done:
+                if self.error:
+                    raise _copy_error(self.error) from self.error
+                return
+
+    async def _changed(self, seen: int):
+        """Wait until there are more than seen tokens or the flight has landed"""
+        loop = asyncio.get_running_loop()
+        with self.cond:
+            if len(self.tokens) > seen or self.finished:
+                return
+            future = loop.create_future()
+            self.wakeups.append((loop, future))
+        await future
+
+    def _notify(self):
+        """Wake every waiter; cond held"""
+        self.cond.notify_all()
+        for loop, future in self.wakeups:
+            loop.call_soon_threadsafe(_wake, future)
+        self.wakeups = []
+
+    def _outcome(self) -> str:
+        if self.error:
+            raise _copy_error(self.error) from self.error
+        return ''.join(self.tokens)
+
+class FlightStream:
+    """One request's iterator over a shared token stream; close() stops watching"""
+
+    def __init__(self, flights: 'SingleFlight', flight: Flight):
+        self.flights = flights
+        self.flight = flight
+        self.tokens = flight.stream()
+        self.closed = False
+
+    def __iter__(self) -> Iterator[str]:
+        return self
+
+    def __next__(self) -> str:
+        return next(self.tokens)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.tokens.close()
+            self.flights.leave(self.flight)
+
+    def __del__(self):
+        self.close()
+
+class AsyncFlightStream:
+    """Async counterpart of FlightStream"""
+
+    def __init__(self, flights: 'SingleFlight', flight: Flight):
+        self.flights = flights
+        self.flight = flight
+        self.tokens = flight.stream_async()
+        self.closed = False
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self
+
+    async def __anext__(self) -> str:
+        return await self.tokens.__anext__()
+
+    async def aclose(self):
+        if not self.closed:
+            self.closed = True
+            await self.tokens.aclose()
+            self.flights.leave(self.flight)
+
+    def __del__(self):
+        if not self.closed:
+            self.closed = True
+            self.flights.leave(self.flight)
+
+class SingleFlight:
+    """Coalesce identical concurrent generations into one
+
+    The first request for a key leads: it starts the generation, whose
+    tokens (or whole text) go into a Flight. Requests with the same key
+    that arrive before the flight lands follow: they wait on, or stream
+    from, that Flight instead of queueing a generation of their own, and
+    a streamed flight keeps going for them even if the leader's client
+    disconnects. Only deterministic options are coalesced, since sampled
+    generations of one prompt are supposed to differ, and requests that
+    opt out of the response cache neither lead nor follow.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.flights = {}
+        self.lock = threading.Lock()
+        # Strong references to leader tasks, which asyncio only holds weakly
+        self.tasks = set()
+        self.counters = {'leaders': 0, 'followers': 0, 'stream_followers': 0, 'abandoned': 0}
+
+    @classmethod
+    def from_env(cls) -> 'SingleFlight':
+        """Coalescing is on unless LLM_COALESCE is 0"""
+        return cls(enabled=os.environ.get('LLM_COALESCE', '1') not in ('', '0', 'false'))
+
+    def key(self, model: str, options: Dict, prompt: str, use_cache: bool = True) -> Optional[str]:
+        """Coalescing key for a generation, or None if it must run on its own"""
+        if not self.enabled or not use_cache or not is_deterministic(options):
+            return None
+        return cache_key(model, options, prompt)
+
+    def run(self, key: Optional[str], generate: Callable[[], str]) -> str:
+        """Return generate()'s text, sharing one call among identical concurrent callers"""
+        if key is None:
+            return generate()
+        flight, leader = self._join(key)
+        try:
+            if not leader:
+                return flight.result()
+            try:
+                text = generate()
+            except BaseException as e:
+                self._land(key, flight, e)
+                raise
+            if text:
+                flight.push(text)
+            self._land(key, flight)
+            return text
+        finally:
+            self.leave(flight)
+
+    async def run_async(self, key: Optional[str], generate: Callable[[], Awaitable[str]]) -> str:
+        """run() for coroutines; the generation outlives a cancelled leader"""
+        if key is None:
+            return await generate()
+        flight, leader = self._join(key)
+        try:
+            if leader:
+                self._spawn(self._lead_async(key, flight, generate))
+            return await flight.result_async()
+        finally:
+            self.leave(flight)
+
+    def stream(self, key: Optional[str], open_stream: Callable[[], Iterator[str]],
+               on_complete: Optional[Callable[[str], None]] = None) -> Tuple[Iterator[str], bool]:
+        """Tokens of a possibly shared streamed generation, and whether this caller leads
+
+        The leader opens the upstream stream here, so admission errors raise
+        before any response is sent; a pump thread then feeds the flight
+        that every joined request reads from. The returned iterator has
+        close(). on_complete(text) is called once when a generation runs to
+        the end, even if the leader's client left while followers read on;
+        pass it only from a caller that may cache the text.
+        """
+        if key is None:
+            return _completing(open_stream(), on_complete), True
+        flight, leader = self._join(key, stream=True)
+        if leader:
+            try:
+                upstream = open_stream()
+            except BaseException as e:
+                self._land(key, flight, e)
+                self.leave(flight)
+                raise
+            threading.Thread(target=self._pump, args=(key, flight, upstream, on_complete),
+                             name='flight-pump', daemon=True).start()
+        return FlightStream(self, flight), leader
+
+    async def stream_async(self, key: Optional[str], open_stream: Callable[[], Awaitable[AsyncIterator[str]]],
+                           on_complete: Optional[Callable[[str], Awaitable[None]]] = None
+                           ) -> Tuple[AsyncIterator[str], bool]:
+        """stream() for coroutines; the iterator has aclose() and on_complete is awaited"""
+        if key is None:
+            return _completing_async(await open_stream(), on_complete), True
+        flight, leader = self._join(key, stream=True)
+        if leader:
+            try:
+                upstream = await open_stream()
+            except BaseException as e:
+                self._land(key, flight, e)
+                self.leave(flight)
+                raise
+            self._spawn(self._pump_async(key, flight, upstream, on_complete))
+        return AsyncFlightStream(self, flight), leader
+
+    def leave(self, flight: Flight):
+        with self.lock:
+            flight.watchers -= 1
+
+    def stats(self) -> Dict:
+        with self.lock:
+            data = dict(self.counters)
+            data['in_flight'] = len(self.flights)
+        requests = data['leaders'] + data['followers']
+        data['coalesced_rate'] = round(data['followers'] / requests, 4) if requests else 0.0
+        data['enabled'] = self.enabled
+        return data
+
+    def _join(self, key: str, stream: bool = False) -> Tuple[Flight, bool]:
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.counters['leaders'] += 1
+            else:
+                self.counters['followers'] += 1
+                if stream:
+                    self.counters['stream_followers'] += 1
+            flight.watchers += 1
+        return flight, leader
+
+    def _land(self, key: str, flight: Flight, error: Optional[BaseException] = None):
+        """Finish a flight; requests arriving from now on start a new one"""
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight.finish(error)
+
+    def _abandon(self, key: str, flight: Flight) -> bool:
+        """Drop a streamed flight nobody reads any more; False if someone joined"""
+        with self.lock:
+            if flight.watchers:
+                return False
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            self.counters['abandoned'] += 1
+        flight.finish()
+        return True
+
+    def _pump(self, key: str, flight: Flight, upstream: Iterator[str],
+              on_complete: Optional[Callable[[str], None]] = None):
+        try:
+            for token in upstream:
+                flight.push(token)
+                # Stop generating (and free the slot) once every reader is gone
+                if not flight.watchers and self._abandon(key, flight):
+                    return
+        except Exception as e:
+            self._land(key, flight, e)
+            return
+        finally:
+            upstream.close()
+        # Before landing, so a request arriving meanwhile finds the text cached
+        text = ''.join(flight.tokens)
+        if on_complete and text:
+            try:
+                on_complete(text)
+            except Exception as e:
+                print(f"Completing shared stream failed: {e}")
+        self._land(key, flight)
+
+    async def _pump_async(self, key: str, flight: Flight, upstream: AsyncIterator[str],
+                          on_complete: Optional[Callable[[str], Awaitable[None]]] = None):
+        try:
+            async for token in upstream:
+                flight.push(token)
+                if not flight.watchers and self._abandon(key, flight):
+                    return
+        except Exception as e:
+            self._land(key, flight, e)
+            return
+        finally:
+            await upstream.aclose()
+        text = ''.join(flight.tokens)
+        if on_complete and text:
+            try:
+                await on_complete(text)
+            except Exception as e:
+                print(f"Completing shared stream failed: {e}")
+        self._land(key, flight)
+
+    async def _lead_async(self, key: str, flight: Flight, generate: Callable[[], Awaitable[str]]):
+        try:
+            text = await generate()
+        except BaseException as e:
+            self._land(key, flight, e)
+            return
+        if text:
+            flight.push(text)
+        self._land(key, flight)
+
+    def _spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
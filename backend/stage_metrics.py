@@ -0,0 +1,146 @@
+# stage_metrics.py - Fixed-bucket latency histograms and per-request stage timings
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+# Upper bounds in seconds, from sub-millisecond tokenizing up to slow generations
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Stage durations of the request being served, as {stage: [seconds, calls]}
+_request_stages = ContextVar('request_stages', default=None)
+
+class Histogram:
+    """Counts of observations per fixed bucket, plus sum and max
+
+    Quantiles are estimated by linear interpolation inside the bucket that
+    holds the requested rank, the same way Prometheus' histogram_quantile does.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # One extra slot for observations above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+class StageTimings:
+    """Named histograms, one per pipeline stage (or endpoint)"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def mean(self, *names: str) -> float:
+        """Mean in seconds across the named histograms"""
+        with self.lock:
+            found = [self.histograms[name] for name in names if name in self.histograms]
+            count = sum(h.count for h in found)
+            return sum(h.sum for h in found) / count if count else 0.0
+
+    def summary(self) -> Dict:
+        """count, mean and p50/p95/p99/max in milliseconds for every name"""
+        with self.lock:
+            return {
+                name: {
+                    'count': h.count,
+                    'mean_ms': round(h.sum / h.count * 1000, 3) if h.count else 0.0,
+                    'p50_ms': round(h.quantile(0.50) * 1000, 3),
+                    'p95_ms': round(h.quantile(0.95) * 1000, 3),
+                    'p99_ms': round(h.quantile(0.99) * 1000, 3),
+                    'max_ms': round(h.max * 1000, 3)
+                }
+                for name, h in sorted(self.histograms.items())
+            }
+
+    def prometheus(self, metric: str, label: str, help_text: str) -> List[str]:
+        """Histogram lines in the Prometheus text exposition format"""
+        lines = [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+        with self.lock:
+            for name, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound:g}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{label}="{name}",le="+Inf"}} {h.count}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {h.sum:.6f}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {h.count}')
+        return lines
+
+# Process-wide pipeline stage histograms
+stages = StageTimings()
+_request_lock = threading.Lock()
+
+@contextmanager
+def timed(stage: str):
+    """Time a block into the stage histogram and the current request's timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+def record(stage: str, seconds: float):
+    stages.observe(stage, seconds)
+    current = _request_stages.get()
+    if current is not None:
+        # Several threads of one batch request may add to the same entry
+        with _request_lock:
+            entry = current.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+def start_request():
+    """Begin collecting stage timings for the request on this context"""
+    _request_stages.set({})
+
+def request_stages() -> Optional[Dict]:
+    return _request_stages.get()
+
+def server_timing(timings: Dict, total: Optional[float] = None) -> str:
+    """Server-Timing header value; repeated stages are summed"""
+    parts = [
+        f'{stage};dur={seconds * 1000:.1f}' + (f';desc="{calls} calls"' if calls > 1 else '')
+        for stage, (seconds, calls) in timings.items()
+    ]
+    if total is not None:
+        parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
+
+def percentile(values: List[float], q: float) -> float:
+    """Exact nearest-rank percentile of an unsorted list of samples (benchmarks and eval tools)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
@@ -0,0 +1,190 @@
+# summarize.py - Map-reduce summarization for long documents
+import asyncio
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional
+
+SECTION_CHARS = int(os.environ.get('SUMMARY_SECTION_CHARS', 2000))
+MAX_PARALLEL = int(os.environ.get('SUMMARY_CONCURRENCY', 4))
+
+# Sentence ends, used as preferred section boundaries
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+MAP_PROMPT = """Summarize the following section of a longer document in 2-3 sentences. Keep names, numbers and key facts.
+
+Section:
+{text}
+
+Summary:"""
+
+COMBINE_PROMPT = """The following are summaries of consecutive sections of one document. Merge them into a single summary of 3-4 sentences, keeping the key facts.
+
+Section summaries:
+{text}
+
+Merged summary:"""
+
+REDUCE_PROMPT = """The following are summaries of consecutive sections of one document. Combine them into a summary of the whole document in 3-5 clear sentences. Focus on the main ideas and key points.
+
+Section summaries:
+{text}
+
+Summary:"""
+
+class SummaryError(Exception):
+    """Raised when a partial summary could not be generated"""
+
+def split_sections(text: str, max_chars: int = SECTION_CHARS) -> List[str]:
+    """Split text into sections of at most max_chars, preferring sentence ends
+
+    Sections are cut greedily from the start, so appending text to a
+    document leaves every earlier section (and its cached summary) intact.
+    """
+    sections = []
+    current = []
+    length = 0
+    for sentence in SENTENCE_END.split(text):
+        # Hard-split sentences longer than a whole section
+        while len(sentence) > max_chars:
+            if current:
+                sections.append(' '.join(current))
+                current, length = [], 0
+            sections.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and length + len(sentence) + 1 > max_chars:
+            sections.append(' '.join(current))
+            current, length = [], 0
+        if sentence:
+            current.append(sentence)
+            length += len(sentence) + 1
+    if current:
+        sections.append(' '.join(current))
+    return sections
+
+def section_hash(section: str) -> str:
+    """Key of a section's stored summary"""
+    return hashlib.sha256(section.encode('utf-8')).hexdigest()
+
+def map_reduce_prompt(content: str, generate: Callable[[str], Optional[str]],
+                      max_chars: int = SECTION_CHARS, max_parallel: int = MAX_PARALLEL,
+                      store=None, model: str = '') -> Optional[str]:
+    """Summarize sections concurrently and return the final reduce prompt
+
+    Returns None when the content fits in one section. Partial summaries are
+    merged in batches until they fit in one prompt, so the final generation
+    (blocking or streamed) is left to the caller.
+
+    With a store (a DocumentStore), section summaries are kept by the hash
+    of the section text and model, so re-summarizing or appending to a
+    document only generates the sections not seen before.
+    """
+    sections = split_sections(content, max_chars)
+    if len(sections) <= 1:
+        return None
+
+    hashes = [section_hash(section) for section in sections]
+    known = store.section_summaries(model, hashes) if store is not None else {}
+    missing = list(dict.fromkeys(s for s, h in zip(sections, hashes) if h not in known))
+    if missing:
+        results = _run_all([MAP_PROMPT.format(text=section) for section in missing], generate, max_parallel)
+        known.update(_keep_partials(missing, results, store, model))
+    partials = [known[h] for h in hashes]
+
+    while len(partials) > 1 and sum(len(p) + 2 for p in partials) > max_chars:
+        batches = _batch(partials, max_chars)
+        partials = _generate_all([COMBINE_PROMPT.format(text='\n\n'.join(batch)) for batch in batches],
+                                 generate, max_parallel)
+
+    return REDUCE_PROMPT.format(text='\n\n'.join(partials))
+
+async def map_reduce_prompt_async(content: str, generate: Callable[[str], Awaitable[Optional[str]]],
+                                  max_chars: int = SECTION_CHARS, max_parallel: int = MAX_PARALLEL,
+                                  store=None, model: str = '', run_blocking=None) -> Optional[str]:
+    """map_reduce_prompt for a coroutine generate(), run on the event loop
+
+    Store calls go through run_blocking(fn, *args), an awaitable that runs
+    fn off the loop (the default executor if not given).
+    """
+    run_blocking = run_blocking or _in_thread
+    sections = split_sections(content, max_chars)
+    if len(sections) <= 1:
+        return None
+
+    hashes = [section_hash(section) for section in sections]
+    known = await run_blocking(store.section_summaries, model, hashes) if store is not None else {}
+    missing = list(dict.fromkeys(s for s, h in zip(sections, hashes) if h not in known))
+    if missing:
+        results = await _run_all_async([MAP_PROMPT.format(text=section) for section in missing],
+                                       generate, max_parallel)
+        known.update(await run_blocking(_keep_partials, missing, results, store, model))
+    partials = [known[h] for h in hashes]
+
+    while len(partials) > 1 and sum(len(p) + 2 for p in partials) > max_chars:
+        batches = _batch(partials, max_chars)
+        partials = await _generate_all_async(
+            [COMBINE_PROMPT.format(text='\n\n'.join(batch)) for batch in batches],
+            generate, max_parallel)
+
+    return REDUCE_PROMPT.format(text='\n\n'.join(partials))
+
+def _keep_partials(sections: List[str], results: List[Optional[str]], store, model: str) -> Dict[str, str]:
+    """Store the section summaries that were generated, then fail if any was not"""
+    partials = {section_hash(section): result.strip()
+                for section, result in zip(sections, results) if result}
+    if store is not None and partials:
+        store.save_section_summaries(model, partials)
+    if len(partials) < len(sections):
+        raise SummaryError('Failed to summarize a document section')
+    return partials
+
+def _in_thread(fn, *args):
+    return asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+def _run_all(prompts: List[str], generate: Callable[[str], Optional[str]],
+             max_parallel: int) -> List[Optional[str]]:
+    """Run generations with bounded parallelism, keeping prompt order"""
+    with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(prompts)))) as pool:
+        return list(pool.map(generate, prompts))
+
+async def _run_all_async(prompts: List[str], generate: Callable[[str], Awaitable[Optional[str]]],
+                         max_parallel: int) -> List[Optional[str]]:
+    """Await generations with bounded parallelism, keeping prompt order"""
+    limit = asyncio.Semaphore(max(1, max_parallel))
+
+    async def run(prompt):
+        async with limit:
+            return await generate(prompt)
+
+    return list(await asyncio.gather(*(run(prompt) for prompt in prompts)))
+
+def _generate_all(prompts: List[str], generate: Callable[[str], Optional[str]],
+                  max_parallel: int) -> List[str]:
+    """Stripped generations for every prompt, or SummaryError if any failed"""
+    return _checked(_run_all(prompts, generate, max_parallel))
+
+async def _generate_all_async(prompts: List[str], generate: Callable[[str], Awaitable[Optional[str]]],
+                              max_parallel: int) -> List[str]:
+    """Stripped generations for every prompt, or SummaryError if any failed"""
+    return _checked(await _run_all_async(prompts, generate, max_parallel))
+
+def _checked(results: List[Optional[str]]) -> List[str]:
+    if not all(results):
+        raise SummaryError('Failed to summarize a document section')
+    return [result.strip() for result in results]
+
+def _batch(partials: List[str], max_chars: int) -> List[List[str]]:
+    """Group consecutive partial summaries, at least two per group"""
+    batches = [[]]
+    length = 0
+    for partial in partials:
+        if len(batches[-1]) >= 2 and length + len(partial) > max_chars:
+            batches.append([])
+            length = 0
+        batches[-1].append(partial)
+        length += len(partial) + 2
+    # A trailing single summary joins the previous group so every round shrinks
+    if len(batches) > 1 and len(batches[-1]) == 1:
+        batches[-2].extend(batches.pop())
+    return batches
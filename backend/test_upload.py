@@ -1,4 +1,5 @@
 # test_upload.py - Simple test script for PDF upload
+import time
 import requests
 
 # API base URL
@@ -25,9 +26,11 @@ def test_upload_pdf(pdf_path):
         result = response.json()
         print("Upload Response:", result)
         
-        if response.status_code == 201:
-            return result.get('document_id')
-        return None
+        if response.status_code == 202:
+            result = wait_for_job(result['job_id'])
+        elif response.status_code != 201:
+            return None
+        return result.get('document_id') if result else None
         
     except FileNotFoundError:
         print(f"Error: PDF file '{pdf_path}' not found!")
@@ -36,6 +39,21 @@ def test_upload_pdf(pdf_path):
         print("Upload error:", e)
         return None
 
+def wait_for_job(job_id, timeout=120):
+    """Poll an ingestion job until it finishes"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = requests.get(f"{BASE_URL}/jobs/{job_id}").json()
+        print(f"Job {job_id[:8]}: {job.get('status')} {job.get('progress')}")
+        if job.get('status') == 'done':
+            return job['result']
+        if job.get('status') == 'failed':
+            print("Job failed:", job.get('error'))
+            return None
+        time.sleep(1)
+    print("Job did not finish in time")
+    return None
+
 def test_list_documents():
     """Test document listing"""
     try:
@@ -102,9 +120,12 @@ print("""
 1. Health check:
 curl http://127.0.0.1:5000/api/health
 
-2. Upload PDF:
+2. Upload PDF (returns a job id; add ?sync=1 to wait for the result):
 curl -X POST -F "file=@your_file.pdf" http://127.0.0.1:5000/api/upload
 
+   Check the upload job (replace JOB_ID):
+curl http://127.0.0.1:5000/api/jobs/JOB_ID
+
 3. List documents:
 curl http://127.0.0.1:5000/api/documents
 
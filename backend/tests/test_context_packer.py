@@ -0,0 +1,64 @@
+from context_packer import GAP, ContextPacker, approx_tokens, merge_overlapping
+
+def words(start, end):
+    return ' '.join(f'w{i}' for i in range(start, end))
+
+def filler(count, source='doc'):
+    return ' '.join(f'Filler sentence {i} of {source} talks about nothing much at all.' for i in range(count))
+
+def test_overlapping_chunks_merge_into_one_passage():
+    # Two 500-word chunks sharing 50 words, as chunk_document produces them
+    first, second = words(0, 500), words(450, 950)
+    assert merge_overlapping([first, second]) == [words(0, 950)]
+    # A chunk contained in another is dropped
+    assert merge_overlapping([first, words(100, 200)]) == [first]
+
+    packed = ContextPacker().pack([('doc', second), ('doc', first)], 'w3', budget=10000)
+    assert packed == [('doc', words(0, 950))]
+
+def test_chunks_of_different_sources_are_not_merged():
+    packed = ContextPacker().pack([('a', words(0, 500)), ('b', words(450, 950))], 'w3', budget=10000)
+    assert [source for source, _ in packed] == ['a', 'b']
+
+def test_duplicate_sentences_across_sources_are_dropped_once():
+    shared = 'The zebra grazes on the open plain near the river.'
+    packer = ContextPacker()
+    packed = packer.pack([
+        ('a', f'{shared} Alpha keeps its own closing words.'),
+        ('b', f'{shared} Beta keeps its own closing words too.'),
+    ], 'zebra', budget=10000)
+    text = '\n\n'.join(text for _, text in packed)
+    assert text.count(shared) == 1
+    assert packed[0] == ('a', f'{shared} Alpha keeps its own closing words.')
+    assert packed[1] == ('b', 'Beta keeps its own closing words too.')
+    assert packer.stats()['trimmed'] == 0
+
+def test_output_fits_the_model_budget():
+    packer = ContextPacker(default_budget=1024)
+    budget = packer.budget_for('small', {'num_ctx': 512})
+    assert budget == 512 - 256
+    passages = [(f'doc{i}', filler(40, f'doc{i}')) for i in range(3)]
+    packed = packer.pack(passages, 'nothing', budget)
+    assert approx_tokens('\n\n'.join(text for _, text in packed)) <= budget
+    stats = packer.stats()
+    assert stats['trimmed'] == 1 and stats['tokens_out'] < stats['tokens_in']
+
+    assert ContextPacker(default_budget=100, budgets={'big': 4000}).budget_for('big', {'num_ctx': 8192}) == 4000
+
+def test_sentences_with_query_terms_survive_trimming():
+    answer = 'The zebra herd crossed the river at dawn.'
+    text = f'{filler(30)} {answer} {filler(30, "tail")}'
+    packed = ContextPacker().pack([('doc', text)], 'When did the zebra herd cross?', budget=40)
+    assert len(packed) == 1
+    assert answer in packed[0][1]
+    # Left-out sentences around the kept ones are marked
+    assert GAP in packed[0][1]
+
+def test_bad_budget_entries_are_skipped(monkeypatch, capsys):
+    monkeypatch.setenv('CONTEXT_TOKEN_BUDGETS', 'a=100, b=lots,=5,, c=300')
+    monkeypatch.setenv('CONTEXT_TOKEN_BUDGET', '2k')
+    packer = ContextPacker.from_env()
+    assert packer.budgets == {'a': 100, 'c': 300}
+    assert packer.default_budget == 1024
+    out = capsys.readouterr().out
+    assert "'b=lots'" in out and "'=5'" in out and "'2k'" in out
@@ -0,0 +1,60 @@
+import numpy as np
+
+from dense_index import DenseIndex, EmbeddingCache, HybridRetriever
+
+def fake_embed(calls):
+    """Chunks c0-c3 and queries point one way, every other text the other"""
+    def embed(texts):
+        calls.append(list(texts))
+        return [[1.0, 0.0] if text.startswith('q') or text in ('c0', 'c1', 'c2', 'c3') else [0.0, 1.0]
+                for text in texts]
+    return embed
+
+class FakeRAG:
+    """Just enough of SimplifiedRAG for corpus retrieval over one document"""
+
+    def __init__(self, chunks, lexical):
+        self.chunks = chunks
+        self.lexical = lexical
+
+    def __contains__(self, doc_id):
+        return doc_id == 'doc'
+
+    def document_ids(self):
+        return ['doc']
+
+    def chunk_texts(self, doc_id, indices=None):
+        return [self.chunks[idx] for idx in indices] if indices is not None else list(self.chunks)
+
+    def score_corpus(self, query, top_k=3):
+        return self.lexical[:top_k]
+
+def test_query_embeddings_stay_in_memory_and_are_bounded():
+    calls = []
+    cache = EmbeddingCache()
+    dense = DenseIndex(fake_embed(calls), cache=cache, query_cache_size=2)
+
+    first = dense.embed_query('q1')
+    assert np.allclose(first, [1.0, 0.0])
+    assert dense.embed_query('q1') is first
+    dense.embed_query('q2')
+    dense.embed_query('q3')
+    assert calls == [['q1'], ['q2'], ['q3']]
+    assert list(dense.queries) == ['q2', 'q3']
+    assert cache.stats()['entries'] == 0
+
+def test_hybrid_corpus_scores_each_document_once():
+    chunks = [f'c{idx}' for idx in range(20)]
+    dense = DenseIndex(fake_embed([]))
+    dense.add_document('doc', chunks)
+    score_calls = []
+    scores = dense.scores
+    dense.scores = lambda doc_id, vector: score_calls.append(doc_id) or scores(doc_id, vector)
+
+    # Lexical candidates that the dense top list (c0-c3) does not cover
+    lexical = [(('doc', idx), 3.0 - idx / 10) for idx in (10, 11, 12)]
+    retriever = HybridRetriever(FakeRAG(chunks, lexical), dense)
+    hits = retriever.retrieve_corpus('q', top_k=1, mode='hybrid', alpha=0.5)
+
+    assert score_calls == ['doc']
+    assert len(hits) == 1 and hits[0]['document_id'] == 'doc'
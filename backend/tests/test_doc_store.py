@@ -0,0 +1,50 @@
+from doc_store import DocumentStore
+
+def document(doc_id, content='Some extracted text.'):
+    return {'id': doc_id, 'filename': f'{doc_id}.txt', 'content_hash': f'hash-{doc_id}',
+            'content_length': len(content), 'created_at': '2026-01-01T00:00:00', 'summary': None}
+
+def add(store, doc_id, content='Some extracted text.'):
+    store.add_content(f'hash-{doc_id}', content)
+    store.add(document(doc_id, content))
+
+def test_shared_handles_see_each_others_writes(tmp_path):
+    path = str(tmp_path / 'store.db')
+    first = DocumentStore(path, shared=True)
+    second = DocumentStore(path, shared=True)
+
+    add(first, 'a')
+    # Loaded into the second handle's working set before the writes below
+    assert second.get('a')['summary'] is None
+
+    first.set_summary('a', 'A summary.')
+    first.append_qa('a', {'question': 'q1', 'answer': 'a1'})
+    second.append_qa_batch([('a', {'question': 'q2', 'answer': 'a2'})])
+
+    for store in (first, second):
+        record = store.get('a')
+        assert record['summary'] == 'A summary.'
+        assert [entry['question'] for entry in record['qa_history']] == ['q1', 'q2']
+        assert record['content'] == 'Some extracted text.'
+    assert second.stats()['cache_hits'] >= 1
+
+    first.delete('a')
+    assert 'a' not in second
+    assert second.get('a') is None
+
+def test_shared_records_are_copies(tmp_path):
+    store = DocumentStore(str(tmp_path / 'store.db'), shared=True)
+    add(store, 'a')
+    store.get('a')['summary'] = 'changed in place'
+    assert store.get('a')['summary'] is None
+
+def test_private_store_serves_its_working_set(tmp_path):
+    store = DocumentStore(str(tmp_path / 'store.db'), max_cached=1)
+    add(store, 'a')
+    add(store, 'b')
+    assert store.get('a') is store.get('a')
+    store.set_summary('a', 'A summary.')
+    assert store.get('a')['summary'] == 'A summary.'
+    store.get('b')
+    assert store.stats()['evictions'] == 1
+    assert store.get('a')['summary'] == 'A summary.'
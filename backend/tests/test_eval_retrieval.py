@@ -0,0 +1,53 @@
+import json
+
+import eval_retrieval
+from simple_rag import SimplifiedRAG
+
+def test_load_corpus_skips_blank_lines(tmp_path):
+    path = tmp_path / 'corpus.jsonl'
+    path.write_text(json.dumps({'id': 'a', 'text': 'alpha'}) + '\n\n   \n'
+                    + json.dumps({'id': 2, 'text': 'beta'}) + '\n\n', encoding='utf-8')
+    assert eval_retrieval.load_corpus(str(path)) == [('a', 'alpha'), ('2', 'beta')]
+
+def test_document_hits_come_from_scored_indices():
+    evaluator = eval_retrieval.Evaluator(SimplifiedRAG(), top_k=3)
+    # Identical chunk texts must still be told apart by index
+    text = ' '.join(['filler words here'] * 60 + ['the zebra grazes'] + ['filler words here'] * 60)
+    evaluator.index([('doc', text)], chunk_size=80)
+
+    hits, _ = evaluator.run_query({'query': 'zebra', 'document_id': 'doc'})
+    chunks = evaluator.rag.chunk_texts('doc')
+    assert hits and all(chunks[idx] == text for _, idx, text in hits)
+    assert all('zebra' in text for _, _, text in hits)
+
+    # No matching chunk is no result, not the first chunk
+    hits, _ = evaluator.run_query({'query': 'giraffe', 'document_id': 'doc'})
+    assert hits == []
+    relevant, retrieved = evaluator.label({'query': 'giraffe', 'document_id': 'doc', 'answers': ['zebra']}, hits)
+    assert retrieved == [] and relevant
+
+def test_document_labels_see_k_distinct_documents():
+    evaluator = eval_retrieval.Evaluator(SimplifiedRAG(), top_k=2)
+    # Every chunk of 'long' outranks the single matching chunk of 'short'
+    long_text = ' '.join(f'zebra zebra zebra filler{i}' for i in range(60))
+    short_text = ' '.join(['zebra'] + ['padding words'] * 60)
+    evaluator.index([('long', long_text), ('short', short_text)], chunk_size=60)
+
+    query = {'query': 'zebra', 'relevant_ids': ['short']}
+    hits, _ = evaluator.run_query(query)
+    relevant, retrieved = evaluator.label(query, hits)
+    assert retrieved == ['long', 'short']
+
+    # Chunk-level queries still get top_k chunks
+    hits, _ = evaluator.run_query({'query': 'zebra', 'relevant_ids': ['short#0']})
+    assert len(hits) == 2
+
+def test_worker_processes_match_sequential_run():
+    corpus = [(f'doc{i}', ' '.join(f'word{i * 7 + j}' for j in range(200))) for i in range(5)]
+    queries = [{'query': f'word{i * 11} word{i * 3}'} for i in range(12)]
+    evaluator = eval_retrieval.Evaluator(SimplifiedRAG(), top_k=3)
+    evaluator.index(corpus, chunk_size=60)
+
+    sequential, _ = eval_retrieval.run_queries(evaluator, queries, 1, corpus, 60)
+    parallel, _ = eval_retrieval.run_queries(evaluator, queries, 2, corpus, 60)
+    assert [hits for hits, _ in parallel] == [hits for hits, _ in sequential]
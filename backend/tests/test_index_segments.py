@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+from doc_store import DocumentStore
+from index_segments import SegmentIndex
+from simple_rag import SimplifiedRAG
+
+WORDS = [f'word{i}' for i in range(300)]
+
+def corpus(count=12, seed=7):
+    rng = random.Random(seed)
+    return [(f'doc{i}', ' '.join(rng.choice(WORDS) for _ in range(rng.randint(50, 400))))
+            for i in range(count)]
+
+def queries(count=20, seed=11):
+    rng = random.Random(seed)
+    return [' '.join(rng.sample(WORDS, rng.randint(1, 4))) for _ in range(count)]
+
+@pytest.fixture
+def indexes(tmp_path):
+    memory = SimplifiedRAG()
+    store = DocumentStore(str(tmp_path / 'store.db'))
+    segments = SegmentIndex(str(tmp_path / 'segments'), merge_at=3)
+    segmented = SimplifiedRAG(store=store, segments=segments)
+    for doc_id, text in corpus():
+        memory.index_document(doc_id, text, chunk_size=60)
+        segmented.index_document(doc_id, text, chunk_size=60)
+        segments.merge()
+    return memory, segmented
+
+def assert_same_ranking(expected, actual):
+    assert [key for key, _ in actual] == [key for key, _ in expected]
+    assert [score for _, score in actual] == pytest.approx([score for _, score in expected])
+
+def test_segments_score_like_the_memory_index(indexes):
+    memory, segmented = indexes
+    assert segmented.segments.counters['merges'] > 0
+    for query in queries():
+        assert_same_ranking(memory.score_corpus(query, top_k=10), segmented.score_corpus(query, top_k=10))
+        for doc_id in ('doc0', 'doc5', 'doc11'):
+            assert_same_ranking(memory.score_chunks(doc_id, query, top_k=5),
+                                segmented.score_chunks(doc_id, query, top_k=5))
+    batch = [(doc_id, query) for query in queries() for doc_id in ('doc1', 'doc4', 'doc9')]
+    assert segmented.retrieve_batch(batch, top_k=3) == memory.retrieve_batch(batch, top_k=3)
+    assert memory.retrieve_batch(batch, top_k=3) == [memory.retrieve(d, q, top_k=3) for d, q in batch]
+    query = queries()[0]
+    assert ([hit['text'] for hit in segmented.retrieve_corpus(query, top_k=5)]
+            == [hit['text'] for hit in memory.retrieve_corpus(query, top_k=5)])
+
+def test_deletes_and_full_merge_keep_scores(indexes):
+    memory, segmented = indexes
+    for doc_id in ('doc2', 'doc7'):
+        memory.remove_document(doc_id)
+        segmented.remove_document(doc_id)
+    for query in queries():
+        assert_same_ranking(memory.score_corpus(query, top_k=10), segmented.score_corpus(query, top_k=10))
+
+    assert segmented.segments.merge(force=True)
+    assert 'doc2' not in segmented and 'doc3' in segmented
+    for query in queries():
+        assert_same_ranking(memory.score_corpus(query, top_k=10), segmented.score_corpus(query, top_k=10))
+
+def test_another_handle_sees_published_segments(indexes, tmp_path):
+    _, segmented = indexes
+    reader = SegmentIndex(str(tmp_path / 'segments'))
+    assert sorted(reader.document_ids()) == sorted(segmented.segments.document_ids())
+
+    segmented.index_document('late', 'a freshly published document about zebras', chunk_size=60)
+    assert 'late' not in reader.document_ids()
+    assert reader.refresh()
+    assert 'late' in reader.document_ids()
+
+    segmented.remove_document('doc0')
+    reader.refresh()
+    assert not reader.has('doc0')
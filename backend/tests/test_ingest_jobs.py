@@ -0,0 +1,47 @@
+import threading
+
+from doc_store import DocumentStore
+from ingest_jobs import IngestError, JobQueue
+
+def wait(queue, job_id):
+    queue.executor.shutdown(wait=True)
+    return queue.get(job_id)
+
+def test_jobs_in_a_shared_store_are_visible_to_other_processes(tmp_path):
+    path = str(tmp_path / 'store.db')
+    running = JobQueue(store=DocumentStore(path, shared=True))
+    polling = JobQueue(store=DocumentStore(path, shared=True))
+    release = threading.Event()
+
+    def work(progress):
+        progress(pages_extracted=1, total_pages=2)
+        release.wait(5)
+        return {'document_id': 'a'}
+
+    job_id = running.submit('pdf', work, filename='a.pdf')
+    seen = polling.get(job_id)
+    assert seen['filename'] == 'a.pdf' and seen['status'] in ('queued', 'running')
+
+    release.set()
+    assert wait(running, job_id)['status'] == 'done'
+    job = polling.get(job_id)
+    assert job['status'] == 'done' and job['result'] == {'document_id': 'a'}
+    assert job['progress'] == {'pages_extracted': 1, 'total_pages': 2}
+
+def test_failed_jobs_and_pruning(tmp_path):
+    store = DocumentStore(str(tmp_path / 'store.db'), shared=True)
+    queue = JobQueue(max_workers=1, max_finished=2, store=store)
+
+    def fail(progress):
+        raise IngestError('No text found')
+
+    job_ids = [queue.submit('pdf', fail) for _ in range(4)]
+    queue.executor.shutdown(wait=True)
+    assert store.get_job(job_ids[-1])['error'] == 'No text found'
+    assert [store.get_job(job_id) is not None for job_id in job_ids] == [False, False, True, True]
+
+def test_private_queue_has_no_store():
+    queue = JobQueue()
+    job_id = queue.submit('web', lambda progress: {'ok': True})
+    assert wait(queue, job_id)['result'] == {'ok': True}
+    assert queue.get('missing') is None
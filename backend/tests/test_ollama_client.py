@@ -0,0 +1,37 @@
+import asyncio
+import gc
+
+import httpx
+
+from ollama_client import AsyncTokenStream
+
+class Body(httpx.AsyncByteStream):
+    """A streamed generation that sends one token and then stalls"""
+
+    def __init__(self):
+        self.closed = asyncio.Event()
+
+    async def __aiter__(self):
+        yield b'{"response": "one", "done": false}\n'
+        await asyncio.sleep(10)
+
+    async def aclose(self):
+        self.closed.set()
+
+def test_collected_async_stream_closes_its_response():
+    released = []
+
+    async def scenario():
+        body = Body()
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, stream=body))
+        async with httpx.AsyncClient(transport=transport) as http:
+            response = await http.send(http.build_request('POST', 'http://ollama/api/generate'), stream=True)
+            stream = AsyncTokenStream(response, lambda: released.append(1))
+            assert await stream.__anext__() == 'one'
+            del stream
+            gc.collect()
+            await asyncio.wait_for(body.closed.wait(), 1)
+            return response.is_closed
+
+    assert asyncio.run(scenario())
+    assert released == [1]
@@ -0,0 +1,81 @@
+# test_retrieval_metrics.py - Vectorized metrics against the scalar reference functions
+import csv
+import random
+import time
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+import retrieval_metrics
+from retrieval_metrics import ap_at_k, evaluate, iter_chunks, mrr_at_k, ndcg_at_k, recall_at_k
+
+KS = [1, 3, 5, 10]
+SCALAR = {'Recall': recall_at_k, 'MRR': mrr_at_k, 'nDCG': ndcg_at_k, 'MAP': ap_at_k}
+
+def random_pairs(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    ids = [f'd{i}' for i in range(30)]
+    pairs = []
+    for _ in range(count):
+        relevant = rng.sample(ids, rng.randint(0, 5))
+        # Sampling with replacement repeats ids in the ranked list
+        retrieved = [rng.choice(ids) for _ in range(rng.randint(0, 12))]
+        pairs.append((';'.join(relevant), ';'.join(retrieved)))
+    return pairs
+
+def scalar_means(pairs):
+    means = {}
+    for name, metric in SCALAR.items():
+        means[name] = {}
+        for k in KS:
+            values = [metric(set(relevant.split(';')) - {''}, [r for r in retrieved.split(';') if r], k)
+                      for relevant, retrieved in pairs]
+            means[name][k] = sum(values) / len(values)
+    return means
+
+def test_vectorized_matches_scalar_reference():
+    pairs = random_pairs(500)
+    results = evaluate(iter([pairs[:200], pairs[200:]]), KS)
+    expected = scalar_means(pairs)
+    for name in SCALAR:
+        for k in KS:
+            assert results[name][k] == pytest.approx(expected[name][k], abs=1e-12), (name, k)
+
+def test_repeated_retrieved_id_counts_once():
+    assert recall_at_k({'A', 'B'}, ['A', 'A', 'A'], 3) == 0.5
+    results = evaluate(iter([[('A;B', 'A;A;A')]]), [3])
+    assert results['Recall'][3] == 0.5
+    assert results['MAP'][3] == pytest.approx(ap_at_k({'A', 'B'}, ['A', 'A', 'A'], 3))
+
+def test_workers_match_single_process_and_read_ahead_is_bounded(tmp_path, monkeypatch):
+    path = tmp_path / 'retrieved.csv'
+    pairs = random_pairs(2000, seed=3)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['query_id', 'relevant_ids', 'retrieved_ids'])
+        writer.writerows((i, relevant, retrieved) for i, (relevant, retrieved) in enumerate(pairs))
+    single = evaluate(iter_chunks(str(path), 100, 'relevant_ids', 'retrieved_ids'), KS)
+
+    # Threads instead of processes, so the test can see chunks being scored
+    scored = []
+    chunk_sums = retrieval_metrics.chunk_sums
+    def slow_chunk_sums(*args):
+        time.sleep(0.01)
+        result = chunk_sums(*args)
+        scored.append(1)
+        return result
+    monkeypatch.setattr(retrieval_metrics, 'Pool', ThreadPool)
+    monkeypatch.setattr(retrieval_metrics, 'chunk_sums', slow_chunk_sums)
+
+    ahead = []
+    def chunks():
+        for number, chunk in enumerate(iter_chunks(str(path), 100, 'relevant_ids', 'retrieved_ids')):
+            ahead.append(number - len(scored))
+            yield chunk
+
+    parallel = evaluate(chunks(), KS, workers=2)
+    assert len(scored) == 20
+    assert max(ahead) <= 4
+    for name in SCALAR:
+        for k in KS:
+            assert parallel[name][k] == pytest.approx(single[name][k])
@@ -0,0 +1,87 @@
+import math
+
+import pytest
+
+from simple_rag import SimplifiedRAG
+
+K1, B = 1.5, 0.75
+
+def bm25(tf, df, num_chunks, length, avg_length):
+    """Term weight from the BM25 definition, written out independently"""
+    idf = math.log(1 + (num_chunks - df + 0.5) / (df + 0.5))
+    return idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avg_length))
+
+def add(rag, doc_id, chunks):
+    """Index pre-split chunks (whitespace-separated words) without overlap"""
+    postings = {}
+    for idx, chunk in enumerate(chunks):
+        words = chunk.split()
+        for term in dict.fromkeys(words):
+            postings.setdefault(term, []).extend((idx, words.count(term)))
+    rag._add_document(doc_id, postings, [len(chunk.split()) for chunk in chunks])
+
+@pytest.fixture
+def rag():
+    rag = SimplifiedRAG(k1=K1, b=B)
+    # Lengths 3, 2, 4 and 1: average 2.5
+    add(rag, 'doc', ['cat cat dog', 'cat bird', 'bird bird bird fish', 'fish'])
+    return rag
+
+def test_scores_match_hand_computed_bm25(rag):
+    ranked = rag.score_chunks('doc', 'cat', top_k=10)
+    # idf = ln(1 + 2.5 / 2.5) = ln 2; chunk 0 has tf 2 in 3 words, chunk 1 tf 1 in 2
+    assert [idx for idx, _ in ranked] == [0, 1]
+    assert ranked[0][1] == pytest.approx(math.log(2) * 2 * 2.5 / (2 + 1.5 * (0.25 + 0.75 * 3 / 2.5)))
+    assert ranked[1][1] == pytest.approx(math.log(2) * 2.5 / (1 + 1.5 * (0.25 + 0.75 * 2 / 2.5)))
+
+    ranked = dict(rag.score_chunks('doc', 'cat bird', top_k=10))
+    assert ranked[1] == pytest.approx(bm25(1, 2, 4, 2, 2.5) * 2)
+    assert ranked[2] == pytest.approx(bm25(3, 2, 4, 4, 2.5))
+
+def test_rarer_terms_weigh_more():
+    rag = SimplifiedRAG(k1=K1, b=B)
+    add(rag, 'doc', ['common rare', 'common other', 'common more'])
+    common = dict(rag.score_chunks('doc', 'common', top_k=10))
+    rare = dict(rag.score_chunks('doc', 'rare', top_k=10))
+    # Same chunk and tf: ln(1 + 0.5 / 3.5) for df 3 against ln(1 + 2.5 / 1.5) for df 1
+    assert common[0] == pytest.approx(math.log(1 + 0.5 / 3.5) * 2.5 / (1 + 1.5))
+    assert rare[0] == pytest.approx(math.log(1 + 2.5 / 1.5) * 2.5 / (1 + 1.5))
+    assert set(rare) == {0}
+    assert [idx for idx, _ in rag.score_chunks('doc', 'common rare', top_k=1)] == [0]
+
+def test_shorter_chunks_win_at_equal_term_frequency(rag):
+    ranked = rag.score_chunks('doc', 'fish', top_k=10)
+    assert [idx for idx, _ in ranked] == [3, 2]
+    assert ranked[0][1] == pytest.approx(bm25(1, 2, 4, 1, 2.5))
+    assert ranked[1][1] == pytest.approx(bm25(1, 2, 4, 4, 2.5))
+
+def test_top_k_ties_go_to_earlier_chunks():
+    rag = SimplifiedRAG(k1=K1, b=B)
+    add(rag, 'doc', ['x y', 'z', 'x y', 'x y'])
+    ranked = rag.score_chunks('doc', 'x', top_k=2)
+    assert [idx for idx, _ in ranked] == [0, 2]
+    assert ranked[0][1] == ranked[1][1]
+    assert rag.score_chunks('doc', 'absent', top_k=2) == []
+
+def test_corpus_scores_use_corpus_statistics(rag):
+    add(rag, 'other', ['cat fish fish', 'owl'])
+    # 6 chunks, 14 words: the average length and document frequencies span both documents
+    ranked = rag.score_corpus('fish', top_k=3)
+    expected = {
+        ('doc', 2): bm25(1, 3, 6, 4, 14 / 6),
+        ('doc', 3): bm25(1, 3, 6, 1, 14 / 6),
+        ('other', 0): bm25(2, 3, 6, 3, 14 / 6),
+    }
+    assert [key for key, _ in ranked] == sorted(expected, key=lambda key: -expected[key])
+    for key, score in ranked:
+        assert score == pytest.approx(expected[key])
+    assert len(rag.score_corpus('fish', top_k=1)) == 1
+
+def test_batch_scores_match_single_queries(rag):
+    add(rag, 'other', ['cat fish fish', 'owl', 'owl cat'])
+    for doc_id, queries in (('doc', ['cat', 'bird fish', 'nothing', 'cat dog fish']), ('other', ['owl cat', 'fish owl'])):
+        batch = rag._score_batch(doc_id, [set(query.split()) for query in queries], 2)
+        expected = [rag.score_chunks(doc_id, query, top_k=2) for query in queries]
+        assert [[idx for idx, _ in hits] for hits in batch] == [[idx for idx, _ in hits] for hits in expected]
+        for hits, single in zip(batch, expected):
+            assert [score for _, score in hits] == pytest.approx([score for _, score in single])
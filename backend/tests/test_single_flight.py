@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ollama_client import OllamaOverloaded
+from single_flight import SingleFlight
+
+def test_key_only_for_deterministic_options():
+    flights = SingleFlight()
+    assert flights.key('m', {'temperature': 0}, 'p') == flights.key('m', {'temperature': 0}, 'p')
+    assert flights.key('m', {'temperature': 0.7}, 'p') is None
+    assert SingleFlight(enabled=False).key('m', {'seed': 1}, 'p') is None
+    assert flights.key('m', {'temperature': 0}, 'p', use_cache=False) is None
+
+def test_followers_share_the_leaders_generation():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def generate():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'shared text'
+
+    with ThreadPoolExecutor(4) as pool:
+        leader = pool.submit(flights.run, 'key', generate)
+        assert started.wait(5)
+        followers = [pool.submit(flights.run, 'key', generate) for _ in range(3)]
+        while flights.stats()['followers'] < 3:
+            time.sleep(0.001)
+        release.set()
+        results = [leader.result(5)] + [f.result(5) for f in followers]
+
+    assert results == ['shared text'] * 4
+    assert len(calls) == 1
+    stats = flights.stats()
+    assert (stats['leaders'], stats['followers'], stats['in_flight']) == (1, 3, 0)
+    # A landed flight is not reused
+    assert flights.run('key', lambda: 'fresh') == 'fresh'
+
+def test_leader_error_reaches_followers():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def generate():
+        started.set()
+        release.wait(5)
+        raise RuntimeError('model down')
+
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(flights.run, 'key', generate)
+        assert started.wait(5)
+        follower = pool.submit(flights.run, 'key', generate)
+        while flights.stats()['followers'] < 1:
+            time.sleep(0.001)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(RuntimeError):
+                future.result(5)
+
+def test_followers_get_their_own_copy_of_the_error():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def generate():
+        started.set()
+        release.wait(5)
+        raise OllamaOverloaded('busy', retry_after=7)
+
+    with ThreadPoolExecutor(3) as pool:
+        leader = pool.submit(flights.run, 'key', generate)
+        assert started.wait(5)
+        followers = [pool.submit(flights.run, 'key', generate) for _ in range(2)]
+        while flights.stats()['followers'] < 2:
+            time.sleep(0.001)
+        release.set()
+        original = leader.exception(5)
+        errors = [f.exception(5) for f in followers]
+
+    assert isinstance(original, OllamaOverloaded)
+    assert len({id(e) for e in errors + [original]}) == 3
+    for error in errors:
+        assert isinstance(error, OllamaOverloaded)
+        assert error.retry_after == 7 and str(error) == 'busy'
+        assert error.__cause__ is original
+
+def test_cancelled_async_leader_keeps_generating_for_followers():
+    flights = SingleFlight()
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'shared text'
+
+    async def scenario():
+        leader = asyncio.ensure_future(flights.run_async('key', generate))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.run_async('key', generate))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower, leader.cancelled()
+
+    assert asyncio.run(scenario()) == ('shared text', True)
+    assert len(calls) == 1
+
+def test_stream_follower_outlives_the_leader_closing():
+    flights = SingleFlight()
+    gate = threading.Event()
+
+    def open_stream():
+        def tokens():
+            yield 'one '
+            gate.wait(5)
+            yield 'two '
+            yield 'three'
+        return tokens()
+
+    leader_tokens, leader = flights.stream('key', open_stream)
+    follower_tokens, follows = flights.stream('key', open_stream)
+    assert leader and not follows
+    assert next(leader_tokens) == 'one '
+    leader_tokens.close()
+    gate.set()
+    assert ''.join(follower_tokens) == 'one two three'
+    follower_tokens.close()
+    assert flights.stats()['in_flight'] == 0
+
+def test_stream_text_completes_after_the_leader_closes():
+    flights = SingleFlight()
+    gate = threading.Event()
+    completed = []
+
+    def open_stream():
+        def tokens():
+            yield 'one '
+            gate.wait(5)
+            yield 'two'
+        return tokens()
+
+    leader_tokens, _ = flights.stream('key', open_stream, on_complete=completed.append)
+    follower_tokens, _ = flights.stream('key', open_stream, on_complete=completed.append)
+    assert next(leader_tokens) == 'one '
+    leader_tokens.close()
+    gate.set()
+    assert ''.join(follower_tokens) == 'one two'
+    assert completed == ['one two']
+
+def test_unshared_stream_completes_only_when_read_to_the_end():
+    completed = []
+    tokens, leader = SingleFlight().stream(None, lambda: (token for token in 'ab'), on_complete=completed.append)
+    assert leader and ''.join(tokens) == 'ab'
+    assert completed == ['ab']
+
+    tokens, _ = SingleFlight().stream(None, lambda: (token for token in 'ab'), on_complete=completed.append)
+    assert next(tokens) == 'a'
+    tokens.close()
+    assert completed == ['ab']
+
+def test_abandoned_stream_stops_upstream():
+    flights = SingleFlight()
+    gate, closed = threading.Event(), threading.Event()
+
+    def open_stream():
+        def tokens():
+            try:
+                yield 'one '
+                gate.wait(5)
+                while True:
+                    yield 'more '
+            finally:
+                closed.set()
+        return tokens()
+
+    tokens, _ = flights.stream('key', open_stream)
+    assert next(tokens) == 'one '
+    tokens.close()
+    gate.set()
+    assert closed.wait(5)
+    assert flights.stats()['abandoned'] == 1
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import summarize
+from doc_store import DocumentStore
+
+def sentences(count, offset=0):
+    return ' '.join(f'Sentence number {i} says something about topic {i}.' for i in range(offset, offset + count))
+
+class Model:
+    def __init__(self, fail_on=None):
+        self.prompts = []
+        self.fail_on = fail_on
+
+    def __call__(self, prompt):
+        self.prompts.append(prompt)
+        if self.fail_on and self.fail_on in prompt:
+            return None
+        return f'summary {len(self.prompts)}'
+
+    def map_calls(self):
+        return [p for p in self.prompts if p.startswith(summarize.MAP_PROMPT[:40])]
+
+def test_section_summaries_are_reused_across_calls():
+    store = DocumentStore()
+    text = sentences(40)
+    first = Model()
+    summarize.map_reduce_prompt(text, first, max_chars=300, store=store, model='m')
+    sections = summarize.split_sections(text, 300)
+    assert len(first.map_calls()) == len(sections)
+
+    again = Model()
+    summarize.map_reduce_prompt(text, again, max_chars=300, store=store, model='m')
+    assert again.map_calls() == []
+
+    # Appending only summarizes the sections that changed
+    appended = Model()
+    summarize.map_reduce_prompt(text + ' ' + sentences(10, offset=40), appended,
+                                max_chars=300, store=store, model='m')
+    assert 0 < len(appended.map_calls()) <= 3
+
+    other_model = Model()
+    summarize.map_reduce_prompt(text, other_model, max_chars=300, store=store, model='other')
+    assert len(other_model.map_calls()) == len(sections)
+
+def test_generated_sections_are_kept_when_one_fails():
+    store = DocumentStore()
+    text = sentences(40)
+    sections = summarize.split_sections(text, 300)
+    failing = Model(fail_on=sections[1])
+    with pytest.raises(summarize.SummaryError):
+        summarize.map_reduce_prompt(text, failing, max_chars=300, store=store, model='m')
+
+    retry = Model()
+    summarize.map_reduce_prompt(text, retry, max_chars=300, store=store, model='m')
+    assert len(retry.map_calls()) == 1
+
+def test_async_uses_the_same_store():
+    store = DocumentStore()
+    text = sentences(40)
+    summarize.map_reduce_prompt(text, Model(), max_chars=300, store=store, model='m')
+
+    model = Model()
+
+    async def generate(prompt):
+        return model(prompt)
+
+    prompt = asyncio.run(summarize.map_reduce_prompt_async(text, generate, max_chars=300,
+                                                           store=store, model='m'))
+    assert prompt.startswith(summarize.REDUCE_PROMPT[:40])
+    assert model.map_calls() == []
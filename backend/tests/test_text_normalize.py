@@ -0,0 +1,30 @@
+# test_text_normalize.py - PDF cleaning and HTML extraction
+from text_normalize import HTMLTextExtractor, clean_pdf_text, extract_html_text
+
+def indented_table(rows: int) -> str:
+    cells = ''.join(f'\n            <tr>\n                <td>row {i} value</td>\n            </tr>' for i in range(rows))
+    return f'<html>\n    <body>\n        <table>{cells}\n        </table>\n    </body>\n</html>'
+
+def test_clean_pdf_text_collapses_junk_and_tightens_punctuation():
+    assert clean_pdf_text('Hello ,  world•\n\tagain .') == 'Hello, world again.'
+
+def test_extract_html_text_drops_scripts_and_separates_blocks():
+    html = '<p>one</p><script>var x = "<p>hidden</p>";</script><div>two<br>three</div>'
+    assert extract_html_text(html) == 'one two three'
+
+def test_whitespace_between_inline_tags_still_separates_words():
+    assert extract_html_text('<span>foo</span> <span>bar</span>') == 'foo bar'
+
+def test_indentation_does_not_count_toward_max_chars():
+    html = indented_table(2000)
+    text = extract_html_text(html, max_chars=10000)
+    assert len(text) == 10000
+    assert text == extract_html_text(html)[:10000]
+
+def test_full_once_max_chars_of_text_are_collected():
+    extractor = HTMLTextExtractor(max_chars=50)
+    extractor.feed(indented_table(3))
+    assert not extractor.full
+    extractor.feed(indented_table(10))
+    assert extractor.full
+    assert len(extractor.text()) == 50
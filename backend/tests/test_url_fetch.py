@@ -0,0 +1,82 @@
+# test_url_fetch.py - Streaming URL imports against a local HTTP server
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from url_fetch import MAX_CHARS, FetchError, PageCache, fetch_page
+
+def indented_page(rows: int) -> bytes:
+    cells = ''.join(f'\n                <tr>\n                    <td>row {i} of the table</td>\n                </tr>'
+                    for i in range(rows))
+    return (f'<!DOCTYPE html>\n<html>\n    <head>\n        <title>Rows</title>\n    </head>\n'
+            f'    <body>\n        <main>\n            <table>{cells}\n            </table>\n'
+            f'        </main>\n    </body>\n</html>\n').encode('utf-8')
+
+PAGES = {'/long': indented_page(3000), '/short': indented_page(20)}
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/trickle':
+            # A few bytes at a time, each well inside the read timeout
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', '100000')
+            self.end_headers()
+            try:
+                for _ in range(50):
+                    self.wfile.write(b'<p>slow</p>')
+                    self.wfile.flush()
+                    time.sleep(0.1)
+            except OSError:
+                pass
+            return
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = PAGES[self.path]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture(scope='module')
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_indented_page_fills_max_chars(server):
+    page = fetch_page(f'{server}/long')
+    assert len(page['text']) == MAX_CHARS
+    assert page['text'].startswith('Rows row 0 of the table row 1 of the table')
+    assert page['truncated']
+    assert page['source_bytes'] == len(PAGES['/long'])
+
+def test_short_indented_page_is_not_truncated(server):
+    page = fetch_page(f'{server}/short')
+    assert page['text'].endswith('row 19 of the table')
+    assert not page['truncated']
+
+def test_not_modified_reuses_cached_text(server):
+    cache = PageCache()
+    first = fetch_page(f'{server}/long', cache=cache)
+    second = fetch_page(f'{server}/long', cache=cache)
+    assert second['not_modified'] and second['bytes_read'] == 0
+    assert second['text'] == first['text'] and second['truncated']
+
+def test_trickling_page_hits_the_deadline(server):
+    start = time.monotonic()
+    with pytest.raises(FetchError, match='longer than'):
+        fetch_page(f'{server}/trickle', deadline=0.5)
+    assert time.monotonic() - start < 2
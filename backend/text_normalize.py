@@ -0,0 +1,111 @@
+# text_normalize.py - Precompiled text cleaning and chunking for PDF and HTML sources
+import re
+from html.parser import HTMLParser
+from typing import Optional
+
+# Characters kept by PDF cleaning: word characters and basic punctuation
+_KEEP = r"""\w.,!?;:()\-'\""""
+# Runs of anything else (whitespace included) longer than one plain space
+_JUNK = re.compile(rf"[^{_KEEP}]{{2,}}|[^{_KEEP} ]")
+_TIGHT_PUNCTUATION = '.,!?;:'
+_WHITESPACE = re.compile(r'\s+')
+
+def clean_pdf_text(text: str) -> str:
+    """Collapse whitespace, drop special characters and fix punctuation spacing
+
+    One regex pass turns every run of whitespace or unsupported characters
+    into a single space (single spaces are left alone, so ordinary text is
+    not rewritten); spaces before punctuation are then removed with
+    str.replace, which scans at C speed.
+    """
+    text = _JUNK.sub(' ', text)
+    for mark in _TIGHT_PUNCTUATION:
+        spaced = ' ' + mark
+        if spaced in text:
+            text = text.replace(spaced, mark)
+    return text.strip()
+
+def chunk_document(content, chunk_size=1000, overlap=200):
+    """Split document into overlapping chunks for better context"""
+    chunks = []
+    start = 0
+    text_length = len(content)
+
+    while start < text_length:
+        end = start + chunk_size
+        chunk = content[start:end]
+        chunks.append(chunk)
+        start = end - overlap  # Overlap for context continuity
+
+    return chunks
+
+class HTMLTextExtractor(HTMLParser):
+    """Incremental HTML-to-text extractor
+
+    Feed markup in pieces as it arrives; text inside script, style and
+    similar elements is dropped as it streams past. Once max_chars of text
+    have been collected the extractor reports full and ignores further input.
+    """
+
+    SKIP_TAGS = {'script', 'style', 'noscript', 'template'}
+    BLOCK_TAGS = {
+        'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt',
+        'figcaption', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header',
+        'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'td', 'th',
+        'title', 'tr', 'ul'
+    }
+
+    def __init__(self, max_chars: Optional[int] = None):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.parts = []
+        self.length = 0
+        self.skip_depth = 0
+
+    @property
+    def full(self) -> bool:
+        return self.max_chars is not None and self.length >= self.max_chars
+
+    def feed(self, data: str):
+        if not self.full:
+            super().feed(data)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append(' ')
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in self.BLOCK_TAGS:
+            self.parts.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append(' ')
+
+    def handle_data(self, data):
+        if self.skip_depth or self.full:
+            return
+        if data.isspace():
+            # Indentation between tags only separates words
+            self.parts.append(' ')
+            return
+        self.parts.append(data)
+        # Count what is left after whitespace is collapsed, so full means
+        # text() really has max_chars
+        self.length += len(_WHITESPACE.sub(' ', data).strip())
+
+    def text(self) -> str:
+        """Extracted text with whitespace collapsed"""
+        text = _WHITESPACE.sub(' ', ''.join(self.parts)).strip()
+        return text[:self.max_chars] if self.max_chars is not None else text
+
+def extract_html_text(html: str, max_chars: Optional[int] = None) -> str:
+    """Visible text of an HTML document"""
+    extractor = HTMLTextExtractor(max_chars)
+    extractor.feed(html)
+    extractor.close()
+    return extractor.text()
@@ -0,0 +1,193 @@
+# url_fetch.py - Streaming, size-capped web page fetching with a conditional-request cache
+import codecs
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import requests
+import urllib3
+
+from text_normalize import HTMLTextExtractor
+
+MAX_BYTES = int(os.environ.get('URL_MAX_BYTES', 5 * 1024 * 1024))
+MAX_CHARS = 10000
+# Seconds a whole fetch may take; the read timeout alone lets a trickling server hold it for much longer
+DEADLINE = float(os.environ.get('URL_FETCH_DEADLINE', 30))
+CHUNK_BYTES = 64 * 1024
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+class FetchError(Exception):
+    """Raised when a page cannot be fetched"""
+
+class PageCache:
+    """Extracted page text keyed by URL, with the validators needed to revalidate it
+
+    Only responses carrying an ETag or Last-Modified header are stored; the
+    oldest entries are dropped beyond max_entries. Pass path=None for memory only.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.counters = {'lookups': 0, 'not_modified': 0, 'modified': 0, 'stored': 0}
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path or ':memory:', check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_hash TEXT, '
+            'text TEXT, truncated INTEGER, fetched_at REAL)'
+        )
+        self.db.commit()
+
+    @classmethod
+    def from_env(cls) -> 'PageCache':
+        """Build a cache from URL_CACHE_* environment variables"""
+        path = os.environ.get('URL_CACHE_PATH',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'url_cache.db'))
+        return cls(path=path or None, max_entries=int(os.environ.get('URL_CACHE_SIZE', 1000)))
+
+    def get(self, url: str) -> Optional[Dict]:
+        with self.lock:
+            self.counters['lookups'] += 1
+            row = self.db.execute(
+                'SELECT etag, last_modified, content_hash, text, truncated FROM pages WHERE url = ?', (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'etag': row[0], 'last_modified': row[1], 'content_hash': row[2],
+                'text': row[3], 'truncated': bool(row[4])}
+
+    def put(self, url: str, page: Dict):
+        with self.lock:
+            self.counters['stored'] += 1
+            self.db.execute(
+                'INSERT OR REPLACE INTO pages (url, etag, last_modified, content_hash, text, truncated, fetched_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, page['etag'], page['last_modified'], page['content_hash'],
+                 page['text'], int(page['truncated']), time.time())
+            )
+            self.db.execute(
+                'DELETE FROM pages WHERE url NOT IN (SELECT url FROM pages ORDER BY fetched_at DESC LIMIT ?)',
+                (self.max_entries,)
+            )
+            self.db.commit()
+
+    def touch(self, url: str):
+        """Record a successful revalidation"""
+        with self.lock:
+            self.counters['not_modified'] += 1
+            self.db.execute('UPDATE pages SET fetched_at = ? WHERE url = ?', (time.time(), url))
+            self.db.commit()
+
+    def count(self, counter: str):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def stats(self) -> Dict:
+        with self.lock:
+            data = dict(self.counters)
+            data['entries'] = self.db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+        data['max_entries'] = self.max_entries
+        return data
+
+def fetch_page(url: str, cache: Optional[PageCache] = None, max_bytes: int = MAX_BYTES,
+               max_chars: int = MAX_CHARS, timeout: float = 10, deadline: float = DEADLINE,
+               progress: Optional[Callable] = None) -> Dict:
+    """Fetch a page and return its visible text
+
+    The body is streamed into the HTML extractor and reading stops once
+    max_bytes have arrived or max_chars of text have been collected. A fetch
+    still reading after deadline seconds raises FetchError. When a cached
+    copy has validators, a conditional GET is sent and a 304 reuses the
+    cached text without downloading or extracting anything.
+
+    Returns a dict with text, content_hash (SHA-256 of the bytes read),
+    bytes_read, source_bytes (the declared Content-Length, if any),
+    truncated and not_modified.
+    """
+    give_up_at = time.monotonic() + deadline
+    headers = {'User-Agent': USER_AGENT}
+    cached = cache.get(url) if cache else None
+    if cached:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    with requests.get(url, timeout=timeout, headers=headers, stream=True) as response:
+        if response.status_code == 304 and cached:
+            cache.touch(url)
+            return {
+                'text': cached['text'],
+                'content_hash': cached['content_hash'],
+                'bytes_read': 0,
+                'source_bytes': None,
+                'truncated': cached['truncated'],
+                'not_modified': True
+            }
+
+        if response.status_code != 200:
+            raise FetchError(f'Failed to fetch URL: {response.status_code}')
+
+        if cached:
+            cache.count('modified')
+
+        # Without a declared charset, HTML is far more often UTF-8 than Latin-1
+        charset = response.encoding if 'charset' in response.headers.get('Content-Type', '').lower() else None
+        try:
+            decoder = codecs.getincrementaldecoder(charset or 'utf-8')(errors='replace')
+        except LookupError:
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+        extractor = HTMLTextExtractor(max_chars)
+        digest = hashlib.sha256()
+        bytes_read = 0
+        truncated = False
+        try:
+            while True:
+                if time.monotonic() > give_up_at:
+                    raise FetchError(f'URL took longer than {deadline:g}s to download')
+                # read1 returns whatever has arrived instead of waiting for a
+                # full chunk, so a trickling body still reaches the check above
+                chunk = response.raw.read1(CHUNK_BYTES, decode_content=True)
+                if not chunk:
+                    break
+                chunk = chunk[:max_bytes - bytes_read]
+                digest.update(chunk)
+                bytes_read += len(chunk)
+                extractor.feed(decoder.decode(chunk))
+                if progress:
+                    progress(bytes_read=bytes_read)
+                if bytes_read >= max_bytes or extractor.full:
+                    truncated = True
+                    break
+        except urllib3.exceptions.ReadTimeoutError as e:
+            raise requests.ReadTimeout(e)
+        except urllib3.exceptions.HTTPError as e:
+            raise FetchError(f'Reading URL failed: {e}')
+
+        extractor.feed(decoder.decode(b'', final=True))
+        extractor.close()
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        declared = response.headers.get('Content-Length', '')
+
+    page = {
+        'text': extractor.text(),
+        'content_hash': digest.hexdigest(),
+        'bytes_read': bytes_read,
+        'source_bytes': int(declared) if declared.isdigit() else None,
+        'truncated': truncated,
+        'not_modified': False
+    }
+    if cache and (etag or last_modified):
+        cache.put(url, dict(page, etag=etag, last_modified=last_modified))
+    return page
@@ -19,6 +19,24 @@ const getBackendUrl = () => {
 
 const BACKEND_URL = getBackendUrl();
 
+// Uploads are processed in the background; poll the job until it finishes
+const waitForJob = async (jobId) => {
+  while (true) {
+    const response = await fetch(`${BACKEND_URL}/api/jobs/${jobId}`);
+    const job = await response.json();
+    if (!response.ok) {
+      throw new Error(job.error || 'Job lookup failed');
+    }
+    if (job.status === 'done') {
+      return job.result;
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error);
+    }
+    await new Promise((resolve) => setTimeout(resolve, 1000));
+  }
+};
+
 function App() {
   const [selectedFile, setSelectedFile] = useState(null);
   const [uploadedDoc, setUploadedDoc] = useState(null);
@@ -50,7 +68,7 @@ function App() {
         });
 
         if (response.ok) {
-          const data = await response.json();
+          const data = await waitForJob((await response.json()).job_id);
           setUploadedDoc({
             id: data.document_id,
             filename: data.filename,
@@ -287,7 +305,7 @@ function App() {
                               });
 
                               if (response.ok) {
-                                const data = await response.json();
+                                const data = await waitForJob((await response.json()).job_id);
                                 setUploadedDoc({
                                   id: data.document_id,
                                   filename: data.domain,